@@ -0,0 +1,96 @@
+"""面向高延迟存储（SMB/NFS 等网络共享）的异步批量导出
+
+网络共享上每次 open、stat 和小块读取都有毫秒级延迟，逐张同步打开图片会把这些延迟串起来。
+这里用 asyncio 调度：同时预读多张源图片的全部内容（数量可配置），在内存中解码、添加水印和编码，
+再交给写入线程池原子写出。解码和编码在单独的线程池中进行（Pillow 处理图片时释放GIL）。
+"""
+import os
+import io
+import time
+import asyncio
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+from watermark_core import write_bytes_atomic
+
+# 默认同时进行中的图片数（预读、渲染、写入各阶段合计）
+DEFAULT_IO_IN_FLIGHT = 16
+
+
+def read_file_bytes(path):
+    """按文件大小一次请求读入整个文件（网络存储上比默认的分块读取往返次数少得多）"""
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        # 读取期间文件变大时继续读完剩余部分
+        return f.read(size) + f.read()
+
+
+def _write_output(data, output_path):
+    """写入一个已编码的输出文件"""
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    write_bytes_atomic(data, output_path)
+
+
+def _render_in_memory(exporter, input_path, data, pending):
+    """从内存中的源文件解码并生成所有输出，返回 ([(输出项, 编码后的数据)], 输入内容哈希)"""
+    input_digest = hashlib.sha256(data).hexdigest() if exporter.use_manifest else None
+    image, source_encoding = exporter.decode(io.BytesIO(data))
+    text_context = exporter.text_context(input_path, image)
+    return exporter.encode_outputs(image, source_encoding, pending, text_context), input_digest
+
+
+def run_async_pipeline(exporter, image_paths, result, journal, tracker, workers, io_in_flight, cancelled, after_item):
+    """用 asyncio 驱动 BatchExporter 导出 image_paths（在调用线程中运行事件循环直到完成）"""
+    asyncio.run(_run_pipeline(exporter, image_paths, result, journal, tracker, workers,
+                              max(1, io_in_flight), cancelled, after_item))
+
+
+async def _run_pipeline(exporter, image_paths, result, journal, tracker, workers, io_in_flight, cancelled, after_item):
+    loop = asyncio.get_running_loop()
+    io_pool = ThreadPoolExecutor(max_workers=io_in_flight, thread_name_prefix='watermark-io')
+    cpu_pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='watermark-render')
+    # 同时进行中的图片数上限，也限制了预读到内存中的源文件数量
+    slots = asyncio.Semaphore(io_in_flight)
+
+    def run_io(func, *args):
+        return loop.run_in_executor(io_pool, func, *args)
+
+    async def process(input_path):
+        start = time.perf_counter()
+        error = None
+        num_bytes = 0
+        try:
+            # 检查清单也要 stat 输入和输出文件，同样放到I/O线程池
+            pending = await run_io(exporter.pending_outputs, input_path, result)
+            if pending:
+                data = await run_io(read_file_bytes, input_path)
+                num_bytes = len(data)
+                encoded, input_digest = await loop.run_in_executor(cpu_pool, _render_in_memory, exporter, input_path, data, pending)
+                del data
+                await asyncio.gather(*(run_io(_write_output, blob, entry["output_path"]) for entry, blob in encoded))
+                await run_io(exporter.record_outputs, input_path, pending, result, input_digest)
+        except Exception as e:
+            error = e
+        try:
+            await run_io(exporter.finish_item, input_path, result, journal, tracker, start, error, num_bytes)
+            # 进度回调与多线程方式一样只在调用线程（事件循环所在线程）中调用，回调不必考虑并发
+            after_item()
+        finally:
+            slots.release()
+
+    tasks = set()
+    try:
+        for input_path in image_paths:
+            await slots.acquire()
+            if cancelled():
+                slots.release()
+                break
+            task = asyncio.create_task(process(input_path))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        # 取消后等待进行中的图片完成
+        if tasks:
+            await asyncio.gather(*tasks)
+    finally:
+        io_pool.shutdown(wait=True)
+        cpu_pool.shutdown(wait=True)
@@ -0,0 +1,163 @@
+import time
+import threading
+import traceback
+
+from PyQt5.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QLabel, QProgressBar, QPushButton
+from PyQt5.QtGui import QImage
+from PyQt5.QtCore import Qt, QThread, QTimer, pyqtSignal
+
+from task_progress import format_progress
+
+
+def pil_to_qimage_copy(pil_image):
+    """在任意线程中将RGB格式的PIL图片转换为独立内存的QImage（QPixmap只能在主线程创建）"""
+    if pil_image.mode != 'RGB':
+        pil_image = pil_image.convert('RGB')
+    width, height = pil_image.size
+    data = pil_image.tobytes('raw', 'RGB')
+    return QImage(data, width, height, 3 * width, QImage.Format_RGB888).copy()
+
+
+class BackgroundTask(QThread):
+    """在后台线程中执行耗时操作，通过排队信号向界面报告进度
+
+    func(task) 在后台线程中执行，可以调用 task.report(tracker) 报告进度、
+    task.item_ready.emit(obj) 逐项返回结果，并通过 task.is_cancelled() 检查是否被取消。
+    """
+
+    progress = pyqtSignal(dict)  # 进度统计（ProgressTracker.snapshot）
+    item_ready = pyqtSignal(object)  # 单项结果
+    succeeded = pyqtSignal(object)  # 最终结果
+    failed = pyqtSignal(str)  # 错误信息
+
+    # 进度刷新的最小间隔（秒），避免信号过多拖慢界面
+    REFRESH_INTERVAL = 0.1
+
+    def __init__(self, title, func, parent=None):
+        super().__init__(parent)
+        self.title = title
+        self.func = func
+        self.cancel_event = threading.Event()
+        self._last_report = 0.0
+        self._last_tracker = None
+
+    def cancel(self):
+        """请求取消（正在处理的项目完成后停止）"""
+        self.cancel_event.set()
+
+    def is_cancelled(self):
+        return self.cancel_event.is_set()
+
+    def report(self, tracker, force=False):
+        """报告进度（按刷新间隔节流）"""
+        self._last_tracker = tracker
+        now = time.perf_counter()
+        if force or now - self._last_report >= self.REFRESH_INTERVAL:
+            self._last_report = now
+            self.progress.emit(tracker.snapshot())
+
+    def run(self):
+        try:
+            result = self.func(self)
+            if self._last_tracker is not None:
+                # 保证最后一次进度一定送达
+                self.report(self._last_tracker, force=True)
+            self.succeeded.emit(result)
+        except Exception as e:
+            traceback.print_exc()
+            self.failed.emit(str(e))
+
+
+class ProgressRow(QWidget):
+    """进度面板中的一行：标题、进度条、统计信息和取消按钮"""
+
+    def __init__(self, task, parent=None):
+        super().__init__(parent)
+        self.task = task
+        layout = QVBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+
+        top_layout = QHBoxLayout()
+        self.title_label = QLabel(task.title)
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setRange(0, 0)  # 总数未知前显示忙碌状态
+        self.cancel_button = QPushButton('取消')
+        self.cancel_button.clicked.connect(self.on_cancel_clicked)
+        top_layout.addWidget(self.title_label)
+        top_layout.addWidget(self.progress_bar, 1)
+        top_layout.addWidget(self.cancel_button)
+        layout.addLayout(top_layout)
+
+        self.stats_label = QLabel('')
+        layout.addWidget(self.stats_label)
+
+        task.progress.connect(self.on_progress, Qt.QueuedConnection)
+
+    def on_cancel_clicked(self):
+        self.task.cancel()
+        self.cancel_button.setEnabled(False)
+        self.cancel_button.setText('正在取消...')
+
+    def on_progress(self, stats):
+        """更新进度显示"""
+        if stats['total'] > 0:
+            self.progress_bar.setRange(0, stats['total'])
+            self.progress_bar.setValue(stats['done'])
+        self.stats_label.setText(format_progress(stats))
+
+    def finish(self, message):
+        """任务结束后显示结果"""
+        self.cancel_button.setEnabled(False)
+        self.progress_bar.setRange(0, 1)
+        self.progress_bar.setValue(1)
+        self.stats_label.setText(message)
+
+
+class ProgressPanel(QWidget):
+    """后台任务进度面板（无任务时自动隐藏）"""
+
+    # 任务结束后结果保留显示的时间（毫秒）
+    LINGER_MS = 4000
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.layout = QVBoxLayout(self)
+        self.layout.setContentsMargins(0, 0, 0, 0)
+        self.rows = {}
+        self.hide()
+
+    def start_task(self, task):
+        """添加任务并开始执行"""
+        row = ProgressRow(task, self)
+        self.rows[task] = row
+        self.layout.addWidget(row)
+        task.finished.connect(lambda: QTimer.singleShot(self.LINGER_MS, lambda: self._remove(task)))
+        self.show()
+        task.start()
+        return task
+
+    def finish_task(self, task, message):
+        """显示任务的结束信息"""
+        row = self.rows.get(task)
+        if row is not None:
+            row.finish(message)
+
+    def running_tasks(self):
+        return [task for task in self.rows if task.isRunning()]
+
+    def cancel_all(self, wait=True):
+        """取消所有任务（关闭窗口时调用）"""
+        for task in list(self.rows):
+            task.cancel()
+        if wait:
+            for task in list(self.rows):
+                task.wait()
+
+    def _remove(self, task):
+        row = self.rows.pop(task, None)
+        if row is not None:
+            self.layout.removeWidget(row)
+            row.deleteLater()
+        task.deleteLater()
+        if not self.rows:
+            self.hide()
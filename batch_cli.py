@@ -0,0 +1,224 @@
+"""无界面的命令行批量导出（供定时任务、CI使用）
+
+按程序保存的模板JSON（save_template 写出的格式）给输入图片添加水印并导出到输出目录，
+不需要图形界面。进度和结果以每行一个JSON对象输出到标准输出，便于脚本解析：
+
+    {"event": "start", "total": 120, ...}
+    {"event": "progress", "done": 40, "total": 120, "images_per_sec": 8.1, ...}
+    {"event": "failed", "input": "a.jpg", "error": "..."}
+    {"event": "summary", "rendered": 118, "skipped": 0, "failed": 2, ...}
+    {"event": "error", "message": "..."}          （无法执行时）
+
+其他诊断信息（例如单张图片的错误详情）输出到标准错误。
+退出码：0 全部成功，1 部分图片失败，2 参数错误，3 没有匹配的图片，4 无法执行（模板无法读取等），
+130 被中断（SIGINT/SIGTERM，正在处理的图片完成后退出）。
+
+用法：
+    python batch_cli.py --template 模板.json --output 输出目录 [--format JPEG] [--quality 90] [--workers 4] 图片或通配符 ...
+"""
+import os
+import sys
+import json
+import time
+import signal
+import argparse
+import threading
+
+import watermark_core
+from batch_export import BatchExporter, BATCH_MODE_NAMES, default_worker_count
+from batch_scheduler import DEFAULT_MEMORY_BUDGET_MB
+from renditions import DEFAULT_RENDITIONS
+from work_queue import expand_inputs
+
+EXIT_OK = 0
+EXIT_FAILED_ITEMS = 1
+EXIT_USAGE = 2  # argparse 参数错误时的退出码
+EXIT_NO_INPUTS = 3
+EXIT_ERROR = 4
+EXIT_CANCELLED = 130
+
+EXPORT_FORMATS = ("JPEG", "PNG", "WEBP")
+
+
+# JSON事件输出到的流（运行期间标准输出被重定向到标准错误，避免诊断信息混入事件）
+_event_stream = None
+
+
+def emit(event, stream=None, **fields):
+    """输出一行JSON事件"""
+    stream = stream or _event_stream or sys.stdout
+    stream.write(json.dumps(dict(event=event, **fields), ensure_ascii=False) + "\n")
+    stream.flush()
+
+
+def load_template(template_path):
+    """读取模板JSON，返回设置字典"""
+    with open(template_path, 'r', encoding='utf-8') as f:
+        template = json.load(f)
+    if not isinstance(template, dict):
+        raise ValueError("模板文件格式不正确")
+    return template
+
+
+def build_settings(template, export_format=None, quality=None):
+    """在模板设置上应用命令行中指定的导出格式和质量"""
+    settings = dict(template)
+    settings.pop("name", None)
+    if export_format:
+        settings["export_format"] = export_format
+    if quality is not None:
+        settings["export_quality"] = quality
+    return watermark_core.normalize_settings(settings)
+
+
+def _progress_reporter(interval):
+    """返回按时间间隔节流的进度回调"""
+    last_report = [0.0]
+
+    def report(tracker):
+        now = time.perf_counter()
+        if now - last_report[0] >= interval or tracker.done >= tracker.total:
+            last_report[0] = now
+            emit("progress", **tracker.snapshot())
+    return report
+
+
+def run_batch(image_paths, settings, output_dir, workers=1, mode="threads", memory_budget_mb=0,
+              renditions=None, incremental=True, progress_interval=1.0, cancel_event=None,
+              templates_dir=watermark_core.DEFAULT_TEMPLATES_DIR):
+    """执行批量导出并输出JSON事件，返回 BatchResult
+
+    templates_dir 为多规格配置中按名称引用的模板所在的目录。
+    """
+    font_name_to_path = None
+    if watermark_core.needs_fonts(settings):
+        # 模板中的字体按显示名称保存，需要系统字体映射才能找到文件
+        _, font_name_to_path = watermark_core.scan_system_fonts()
+    os.makedirs(output_dir, exist_ok=True)
+    watermark_core.remove_stale_temp_files(output_dir)
+
+    exporter = BatchExporter(settings, output_dir, font_name_to_path, incremental=incremental,
+                             renditions=renditions, templates_dir=templates_dir)
+    emit("start", total=len(image_paths), output=os.path.abspath(output_dir), workers=workers, mode=mode)
+    return exporter.run(
+        image_paths,
+        progress_callback=_progress_reporter(progress_interval) if progress_interval >= 0 else None,
+        workers=workers, cancel_event=cancel_event, memory_budget_mb=memory_budget_mb,
+        use_processes=(mode == "processes"), async_io=(mode == "async_io"),
+    )
+
+
+def exit_code_for(result):
+    """按导出结果返回退出码"""
+    if result.cancelled:
+        return EXIT_CANCELLED
+    if result.failed:
+        return EXIT_FAILED_ITEMS
+    return EXIT_OK
+
+
+def _install_signal_handlers(cancel_event):
+    """SIGINT/SIGTERM 时请求取消（正在处理的图片完成后退出），再次收到时立即退出"""
+    def handle(signum, frame):
+        if cancel_event.is_set():
+            raise KeyboardInterrupt
+        cancel_event.set()
+    signal.signal(signal.SIGINT, handle)
+    if hasattr(signal, 'SIGTERM'):
+        signal.signal(signal.SIGTERM, handle)
+
+
+def _quality(value):
+    quality = int(value)
+    if not 1 <= quality <= 100:
+        raise argparse.ArgumentTypeError("质量应在 1-100 之间")
+    return quality
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='无界面批量添加水印并导出')
+    parser.add_argument('inputs', nargs='+', help='图片路径、通配符或文件夹')
+    parser.add_argument('--template', required=True, help='模板JSON文件（与程序保存的模板格式相同）')
+    parser.add_argument('--output', required=True, help='输出目录')
+    parser.add_argument('--format', choices=EXPORT_FORMATS, type=str.upper, help='导出格式（默认使用模板中的设置）')
+    parser.add_argument('--quality', type=_quality, metavar='1-100',
+                        help='JPEG/WebP 质量（默认使用模板中的设置）')
+    parser.add_argument('--workers', type=int, default=default_worker_count(), help='并行数（默认CPU核心数）')
+    parser.add_argument('--mode', choices=sorted(BATCH_MODE_NAMES), default='threads',
+                        help='处理方式：threads 多线程，processes 多进程，async_io 异步读写（网络共享）')
+    parser.add_argument('--memory-budget', type=int, default=DEFAULT_MEMORY_BUDGET_MB,
+                        help='内存预算（MB，0 表示不限制）')
+    parser.add_argument('--renditions', action='store_true',
+                        help='按模板中的多规格配置导出（模板中没有时使用默认规格）')
+    parser.add_argument('--templates-dir', default=watermark_core.DEFAULT_TEMPLATES_DIR,
+                        help='多规格配置中按名称引用的模板所在的目录（默认为程序保存模板的目录）')
+    parser.add_argument('--force', action='store_true', help='重新导出所有图片（不跳过未变化的图片）')
+    parser.add_argument('--progress-interval', type=float, default=1.0,
+                        help='进度输出间隔（秒，负数表示不输出进度）')
+    return parser
+
+
+def main(argv=None):
+    global _event_stream
+    args = build_parser().parse_args(argv)
+    _event_stream = sys.stdout
+    sys.stdout = sys.stderr
+    try:
+        return _main(args)
+    finally:
+        sys.stdout = _event_stream
+        _event_stream = None
+
+
+def _main(args):
+    try:
+        template = load_template(args.template)
+    except (OSError, ValueError) as e:
+        emit("error", message=f"读取模板时出错: {e}")
+        return EXIT_ERROR
+    settings = build_settings(template, args.format, args.quality)
+    renditions = None
+    if args.renditions:
+        renditions = template.get("renditions") or DEFAULT_RENDITIONS
+
+    image_paths = expand_inputs(args.inputs)
+    if not image_paths:
+        emit("error", message="没有匹配的图片")
+        return EXIT_NO_INPUTS
+
+    cancel_event = threading.Event()
+    _install_signal_handlers(cancel_event)
+    try:
+        result = run_batch(
+            image_paths, settings, args.output, workers=max(1, args.workers), mode=args.mode,
+            memory_budget_mb=args.memory_budget, renditions=renditions, incremental=not args.force,
+            progress_interval=args.progress_interval, cancel_event=cancel_event,
+            templates_dir=args.templates_dir,
+        )
+    except KeyboardInterrupt:
+        emit("error", message="已中断")
+        return EXIT_CANCELLED
+    except Exception as e:
+        emit("error", message=f"批量导出时出错: {e}")
+        return EXIT_ERROR
+
+    for input_path, error in result.failed:
+        emit("failed", input=input_path, error=error)
+    stats = result.stats or {}
+    emit(
+        "summary",
+        total=len(image_paths),
+        rendered=len(result.rendered),
+        skipped=len(result.skipped),
+        failed=len(result.failed),
+        cancelled=result.cancelled,
+        elapsed=stats.get("elapsed"),
+        images_per_sec=stats.get("images_per_sec"),
+        utilization=stats.get("utilization"),
+        peak_rss_mb=stats.get("peak_rss_mb"),
+    )
+    return exit_code_for(result)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
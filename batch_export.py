@@ -0,0 +1,390 @@
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from watermark_core import (
+    normalize_settings, settings_hash, generate_output_filename, load_source, has_watermark, has_text_tokens,
+    get_text_context, add_watermark_to_image, save_image_atomic, encode_image, file_sha256
+)
+from export_manifest import ExportManifest
+from renditions import RenditionPlan, load_source_for_plan
+from task_progress import ProgressTracker
+from batch_scheduler import MemoryBudget, order_largest_first, peak_rss_mb
+# async_export（asyncio）、shared_frames 和进程池（multiprocessing）只在对应导出方式中用到，
+# 在使用时再导入，界面和命令行启动时不必加载
+
+
+def default_worker_count():
+    """默认的并行导出数（Pillow解码、缩放和编码时会释放GIL，线程可以并行；内存由内存预算限制）"""
+    return max(1, os.cpu_count() or 1)
+
+
+# 批量导出方式（界面显示名称）：多线程、多进程（共享内存传递图片）、异步读写（网络共享等高延迟存储）
+BATCH_MODE_NAMES = {
+    "threads": "多线程",
+    "processes": "多进程（大图、多核）",
+    "async_io": "异步读写（网络共享）",
+}
+
+
+class BatchResult:
+    """批量导出结果统计"""
+
+    def __init__(self):
+        self.rendered = []  # 重新渲染的输出文件
+        self.skipped = []  # 已是最新而跳过的输出文件
+        self.failed = []  # (输入文件, 错误信息)
+        self.cancelled = False  # 是否被用户取消
+        self.stats = None  # 结束时的吞吐量、利用率和内存统计
+
+    @property
+    def total(self):
+        return len(self.rendered) + len(self.skipped) + len(self.failed)
+
+    def summary(self):
+        """返回可读的统计摘要"""
+        text = f"已渲染 {len(self.rendered)} 张，跳过 {len(self.skipped)} 张（未变化）"
+        if self.failed:
+            text += f"，失败 {len(self.failed)} 张"
+        if self.cancelled:
+            text += "（已取消）"
+        if self.stats:
+            text += f"，利用率 {self.stats['utilization'] * 100:.0f}%"
+            if self.stats.get("peak_rss_mb") is not None:
+                text += f"，峰值内存 {self.stats['peak_rss_mb']:.0f} MB"
+        return text
+
+
+# 每完成多少张图片保存一次导出清单
+MANIFEST_SAVE_INTERVAL = 100
+
+
+class BatchExporter:
+    """批量导出器：使用输出目录中的清单实现增量导出
+
+    指定 renditions 时进入多规格模式：每张源图只解码一次，生成配置中的所有规格。
+    use_manifest 为 False 时不读写清单（多个进程同时写同一目录时使用，避免清单互相覆盖）。
+    """
+
+    def __init__(self, settings, export_dir, font_name_to_path=None, incremental=True,
+                 renditions=None, templates_dir=None, use_manifest=True):
+        self.settings = normalize_settings(settings)
+        self.export_dir = export_dir
+        self.font_name_to_path = font_name_to_path
+        self.use_manifest = use_manifest
+        self.incremental = incremental and use_manifest
+        self.settings_digest = settings_hash(self.settings)
+        self.renditions = renditions
+        self.templates_dir = templates_dir
+        self.manifests = {}  # 输出目录 -> ExportManifest
+        self._lock = threading.Lock()  # 保护清单和任务日志（多线程导出时）
+        self.rendition_plan = None
+        if renditions:
+            self.rendition_plan = RenditionPlan(renditions, self.settings, templates_dir, font_name_to_path)
+        # 文本水印中有变量时，每张图片按文件名、序号和EXIF填写（序号按 run 传入的图片顺序，从1开始）
+        if self.rendition_plan is None:
+            self.uses_text_tokens = has_text_tokens(self.settings)
+        else:
+            self.uses_text_tokens = any(has_text_tokens(item["settings"]) for item in self.rendition_plan.items)
+        self.image_indices = {}  # 图片路径 -> 序号
+
+    def _get_manifest(self, output_path):
+        """获取输出文件所在目录的清单（保存到原目录时每个目录各有一份）"""
+        if not self.use_manifest:
+            return None
+        output_dir = os.path.dirname(os.path.abspath(output_path))
+        with self._lock:
+            if output_dir not in self.manifests:
+                self.manifests[output_dir] = ExportManifest(output_dir)
+            return self.manifests[output_dir]
+
+    def _is_up_to_date(self, manifest, input_path, digest, output_path):
+        """线程安全地检查输出是否已是最新"""
+        if not self.incremental:
+            return False
+        with self._lock:
+            return manifest.is_up_to_date(input_path, digest, output_path)
+
+    def _record(self, manifest, input_path, digest, output_path, input_digest):
+        """线程安全地记录导出结果（内容哈希在锁外计算）"""
+        if manifest is None:
+            return
+        with self._lock:
+            manifest.record(input_path, digest, output_path, input_digest)
+
+    def pending_outputs(self, input_path, result):
+        """列出需要重新渲染的输出，已是最新的输出记入 result.skipped
+
+        返回 [{"name", "settings", "digest", "output_path"}]，单规格模式下 name 为 None。
+        """
+        if self.rendition_plan is None:
+            targets = [(None, self.settings, self.settings_digest)]
+        else:
+            targets = [(item["rendition"]["name"], item["settings"], item["digest"]) for item in self.rendition_plan.items]
+        pending = []
+        for name, settings, digest in targets:
+            output_path = generate_output_filename(input_path, settings, self.export_dir)
+            if self._is_up_to_date(self._get_manifest(output_path), input_path, digest, output_path):
+                result.skipped.append(output_path)
+            else:
+                pending.append({"name": name, "settings": settings, "digest": digest, "output_path": output_path})
+        return pending
+
+    def decode(self, input_path):
+        """解码源图片（也可以是已读入内存的文件对象），返回 (图片, JPEG编码参数或None)
+
+        多规格模式下只解码到最大规格需要的尺寸。
+        """
+        if self.rendition_plan is None:
+            return load_source(input_path)
+        return load_source_for_plan(input_path, self.rendition_plan)
+
+    def text_context(self, input_path, image, index=None):
+        """填写文本变量的值（需要在解码后、添加水印前取得，EXIF来自解码的源图片）；设置中没有变量时返回 None"""
+        if not self.uses_text_tokens:
+            return None
+        if index is None and isinstance(input_path, (str, os.PathLike)):
+            index = self.image_indices.get(input_path)
+        return get_text_context(input_path, index, image)
+
+    def rendered_outputs(self, image, pending, text_context=None):
+        """为已解码的图片添加水印，返回 [(输出项, 图片)]"""
+        if self.rendition_plan is None:
+            entry = pending[0]
+            if has_watermark(entry["settings"]):
+                image = add_watermark_to_image(image, entry["settings"], font_name_to_path=self.font_name_to_path,
+                                               text_context=text_context)
+            return [(entry, image)]
+        # 只生成未更新的规格（跳过的规格仍参与缩小链）
+        entries = {entry["name"]: entry for entry in pending}
+        return [(entries[item["rendition"]["name"]], output)
+                for item, output in self.rendition_plan.render(image, needed=set(entries), text_context=text_context)]
+
+    def render_outputs(self, image, source_encoding, pending, text_context=None):
+        """为已解码的图片添加水印并写入 pending 中的输出，返回输出文件列表"""
+        written = []
+        for entry, output in self.rendered_outputs(image, pending, text_context):
+            os.makedirs(os.path.dirname(entry["output_path"]), exist_ok=True)
+            save_image_atomic(output, entry["output_path"], entry["settings"], source_encoding)
+            written.append(entry["output_path"])
+        return written
+
+    def encode_outputs(self, image, source_encoding, pending, text_context=None):
+        """为已解码的图片添加水印并编码到内存，返回 [(输出项, 编码后的数据)]，由调用方写入"""
+        return [(entry, encode_image(output, entry["settings"], source_encoding))
+                for entry, output in self.rendered_outputs(image, pending, text_context)]
+
+    def record_outputs(self, input_path, pending, result, input_digest=None):
+        """把已写入的输出记入清单和结果（input_digest 为已知的输入内容哈希）"""
+        if input_digest is None and self.use_manifest:
+            input_digest = file_sha256(input_path)
+        for entry in pending:
+            self._record(self._get_manifest(entry["output_path"]), input_path, entry["digest"],
+                         entry["output_path"], input_digest)
+            result.rendered.append(entry["output_path"])
+
+    def export_one(self, input_path, result, index=None):
+        """导出单张图片（多规格模式下一次解码导出所有规格），已是最新的输出跳过
+
+        index 为填写 {index} 变量的序号，不提供时使用 run 传入的图片顺序。
+        """
+        pending = self.pending_outputs(input_path, result)
+        if not pending:
+            return
+        image, source_encoding = self.decode(input_path)
+        self.render_outputs(image, source_encoding, pending, self.text_context(input_path, image, index))
+        self.record_outputs(input_path, pending, result)
+
+    def save_manifests(self):
+        """保存所有输出目录的清单"""
+        for manifest in self.manifests.values():
+            try:
+                manifest.save()
+            except Exception as e:
+                print(f"保存导出清单时出错: {e}")
+
+    def finish_item(self, input_path, result, journal, tracker, start, error=None, num_bytes=None):
+        """提交一张图片到任务日志（出错时记为失败），统计耗时；num_bytes 为已知的输入文件大小"""
+        if error is None and journal is not None:
+            try:
+                with self._lock:
+                    journal.mark_done(input_path)
+            except Exception as e:
+                error = e
+        if error is not None:
+            print(f"导出 {input_path} 时出错: {error}")
+            result.failed.append((input_path, str(error)))
+        if num_bytes is None:
+            try:
+                num_bytes = os.path.getsize(input_path)
+            except OSError:
+                num_bytes = 0
+        tracker.item_done(num_bytes, time.perf_counter() - start)
+
+    def _process(self, input_path, result, journal, tracker):
+        """导出一张图片并提交到任务日志"""
+        start = time.perf_counter()
+        error = None
+        try:
+            self.export_one(input_path, result)
+        except Exception as e:
+            error = e
+        self.finish_item(input_path, result, journal, tracker, start, error)
+
+    def _run_processes(self, scheduled, budget, result, journal, tracker, processes, cancelled, after_item):
+        """多进程导出：本进程解码，像素经共享内存交给渲染进程添加水印、编码和写入
+
+        进程间只传递共享内存块的描述信息，不复制像素。共享内存块比渲染进程多一个，
+        渲染进程忙碌时本进程可以提前解码下一张图片。scheduled 为 [(图片路径, 估算内存)]。
+        """
+        from concurrent.futures import ProcessPoolExecutor
+        from shared_frames import SharedFramePool, write_frame
+
+        init_args = (self.settings, self.export_dir, self.font_name_to_path, self.renditions, self.templates_dir)
+        with SharedFramePool(processes + 1) as pool, ProcessPoolExecutor(
+                max_workers=processes, initializer=_init_render_process, initargs=init_args) as executor:
+            queue = iter(scheduled)
+            next_item = next(queue, None)
+            running = {}  # future -> (输入文件, 待写入的输出, 共享内存描述, 估算内存, 开始时间)
+            while True:
+                while (next_item is not None and len(running) <= processes
+                       and budget.can_admit(next_item[1]) and not cancelled()):
+                    input_path, cost = next_item
+                    next_item = next(queue, None)
+                    start = time.perf_counter()
+                    try:
+                        pending = self.pending_outputs(input_path, result)
+                        if not pending:
+                            self.finish_item(input_path, result, journal, tracker, start)
+                            after_item()
+                            continue
+                        image, source_encoding = self.decode(input_path)
+                        # 共享内存中只有像素，EXIF等变量的值在本进程中取得
+                        text_context = self.text_context(input_path, image)
+                        descriptor = write_frame(pool, image)
+                        del image
+                    except Exception as e:
+                        self.finish_item(input_path, result, journal, tracker, start, e)
+                        after_item()
+                        continue
+                    future = executor.submit(_render_shared_frame, descriptor, source_encoding, pending, text_context)
+                    budget.admit(cost)
+                    running[future] = (input_path, pending, descriptor, cost, start)
+                if not running:
+                    break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    input_path, pending, descriptor, cost, start = running.pop(future)
+                    pool.release(descriptor["name"])
+                    budget.release(cost)
+                    error = None
+                    try:
+                        future.result()
+                        self.record_outputs(input_path, pending, result)
+                    except Exception as e:
+                        error = e
+                    self.finish_item(input_path, result, journal, tracker, start, error)
+                    after_item()
+
+    def run(self, image_paths, progress_callback=None, journal=None, workers=1, cancel_event=None,
+            use_processes=False, memory_budget_mb=0, async_io=False, io_in_flight=None):
+        """导出所有图片，progress_callback(ProgressTracker) 在每张图片完成后调用
+
+        指定 journal（BatchJournal）时，每张图片完成后提交到任务日志，日志中已完成的图片直接跳过。
+        workers 大于1时使用线程池并行导出；use_processes 为 True 时改用 workers 个渲染进程，
+        解码后的像素通过共享内存传递。memory_budget_mb 大于0时按文件头估算每张图片的内存，
+        同时处理的图片总估算不超过预算（workers 仍是并行数上限），并从大到小分派。
+        async_io 为 True 时用 asyncio 同时预读 io_in_flight 张源图片（默认 DEFAULT_IO_IN_FLIGHT）、
+        在内存中解码并异步写出，适合网络共享等高延迟存储（此时按 io_in_flight 而不是内存预算限制进行中的图片数）。
+        cancel_event（threading.Event）被设置后不再开始新的图片，正在处理的图片完成后返回。
+        """
+        result = BatchResult()
+        self.image_indices = {path: index for index, path in enumerate(image_paths, 1)}
+        pending = [p for p in image_paths if journal is None or p not in journal.done]
+        tracker = ProgressTracker(len(image_paths), workers)
+        tracker.add_skipped(len(image_paths) - len(pending))
+        budget = MemoryBudget(memory_budget_mb * 1024 * 1024)
+        if memory_budget_mb > 0 and workers > 1:
+            scheduled = order_largest_first(pending)
+        else:
+            scheduled = [(path, 0) for path in pending]
+
+        def cancelled():
+            return cancel_event is not None and cancel_event.is_set()
+
+        def after_item():
+            if (tracker.done - tracker.skipped) % MANIFEST_SAVE_INTERVAL == 0:
+                with self._lock:
+                    self.save_manifests()
+            if progress_callback:
+                progress_callback(tracker)
+
+        try:
+            if use_processes:
+                self._run_processes(scheduled, budget, result, journal, tracker, max(1, workers), cancelled, after_item)
+            elif async_io:
+                from async_export import run_async_pipeline, DEFAULT_IO_IN_FLIGHT
+                if io_in_flight is None:
+                    io_in_flight = DEFAULT_IO_IN_FLIGHT
+                run_async_pipeline(self, pending, result, journal, tracker, workers, io_in_flight,
+                                   cancelled, after_item)
+            elif workers <= 1:
+                for input_path in pending:
+                    if cancelled():
+                        break
+                    self._process(input_path, result, journal, tracker)
+                    after_item()
+            else:
+                # 同时在处理中的图片不超过线程数和内存预算，便于及时响应取消
+                with ThreadPoolExecutor(max_workers=workers) as executor:
+                    queue = iter(scheduled)
+                    next_item = next(queue, None)
+                    running = {}  # future -> 估算内存
+                    while True:
+                        while (next_item is not None and len(running) < workers
+                               and budget.can_admit(next_item[1]) and not cancelled()):
+                            input_path, cost = next_item
+                            next_item = next(queue, None)
+                            budget.admit(cost)
+                            running[executor.submit(self._process, input_path, result, journal, tracker)] = cost
+                        if not running:
+                            break
+                        finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                        for future in finished:
+                            budget.release(running.pop(future))
+                            future.result()
+                            after_item()
+            result.cancelled = cancelled()
+            result.stats = tracker.snapshot()
+            result.stats["peak_rss_mb"] = peak_rss_mb(include_children=use_processes)
+            result.stats["peak_budget_mb"] = budget.peak / (1024 * 1024)
+        finally:
+            # 中途出错也要保存已完成部分的记录
+            with self._lock:
+                self.save_manifests()
+        return result
+
+
+# 渲染进程中的导出器（进程池启动时创建，之后每张图片只传递共享内存描述）
+_process_exporter = None
+
+
+def _init_render_process(settings, export_dir, font_name_to_path, renditions, templates_dir):
+    """渲染进程初始化"""
+    global _process_exporter
+    _process_exporter = BatchExporter(settings, export_dir, font_name_to_path, renditions=renditions,
+                                      templates_dir=templates_dir, use_manifest=False)
+
+
+def _render_shared_frame(descriptor, source_encoding, pending, text_context=None):
+    """在渲染进程中处理共享内存中的一张图片，返回输出文件列表"""
+    from shared_frames import open_frame, close_frame
+
+    shm, image = open_frame(descriptor)
+    try:
+        return _process_exporter.render_outputs(image, source_encoding, pending, text_context)
+    finally:
+        # 先释放引用共享内存的图片，才能断开共享内存
+        del image
+        close_frame(shm)
@@ -0,0 +1,123 @@
+import os
+import json
+import time
+import uuid
+
+# 任务日志目录名（位于应用数据目录下）
+JOBS_DIRNAME = "jobs"
+JOURNAL_VERSION = 1
+
+
+def get_jobs_dir(app_data_dir):
+    """返回任务日志目录"""
+    return os.path.join(app_data_dir, JOBS_DIRNAME)
+
+
+class BatchJournal:
+    """批量导出任务日志（追加写入的JSON Lines文件）
+
+    第一行记录任务参数（设置、输出目录、图片列表等），之后每完成一张图片追加一行并落盘。
+    程序异常退出后，可以根据日志从最后一张已提交的图片继续，不会重复渲染已完成的图片。
+    最后一行若因断电只写了一半，读取时会被忽略。
+    """
+
+    def __init__(self, path, job, done=None):
+        self.path = path
+        self.job = job
+        self.done = set(done or ())
+        self._file = None
+
+    @classmethod
+    def create(cls, jobs_dir, settings, export_dir, image_paths, renditions=None, templates_dir=None):
+        """创建新的任务日志"""
+        os.makedirs(jobs_dir, exist_ok=True)
+        job = {
+            "version": JOURNAL_VERSION,
+            "job_id": uuid.uuid4().hex,
+            "created": time.time(),
+            "settings": settings,
+            "export_dir": export_dir,
+            "image_paths": list(image_paths),
+            "renditions": renditions,
+            "templates_dir": templates_dir,
+        }
+        path = os.path.join(jobs_dir, f"job_{job['job_id']}.jsonl")
+        journal = cls(path, job)
+        journal._append(job)
+        return journal
+
+    @classmethod
+    def load(cls, path):
+        """读取任务日志，返回 BatchJournal（文件无效时返回None）"""
+        job = None
+        done = set()
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # 未写完整的最后一行
+                    continue
+                if job is None:
+                    job = record
+                elif "done" in record:
+                    done.add(record["done"])
+        if not job or job.get("version") != JOURNAL_VERSION:
+            return None
+        return cls(path, job, done)
+
+    def _append(self, record):
+        """追加一条记录并强制落盘"""
+        if self._file is None:
+            self._file = open(self.path, 'a', encoding='utf-8')
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def mark_done(self, input_path):
+        """提交一张已完成的图片"""
+        self._append({"done": input_path})
+        self.done.add(input_path)
+
+    def pending_paths(self):
+        """尚未完成的图片（保持原顺序）"""
+        return [path for path in self.job["image_paths"] if path not in self.done]
+
+    def output_dirs(self):
+        """任务可能写入的输出目录（用于清理遗留的临时文件）"""
+        if self.job["settings"].get("save_to_same_dir"):
+            return sorted({os.path.dirname(os.path.abspath(p)) for p in self.job["image_paths"]})
+        return [self.job["export_dir"]]
+
+    def close(self):
+        """关闭日志文件（任务未完成，保留日志以便续传）"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def finish(self):
+        """任务完成，删除日志"""
+        self.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+def find_unfinished_jobs(jobs_dir):
+    """查找未完成的任务日志，按创建时间排序"""
+    journals = []
+    if not os.path.isdir(jobs_dir):
+        return journals
+    for name in os.listdir(jobs_dir):
+        if not (name.startswith("job_") and name.endswith(".jsonl")):
+            continue
+        try:
+            journal = BatchJournal.load(os.path.join(jobs_dir, name))
+        except Exception as e:
+            print(f"读取任务日志 {name} 时出错: {e}")
+            continue
+        if journal is not None:
+            journals.append(journal)
+    journals.sort(key=lambda j: j.job.get("created", 0))
+    return journals
@@ -0,0 +1,125 @@
+"""按内存预算调度批量导出
+
+固定的并行数在同时遇到几张上亿像素的扫描图时可能耗尽内存，图片都很小时又用不满CPU。
+这里只读取文件头得到尺寸来估算每张图片处理时的内存占用，在预算内尽量多地同时处理，
+并按从大到小的顺序分派，避免最后剩下一张大图让其他线程空等。
+"""
+import sys
+
+from PIL import Image
+
+# 处理一张图片时每个像素的峰值内存估计（字节）：
+# Pillow 的 RGB/RGBA 每像素4字节，解码时复制一次，编码前转换格式再复制一次
+BYTES_PER_PIXEL = 12
+
+# 默认内存预算（MB）
+DEFAULT_MEMORY_BUDGET_MB = 2048
+
+
+def estimate_image_memory(input_path):
+    """只读取文件头估算处理一张图片的内存（字节），无法读取时返回0"""
+    try:
+        with Image.open(input_path) as image:
+            width, height = image.size
+    except Exception:
+        # 交给导出流程报告具体错误
+        return 0
+    return width * height * BYTES_PER_PIXEL
+
+
+def order_largest_first(image_paths):
+    """估算每张图片的内存并按从大到小排序，返回 [(图片路径, 估算字节数)]"""
+    costs = [(path, estimate_image_memory(path)) for path in image_paths]
+    costs.sort(key=lambda item: -item[1])
+    return costs
+
+
+class MemoryBudget:
+    """内存预算计数（只在分派线程中使用）
+
+    预算内可以同时处理多张图片；单张图片超过整个预算时，等其他图片都完成后单独处理。
+    """
+
+    def __init__(self, budget_bytes):
+        self.budget_bytes = budget_bytes
+        self.in_use = 0
+        self.peak = 0
+        self.running = 0
+
+    def can_admit(self, cost):
+        """判断当前能否开始处理估算为 cost 字节的图片"""
+        if self.running == 0 or self.budget_bytes <= 0:
+            return True
+        return self.in_use + cost <= self.budget_bytes
+
+    def admit(self, cost):
+        self.in_use += cost
+        self.running += 1
+        self.peak = max(self.peak, self.in_use)
+
+    def release(self, cost):
+        self.in_use -= cost
+        self.running -= 1
+
+
+def peak_rss_mb(include_children=False):
+    """进程的峰值常驻内存（MB），平台不支持时返回None
+
+    Windows 没有 resource 模块，改为读取本进程的峰值工作集（见 _peak_working_set_mb）；
+    已退出的子进程的峰值在 Windows 上无法取得，include_children 只在其他平台上生效。
+    """
+    try:
+        import resource
+    except ImportError:
+        return _peak_working_set_mb()
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if include_children:
+        usage = max(usage, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # Linux 以KB为单位，macOS 以字节为单位
+    divisor = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return usage / divisor
+
+
+def _peak_working_set_mb():
+    """本进程的峰值工作集（MB）：安装了 psutil 时用 psutil，否则在 Windows 上调用 GetProcessMemoryInfo"""
+    try:
+        import psutil
+    except ImportError:
+        psutil = None
+    if psutil is not None:
+        peak = getattr(psutil.Process().memory_info(), 'peak_wset', None)
+        if peak is not None:
+            return peak / (1024 * 1024)
+    if sys.platform != 'win32':
+        return None
+    import ctypes
+    from ctypes import wintypes
+
+    class ProcessMemoryCounters(ctypes.Structure):
+        _fields_ = [
+            ("cb", wintypes.DWORD),
+            ("PageFaultCount", wintypes.DWORD),
+            ("PeakWorkingSetSize", ctypes.c_size_t),
+            ("WorkingSetSize", ctypes.c_size_t),
+            ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+            ("PagefileUsage", ctypes.c_size_t),
+            ("PeakPagefileUsage", ctypes.c_size_t),
+        ]
+
+    counters = ProcessMemoryCounters()
+    counters.cb = ctypes.sizeof(counters)
+    try:
+        kernel32 = ctypes.WinDLL('kernel32')
+        psapi = ctypes.WinDLL('psapi')
+        kernel32.GetCurrentProcess.restype = wintypes.HANDLE
+        psapi.GetProcessMemoryInfo.argtypes = [wintypes.HANDLE, ctypes.POINTER(ProcessMemoryCounters), wintypes.DWORD]
+        psapi.GetProcessMemoryInfo.restype = wintypes.BOOL
+        if not psapi.GetProcessMemoryInfo(kernel32.GetCurrentProcess(), ctypes.byref(counters), counters.cb):
+            return None
+    except (AttributeError, OSError) as e:
+        print(f"读取峰值内存时出错: {e}")
+        return None
+    return counters.PeakWorkingSetSize / (1024 * 1024)
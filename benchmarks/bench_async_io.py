@@ -0,0 +1,182 @@
+"""高延迟存储基准测试：在本地目录上注入人为延迟，模拟网络共享，比较同步导出与异步导出
+
+对 open、stat、rename、fsync 和每次系统调用级别的读写都增加固定延迟（只对测试目录内的文件生效），
+分别用单线程、多线程和 asyncio 导出同一批图片，统计总耗时。
+
+用法：
+    python benchmarks/bench_async_io.py [--count N] [--latency-ms MS] [--workers N] [--in-flight N]
+"""
+import os
+import io
+import sys
+import time
+import shutil
+import builtins
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from batch_export import BatchExporter
+from bench_encoders import make_sample_image
+
+
+class _SlowRaw(io.RawIOBase):
+    """每次系统调用级别的读写都有延迟的原始文件（位于Python缓冲层之下，模拟网络往返）"""
+
+    def __init__(self, raw, delay):
+        self._raw = raw
+        self._delay = delay
+
+    def readinto(self, buffer):
+        time.sleep(self._delay)
+        return self._raw.readinto(buffer)
+
+    def write(self, data):
+        time.sleep(self._delay)
+        return self._raw.write(data)
+
+    def readable(self):
+        return self._raw.readable()
+
+    def writable(self):
+        return self._raw.writable()
+
+    def seekable(self):
+        return self._raw.seekable()
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        return self._raw.seek(offset, whence)
+
+    def tell(self):
+        return self._raw.tell()
+
+    def truncate(self, size=None):
+        return self._raw.truncate(size)
+
+    def fileno(self):
+        return self._raw.fileno()
+
+    @property
+    def name(self):
+        return self._raw.name
+
+    def close(self):
+        self._raw.close()
+        super().close()
+
+
+def _wrap_slow(raw, mode, delay, encoding, errors, newline):
+    """按打开模式在延迟原始文件外加上缓冲层和文本层"""
+    slow = _SlowRaw(raw, delay)
+    if '+' in mode:
+        buffered = io.BufferedRandom(slow)
+    elif 'r' in mode:
+        buffered = io.BufferedReader(slow)
+    else:
+        buffered = io.BufferedWriter(slow)
+    if 'b' in mode:
+        return buffered
+    return io.TextIOWrapper(buffered, encoding=encoding, errors=errors, newline=newline)
+
+
+class LatencyInjector:
+    """在 root 目录下的文件操作上注入延迟（模拟 SMB/NFS）"""
+
+    def __init__(self, root, latency_ms):
+        self.root = os.path.abspath(root)
+        self.delay = latency_ms / 1000.0
+        self._originals = {}
+
+    def _slow(self, path):
+        try:
+            return os.path.abspath(os.fspath(path)).startswith(self.root)
+        except TypeError:
+            # 文件描述符等
+            return False
+
+    def __enter__(self):
+        injector = self
+        original_open = builtins.open
+        self._originals = {
+            (builtins, 'open'): builtins.open,
+            (os, 'stat'): os.stat,
+            (os, 'replace'): os.replace,
+            (os, 'fsync'): os.fsync,
+        }
+
+        def slow_open(file, mode='r', buffering=-1, encoding=None, errors=None, newline=None, *args, **kwargs):
+            if not injector._slow(file):
+                return original_open(file, mode, buffering, encoding, errors, newline, *args, **kwargs)
+            time.sleep(injector.delay)
+            raw = original_open(file, mode.replace('t', '').replace('b', '') + 'b', 0, *args, **kwargs)
+            if buffering == 0:
+                return _SlowRaw(raw, injector.delay)
+            return _wrap_slow(raw, mode, injector.delay, encoding, errors, newline)
+
+        def slow_call(func, path_arg=True):
+            def wrapper(*args, **kwargs):
+                if not path_arg or injector._slow(args[0]):
+                    time.sleep(injector.delay)
+                return func(*args, **kwargs)
+            return wrapper
+
+        builtins.open = slow_open
+        os.stat = slow_call(os.stat)
+        os.replace = slow_call(os.replace)
+        os.fsync = slow_call(os.fsync, path_arg=False)
+        return self
+
+    def __exit__(self, *exc_info):
+        for (module, name), func in self._originals.items():
+            setattr(module, name, func)
+
+
+def prepare_sources(directory, count):
+    """生成测试用的源图片"""
+    os.makedirs(directory, exist_ok=True)
+    sample = make_sample_image(1600, 1200)
+    paths = []
+    for i in range(count):
+        path = os.path.join(directory, f"img_{i:04d}.jpg")
+        sample.save(path, quality=90)
+        paths.append(path)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description='高延迟存储基准测试')
+    parser.add_argument('--count', type=int, default=40, help='图片数量')
+    parser.add_argument('--latency-ms', type=float, default=5.0, help='每次文件操作的延迟（毫秒）')
+    parser.add_argument('--workers', type=int, default=4, help='渲染线程数')
+    parser.add_argument('--in-flight', type=int, default=16, help='异步模式同时进行中的图片数')
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix='watermark-bench-')
+    try:
+        paths = prepare_sources(os.path.join(root, 'src'), args.count)
+        settings = {"watermark_text": "Benchmark", "watermark_font_size": 48}
+        modes = [
+            ('同步-单线程', dict(workers=1)),
+            (f'同步-{args.workers}线程', dict(workers=args.workers)),
+            (f'异步-{args.in_flight}并发', dict(workers=args.workers, async_io=True, io_in_flight=args.in_flight)),
+        ]
+        print(f"{args.count} 张图片，每次文件操作延迟 {args.latency_ms} ms")
+        print(f"{'方式':<16}{'耗时(s)':>10}{'张/秒':>10}")
+        for name, options in modes:
+            output_dir = os.path.join(root, 'out')
+            shutil.rmtree(output_dir, ignore_errors=True)
+            exporter = BatchExporter(settings, output_dir, {})
+            with LatencyInjector(root, args.latency_ms):
+                start = time.perf_counter()
+                result = exporter.run(paths, **options)
+                seconds = time.perf_counter() - start
+            if result.failed:
+                print(f"{name}: {len(result.failed)} 张失败，例如 {result.failed[0]}")
+            print(f"{name:<16}{seconds:>10.2f}{args.count / seconds:>10.1f}")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""进程间传递图片的基准测试：比较序列化（pickle）传递与共享内存传递
+
+每次把一张解码后的图片交给另一个进程，子进程读取一个像素后返回，统计每次传递的平均耗时。
+
+用法：
+    python benchmarks/bench_frame_transfer.py [--sizes 12,24] [--repeat N]
+"""
+import os
+import sys
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image
+
+from shared_frames import SharedFramePool, write_frame, open_frame, close_frame
+
+
+def make_frame(megapixels):
+    """生成指定像素数（百万）的3:2 RGB图片"""
+    height = int((megapixels * 1000000 / 1.5) ** 0.5)
+    width = int(height * 1.5)
+    return Image.effect_noise((width, height), 60).convert('RGB')
+
+
+def touch_pickled(image):
+    """子进程：收到反序列化后的图片"""
+    return image.getpixel((0, 0))
+
+
+def touch_shared(descriptor):
+    """子进程：在共享内存上打开图片"""
+    shm, image = open_frame(descriptor)
+    try:
+        return image.getpixel((0, 0))
+    finally:
+        del image
+        close_frame(shm)
+
+
+def bench_pickled(executor, image, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        executor.submit(touch_pickled, image).result()
+    return (time.perf_counter() - start) / repeat
+
+
+def bench_shared(executor, pool, image, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        descriptor = write_frame(pool, image)
+        executor.submit(touch_shared, descriptor).result()
+        pool.release(descriptor["name"])
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description='进程间传递图片的基准测试')
+    parser.add_argument('--sizes', default='12,24', help='逗号分隔的图片尺寸（百万像素）')
+    parser.add_argument('--repeat', type=int, default=10, help='每种方式的传递次数')
+    args = parser.parse_args()
+
+    print(f"{'尺寸':<8}{'像素数据(MB)':>14}{'pickle(ms)':>12}{'共享内存(ms)':>14}{'加速':>8}")
+    with SharedFramePool(1) as pool, ProcessPoolExecutor(max_workers=1) as executor:
+        # 预热：启动子进程
+        executor.submit(touch_pickled, Image.new('RGB', (1, 1))).result()
+        for size in args.sizes.split(','):
+            image = make_frame(float(size))
+            pickled = bench_pickled(executor, image, args.repeat)
+            shared = bench_shared(executor, pool, image, args.repeat)
+            data_mb = image.width * image.height * 3 / (1024 * 1024)
+            print(f"{size + 'MP':<8}{data_mb:>14.1f}{pickled * 1000:>12.1f}{shared * 1000:>14.1f}{pickled / shared:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
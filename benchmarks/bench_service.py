@@ -0,0 +1,165 @@
+"""水印服务负载测试：以固定并发向本机的 watermark_service 发送请求，统计延迟百分位数和吞吐量
+
+每个并发连接使用HTTP长连接连续发送请求，记录每个请求从发送到收完响应的时间。
+未指定 --url 时自动在临时模板目录中启动一个服务进程，测试结束后关闭。
+
+用法：
+    python benchmarks/bench_service.py [--url http://127.0.0.1:8765] [--template 模板名] [--image 图片]
+                                       [--concurrency 8] [--requests 400] [--workers N]
+"""
+import os
+import io
+import sys
+import json
+import math
+import time
+import shutil
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+import http.client
+from collections import Counter
+from urllib.parse import urlparse, quote
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import watermark_core
+from bench_encoders import make_sample_image
+
+BENCH_TEMPLATE = "bench"
+
+
+def percentile(sorted_values, fraction):
+    """已排序数据的百分位数（最近秩法）"""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_local_service(workers):
+    """在临时模板目录中启动服务进程，返回 (进程, 地址, 临时目录)"""
+    templates_dir = tempfile.mkdtemp(prefix='watermark-service-')
+    with open(watermark_core.get_template_path(templates_dir, BENCH_TEMPLATE), 'w', encoding='utf-8') as f:
+        json.dump({"name": BENCH_TEMPLATE, "watermark_text": "Benchmark", "watermark_font_size": 48,
+                   "watermark_stroke": True, "export_quality": 85}, f, ensure_ascii=False)
+    port = _free_port()
+    script = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'watermark_service.py')
+    command = [sys.executable, script, '--port', str(port), '--templates-dir', templates_dir]
+    if workers:
+        command += ['--workers', str(workers)]
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            connection.request("GET", "/health")
+            if connection.getresponse().status == 200:
+                return process, url, templates_dir
+        except OSError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError("服务未能启动")
+
+
+def run_load(url, template, body, concurrency, total_requests):
+    """以 concurrency 个长连接发送 total_requests 个请求，返回 (延迟列表, 状态码计数, 总耗时)"""
+    target = urlparse(url)
+    path = f"/watermark?template={quote(template)}"
+    remaining = [total_requests]
+    lock = threading.Lock()
+    latencies = []
+    statuses = Counter()
+
+    def client():
+        connection = http.client.HTTPConnection(target.hostname, target.port, timeout=120)
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    break
+                remaining[0] -= 1
+            start = time.perf_counter()
+            try:
+                connection.request("POST", path, body=body, headers={"Content-Type": "application/octet-stream"})
+                response = connection.getresponse()
+                response.read()
+                status = response.status
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                connection = http.client.HTTPConnection(target.hostname, target.port, timeout=120)
+                status = "连接错误"
+            elapsed = time.perf_counter() - start
+            with lock:
+                statuses[status] += 1
+                if status == 200:
+                    latencies.append(elapsed)
+        connection.close()
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, statuses, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='水印服务负载测试')
+    parser.add_argument('--url', help='服务地址（不指定时自动启动本机服务）')
+    parser.add_argument('--template', default=BENCH_TEMPLATE, help='模板名称')
+    parser.add_argument('--image', help='请求使用的图片（默认生成 1600x1200 的样例JPEG）')
+    parser.add_argument('--concurrency', type=int, default=8, help='并发连接数')
+    parser.add_argument('--requests', type=int, default=400, help='请求总数')
+    parser.add_argument('--warmup', type=int, default=20, help='正式测试前的预热请求数')
+    parser.add_argument('--workers', type=int, help='自动启动服务时的工作进程数')
+    args = parser.parse_args()
+
+    if args.image:
+        with open(args.image, 'rb') as f:
+            body = f.read()
+    else:
+        buffer = io.BytesIO()
+        make_sample_image(1600, 1200).save(buffer, 'JPEG', quality=90)
+        body = buffer.getvalue()
+
+    process = templates_dir = None
+    url = args.url
+    if url is None:
+        process, url, templates_dir = start_local_service(args.workers)
+    try:
+        if args.warmup:
+            run_load(url, args.template, body, min(args.concurrency, args.warmup), args.warmup)
+        latencies, statuses, seconds = run_load(url, args.template, body, args.concurrency, args.requests)
+        latencies.sort()
+        print(f"{args.requests} 个请求，并发 {args.concurrency}，请求体 {len(body) / 1024:.0f} KB，耗时 {seconds:.2f} s")
+        print(f"吞吐量 {len(latencies) / seconds:.1f} 张/秒")
+        print("状态码：" + "，".join(f"{status}: {count}" for status, count in sorted(statuses.items(), key=str)))
+        if latencies:
+            print(f"{'p50':>8}{'p90':>8}{'p99':>8}{'最大':>8}   (ms)")
+            print(f"{percentile(latencies, 0.5) * 1000:>8.1f}{percentile(latencies, 0.9) * 1000:>8.1f}"
+                  f"{percentile(latencies, 0.99) * 1000:>8.1f}{latencies[-1] * 1000:>8.1f}")
+        connection = http.client.HTTPConnection(urlparse(url).hostname, urlparse(url).port, timeout=10)
+        connection.request("GET", "/stats")
+        stats = json.loads(connection.getresponse().read())
+        processing = stats["processing"]
+        print(f"服务端处理时间：p50 <= {processing['p50_ms']:.0f} ms，p99 <= {processing['p99_ms']:.0f} ms，"
+              f"拒绝 {stats['requests']['rejected']} 个")
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+            shutil.rmtree(templates_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""启动时间测试：从启动进程到主窗口第一次绘制（首帧）的时间
+
+每次在新的Python进程中启动界面，记录各阶段相对于进程启动的时间：
+导入 main 模块、创建窗口、首帧绘制，以及首帧之后后台字体扫描、设置恢复全部完成的时间。
+子进程使用临时的用户目录，不读取也不修改真实的设置和模板。
+
+用法：
+    python benchmarks/bench_startup.py [--runs 10] [--platform offscreen]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PHASES = [
+    ("imported", "导入模块"),
+    ("constructed", "创建窗口"),
+    ("first_frame", "首帧"),
+    ("ready", "初始化完成"),
+]
+
+
+def child(launch_time):
+    """在子进程中启动界面，输出各阶段时间（秒，相对于父进程启动子进程的时刻）"""
+    sys.path.insert(0, ROOT)
+    marks = {}
+
+    def mark(name):
+        marks[name] = time.time() - launch_time
+
+    import main
+    mark("imported")
+    from PyQt5.QtWidgets import QApplication
+    from PyQt5.QtCore import QTimer
+
+    class TimedWindow(main.ImageWatermarkTool):
+        def paintEvent(self, event):
+            super().paintEvent(event)
+            if "first_frame" not in marks:
+                mark("first_frame")
+
+    app = QApplication(sys.argv[:1])
+    window = TimedWindow()
+    mark("constructed")
+
+    def poll():
+        # 字体扫描完成且首帧后的初始化已执行（设置恢复在同一次事件中完成）
+        if "first_frame" in marks and window.font_name_to_path is not None:
+            mark("ready")
+            window.close()
+            app.quit()
+        else:
+            QTimer.singleShot(1, poll)
+
+    window.show()
+    QTimer.singleShot(0, poll)
+    app.exec_()
+    print(json.dumps(marks))
+
+
+def run_once(home, platform):
+    env = dict(os.environ, HOME=home, USERPROFILE=home)
+    if platform:
+        env["QT_QPA_PLATFORM"] = platform
+    launch_time = time.time()
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--child", repr(launch_time)],
+        env=env, stdout=subprocess.PIPE, check=True, text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='界面启动时间测试')
+    parser.add_argument('--runs', type=int, default=10, help='启动次数')
+    parser.add_argument('--platform', help='Qt平台插件（例如 offscreen，无显示器时使用）')
+    parser.add_argument('--child', type=float, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        child(args.child)
+        return
+
+    home = tempfile.mkdtemp(prefix='watermark-startup-')
+    try:
+        run_once(home, args.platform)  # 预热磁盘缓存，并生成设置文件的目录
+        results = [run_once(home, args.platform) for _ in range(args.runs)]
+    finally:
+        shutil.rmtree(home, ignore_errors=True)
+
+    print(f"{args.runs} 次启动（毫秒，从启动进程算起）")
+    print(f"{'阶段':<10}{'中位数':>10}{'最小':>10}{'最大':>10}")
+    for key, label in PHASES:
+        values = [r[key] * 1000 for r in results]
+        print(f"{label:<10}{statistics.median(values):>10.1f}{min(values):>10.1f}{max(values):>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+import os
+import json
+
+from watermark_core import file_sha256
+
+# 清单文件名（保存在输出目录中）
+MANIFEST_FILENAME = ".watermark_manifest.json"
+MANIFEST_VERSION = 2
+
+
+class ExportManifest:
+    """输出目录中的导出清单：记录每个输出文件与其输入文件的对应关系
+
+    记录按输出文件索引（一个输入可以对应多个规格的输出），包含输入文件的路径、大小、
+    修改时间和内容哈希，以及导出时的设置哈希。
+    再次导出时，输入和设置都未变化且输出文件仍然存在的图片可以直接跳过。
+    """
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self.manifest_path = os.path.join(output_dir, MANIFEST_FILENAME)
+        self.entries = {}
+        self.dirty = False
+        self.load()
+
+    @staticmethod
+    def _path_key(path):
+        """清单中文件的键（规范化的绝对路径）"""
+        return os.path.normcase(os.path.abspath(path))
+
+    def load(self):
+        """从输出目录加载清单（文件损坏时视为空清单）"""
+        try:
+            if os.path.exists(self.manifest_path):
+                with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                if data.get("version") == MANIFEST_VERSION:
+                    self.entries = data.get("entries", {})
+        except Exception as e:
+            print(f"加载导出清单时出错: {e}")
+            self.entries = {}
+
+    def save(self):
+        """写入清单（先写临时文件再原子替换，避免中途退出留下损坏的清单）"""
+        if not self.dirty:
+            return
+        os.makedirs(self.output_dir, exist_ok=True)
+        temp_path = self.manifest_path + ".tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({"version": MANIFEST_VERSION, "entries": self.entries}, f, ensure_ascii=False, indent=2)
+        os.replace(temp_path, self.manifest_path)
+        self.dirty = False
+
+    def is_up_to_date(self, input_path, settings_digest, output_path):
+        """判断输出文件是否已是最新（输入、设置、输出均未变化）"""
+        entry = self.entries.get(self._path_key(output_path))
+        if not entry or entry.get("settings_hash") != settings_digest:
+            return False
+        if self._path_key(entry.get("input", "")) != self._path_key(input_path):
+            return False
+
+        # 输出文件被删除或被外部修改时需要重新渲染
+        try:
+            output_stat = os.stat(output_path)
+            input_stat = os.stat(input_path)
+        except OSError:
+            return False
+        if output_stat.st_size != entry.get("output_size") or output_stat.st_mtime_ns != entry.get("output_mtime_ns"):
+            return False
+
+        # 快速路径：大小和修改时间一致时不再计算内容哈希
+        if input_stat.st_size == entry.get("size") and input_stat.st_mtime_ns == entry.get("mtime_ns"):
+            return True
+
+        # 修改时间变化但内容未变（例如文件被复制或touch），刷新记录后跳过
+        if input_stat.st_size != entry.get("size"):
+            return False
+        if file_sha256(input_path) != entry.get("sha256"):
+            return False
+        entry["mtime_ns"] = input_stat.st_mtime_ns
+        self.dirty = True
+        return True
+
+    def record(self, input_path, settings_digest, output_path, input_digest=None):
+        """记录一次成功的导出"""
+        input_stat = os.stat(input_path)
+        output_stat = os.stat(output_path)
+        self.entries[self._path_key(output_path)] = {
+            "input": os.path.abspath(input_path),
+            "size": input_stat.st_size,
+            "mtime_ns": input_stat.st_mtime_ns,
+            "sha256": input_digest or file_sha256(input_path),
+            "settings_hash": settings_digest,
+            "output_size": output_stat.st_size,
+            "output_mtime_ns": output_stat.st_mtime_ns,
+        }
+        self.dirty = True
@@ -0,0 +1,185 @@
+"""图片列表的模型与按需生成的缩略图
+
+列表模型只保存路径；视图绘制某一行时才通过 data() 请求它的缩略图，缩略图在后台线程中生成
+（提供磁盘缓存时优先从中读取，见 thumbnail_cache.py），生成好的像素图放入有容量上限的内存缓存。
+滚动出可见区域的缩略图会逐渐被淘汰，滚动回来时重新生成，
+所以导入十万张图片时内存和布局开销只与路径数量和可见行数有关。
+"""
+import os
+import threading
+from collections import deque
+
+from PyQt5.QtGui import QPixmap, QColor
+from PyQt5.QtCore import Qt, QObject, QAbstractListModel, QModelIndex, QSize, pyqtSignal
+
+import watermark_core
+from background_tasks import pil_to_qimage_copy
+from preview_cache import LRUCache
+
+# 缩略图最大边长与列表中每项的尺寸（像素）
+THUMBNAIL_SIZE = 120
+ITEM_SIZE = QSize(130, 150)
+
+# 缩略图像素图缓存的默认容量（MB），约可容纳一千多张缩略图
+DEFAULT_THUMBNAIL_CACHE_MB = 64
+
+# 生成缩略图的后台线程数，以及最多排队的请求数（快速滚动时丢弃最早的请求）
+THUMBNAIL_WORKERS = 2
+MAX_PENDING_THUMBNAILS = 256
+
+
+class ThumbnailLoader(QObject):
+    """在后台线程中生成缩略图
+
+    请求按后进先出处理：快速滚动时最近请求的（也就是当前可见的）行先生成，
+    排队超过 max_pending 时丢弃最早的请求，被丢弃的行再次显示时会重新请求。
+    """
+
+    loaded = pyqtSignal(str, object)  # 路径, QImage（无法加载时为 None）
+    dropped = pyqtSignal(str)  # 被丢弃的请求
+
+    def __init__(self, size=THUMBNAIL_SIZE, workers=THUMBNAIL_WORKERS, max_pending=MAX_PENDING_THUMBNAILS,
+                 disk_cache=None, parent=None):
+        super().__init__(parent)
+        self.size = size
+        self.disk_cache = disk_cache  # ThumbnailCache，None 表示每次从源文件生成
+        self.max_pending = max_pending
+        self._pending = deque()
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._threads = [
+            threading.Thread(target=self._run, name=f'thumbnail-{i}', daemon=True) for i in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def request(self, file_path):
+        with self._condition:
+            self._pending.append(file_path)
+            dropped = self._pending.popleft() if len(self._pending) > self.max_pending else None
+            self._condition.notify()
+        if dropped is not None:
+            self.dropped.emit(dropped)
+
+    def cancel_all(self):
+        """丢弃所有排队中的请求"""
+        with self._condition:
+            dropped = list(self._pending)
+            self._pending.clear()
+        for file_path in dropped:
+            self.dropped.emit(file_path)
+
+    def shutdown(self):
+        """停止后台线程（正在生成的缩略图完成后退出）"""
+        with self._condition:
+            self._stopped = True
+            self._pending.clear()
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending and not self._stopped:
+                    self._condition.wait()
+                if self._stopped:
+                    return
+                file_path = self._pending.pop()
+            try:
+                if self.disk_cache is not None:
+                    thumbnail = self.disk_cache.load(file_path, self.size)
+                else:
+                    thumbnail = watermark_core.load_thumbnail(file_path, self.size)
+                q_image = pil_to_qimage_copy(thumbnail)
+            except Exception as e:
+                print(f"生成缩略图 {file_path} 时出错: {e}")
+                q_image = None
+            self.loaded.emit(file_path, q_image)
+
+
+class ImageListModel(QAbstractListModel):
+    """导入的图片列表：显示文件名，缩略图在行可见时才生成"""
+
+    def __init__(self, parent=None, cache_mb=DEFAULT_THUMBNAIL_CACHE_MB, disk_cache=None):
+        super().__init__(parent)
+        self.paths = []  # 图片路径（按导入顺序）
+        self._rows = {}  # 路径 -> 行号
+        self._failed = set()  # 无法生成缩略图的路径
+        self._requested = set()  # 已请求、尚未生成的路径
+        self.thumbnails = LRUCache(cache_mb * 1024 * 1024)  # 路径 -> QPixmap
+        self.placeholder = QPixmap(THUMBNAIL_SIZE, THUMBNAIL_SIZE)
+        self.placeholder.fill(QColor('#eeeeee'))
+        self.loader = ThumbnailLoader(disk_cache=disk_cache, parent=self)
+        self.loader.loaded.connect(self._on_thumbnail_loaded)
+        self.loader.dropped.connect(self._requested.discard)
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.paths)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or not 0 <= index.row() < len(self.paths):
+            return None
+        file_path = self.paths[index.row()]
+        if role == Qt.DisplayRole:
+            if file_path in self._failed:
+                return f'{os.path.basename(file_path)}\n(无法加载)'
+            return os.path.basename(file_path)
+        if role == Qt.DecorationRole:
+            return self.thumbnail(file_path)
+        if role == Qt.ToolTipRole:
+            return file_path
+        if role == Qt.TextAlignmentRole:
+            return int(Qt.AlignHCenter | Qt.AlignBottom)
+        if role == Qt.SizeHintRole:
+            return ITEM_SIZE
+        return None
+
+    def thumbnail(self, file_path):
+        """缓存中的缩略图；没有时请求后台生成，先返回占位图"""
+        pixmap = self.thumbnails.get(file_path)
+        if pixmap is not None:
+            return pixmap
+        if file_path in self._failed:
+            return None
+        if file_path not in self._requested:
+            self._requested.add(file_path)
+            self.loader.request(file_path)
+        return self.placeholder
+
+    def _on_thumbnail_loaded(self, file_path, q_image):
+        """缩略图生成后放入缓存并刷新对应的行（界面线程）"""
+        self._requested.discard(file_path)
+        row = self._rows.get(file_path)
+        if row is None:
+            return
+        if q_image is None:
+            self._failed.add(file_path)
+        else:
+            self.thumbnails.put(file_path, QPixmap.fromImage(q_image), q_image.width() * q_image.height() * 4)
+        index = self.index(row)
+        self.dataChanged.emit(index, index, [Qt.DecorationRole, Qt.DisplayRole])
+
+    def add_paths(self, file_paths):
+        """追加尚未导入的图片，返回实际新增的路径列表"""
+        new_paths = []
+        seen = set()
+        for file_path in file_paths:
+            if file_path not in self._rows and file_path not in seen:
+                seen.add(file_path)
+                new_paths.append(file_path)
+        if new_paths:
+            first = len(self.paths)
+            self.beginInsertRows(QModelIndex(), first, first + len(new_paths) - 1)
+            for row, file_path in enumerate(new_paths, first):
+                self._rows[file_path] = row
+            self.paths.extend(new_paths)
+            self.endInsertRows()
+        return new_paths
+
+    def row_of(self, file_path):
+        """路径所在的行号，不在列表中时返回 -1"""
+        return self._rows.get(file_path, -1)
+
+    def shutdown(self):
+        self.loader.shutdown()
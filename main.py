@@ -1,24 +1,39 @@
 import sys
 import os
 import json
-import sys
 import math
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, 
-    QLabel, QPushButton, QListWidget, QListWidgetItem, QFileDialog, 
-    QSplitter, QFrame, QGroupBox, QFormLayout, QAction, qApp, QMessageBox,
-    QLineEdit, QGridLayout, QComboBox, QSlider, QCheckBox, QRadioButton, QButtonGroup, QInputDialog, QColorDialog
+    QLabel, QPushButton, QListView, QListWidget, QFileDialog, 
+    QGroupBox, QFormLayout, QAction, qApp, QMessageBox,
+    QLineEdit, QGridLayout, QComboBox, QSlider, QCheckBox, QRadioButton, QButtonGroup, QInputDialog, QColorDialog,
+    QSpinBox
+)
+from PyQt5.QtGui import QPixmap, QImage, QColor, QPainter
+from PyQt5.QtCore import Qt, QSize, QTimer
+from PIL import Image
+import watermark_core
+from batch_export import BatchExporter, BATCH_MODE_NAMES, default_worker_count
+from batch_scheduler import DEFAULT_MEMORY_BUDGET_MB
+from background_tasks import BackgroundTask, ProgressPanel, pil_to_qimage_copy
+from task_progress import ProgressTracker
+from batch_journal import BatchJournal, find_unfinished_jobs, get_jobs_dir
+from image_list_model import ImageListModel, THUMBNAIL_SIZE, ITEM_SIZE
+from thumbnail_cache import ThumbnailCache
+from preview_cache import PreviewCache, LRUCache, preview_settings_key, render_preview, image_cost
+from preview_pyramid import (
+    PreviewPyramid, TILE_SIZE, ZOOM_STEP, MAX_ZOOM, choose_level, level_count, level_size, tiles_in_rect
 )
-from PyQt5.QtGui import QPixmap, QImage, QFont, QIcon, QColor
-from PyQt5.QtCore import Qt, QSize, QPoint, QTimer
-from PIL import Image, ImageQt, ImageDraw, ImageFont
-import glob
-import functools
+from renditions import DEFAULT_RENDITIONS, normalize_rendition, parse_rendition_lines, format_rendition_lines
 
 class ImageWatermarkTool(QMainWindow):
     def __init__(self):
         super().__init__()
-        self.image_list = []  # 存储导入的图片路径
+        # 图片列表模型（缩略图在行可见时才生成，并保存到磁盘缓存供下次导入时直接读取）
+        self.image_model = ImageListModel(self, disk_cache=ThumbnailCache())
+        self.image_list = self.image_model.paths  # 存储导入的图片路径（与列表模型共用）
+        self.export_task = None  # 正在进行的批量导出任务
+        self.is_closing = False
         self.current_image_index = -1  # 当前选中的图片索引
         
         # 水印相关变量
@@ -42,29 +57,70 @@ class ImageWatermarkTool(QMainWindow):
         self.watermark_image_size_ratio = 20  # 水印图片相对于原图片的百分比大小
         self.watermark_image_opacity = 128  # 0-255
         
+        # 额外的水印图层（绘制在当前编辑的水印之下），每一项是 watermark_core.LAYER_SETTING_KEYS 组成的字典
+        self.watermark_layers = []
+        
+        # 导出相关配置
+        self.export_format = "JPEG"  # 默认导出格式
+        self.export_quality = 95  # 默认导出质量
+        self.encoder_profile = "balanced"  # 默认编码配置
+        self.target_file_size_kb = 0  # 目标文件大小（KB），0 表示不限制
+        self.keep_source_quality = False  # JPEG源图沿用原量化表
+        self.renditions = [dict(r) for r in DEFAULT_RENDITIONS]  # 多规格导出配置
+        self.batch_workers = default_worker_count()  # 批量导出并行数
+        self.batch_mode = "threads"  # 批量导出方式（见 BATCH_MODE_NAMES）
+        self.batch_memory_budget_mb = DEFAULT_MEMORY_BUDGET_MB  # 批量导出内存预算（MB），0 表示不限制
+        self.use_suffix = True  # 默认使用后缀
+        self.suffix_text = "_watermark"  # 默认后缀文本
+        self.save_to_same_dir = False  # 默认不保存到原目录
+        self.last_export_dir = os.path.expanduser("~")  # 上次导出目录
+        
         # 模板相关变量
         self.templates_dir = os.path.join(os.path.expanduser("~"), ".photo_watermark_templates")
         self.settings_file = os.path.join(self.templates_dir, "last_settings.json")
-        self.system_fonts = self.get_system_fonts()  # 获取系统字体列表
-        self.load_last_settings()
-        
-        # 清除水印设置，确保程序启动时不显示默认水印
-        self.watermark_text = ""  # 清空水印文本
-        self.use_image_watermark = False  # 关闭图片水印
-        self.watermark_image_path = ""  # 清空水印图片路径
-        # 重置旋转角度为0
-        self.watermark_rotation = 0
+        # 系统字体在窗口第一次绘制后由后台线程扫描（见 _finish_startup），扫描完成前为空
+        self.system_fonts = []
+        self.font_name_to_path = None
+        self.font_task = None
+        self.startup_started = False  # 是否已开始启动后的初始化
+        self.restoring_settings = False  # 恢复设置期间不把中间状态写回设置文件
         
         # 优化性能相关变量
-        self.preview_timer = QTimer(self)  # 预览更新计时器
+        self.preview_timer = QTimer(self)  # 预览更新计时器（快速帧节流）
         self.preview_timer.setSingleShot(True)
-        self.preview_timer.setInterval(100)  # 100ms延迟
+        self.preview_timer.setInterval(30)  # 输入持续时最多每30ms一帧
         self.preview_timer.timeout.connect(self._update_preview_delayed)
         
-        # 初始化缓存字典
-        self.cached_fonts = {}
-        self.original_image_cache = {}
-        self.processed_image_cache = {}
+        # 输入停止后再生成高质量帧
+        self.refine_timer = QTimer(self)
+        self.refine_timer.setSingleShot(True)
+        self.refine_timer.setInterval(250)
+        self.refine_timer.timeout.connect(self._refine_preview)
+        self.preview_generation = 0  # 每次预览请求加1，用于丢弃过期的高质量帧
+        self.refine_task = None  # 正在后台渲染的高质量帧
+        self.refine_tasks = set()  # 仍在运行的高质量帧任务（包括已取消的）
+        
+        # 预览缓存（代理图与渲染结果，带相邻图片预取）
+        self.preview_cache = PreviewCache()
+        # 按设置状态缓存已缩放到预览区域大小的像素图：(路径, 设置键, 显示尺寸) -> QPixmap
+        self.display_pixmap_cache = LRUCache(64 * 1024 * 1024)
+        self.preview_qimage = None  # 当前预览的渲染结果（代理图分辨率）
+        self.preview_pixmap = None  # 当前预览的显示像素图
+        self.preview_state_key = None  # 当前预览的 (路径, 设置键)
+        
+        # 缩放预览：多分辨率金字塔，只渲染可见的图块
+        self.preview_pyramid = PreviewPyramid()
+        self.preview_zoom = None  # 显示像素/原图像素，None 表示适应窗口
+        self.preview_view_center = (0.5, 0.5)  # 缩放时视图中心在图片中的相对位置
+        self.preview_view_rect = (0.0, 0.0, 1.0, 1.0)  # 当前显示的像素图对应的图片范围（相对坐标）
+        self.is_panning = False
+        self.pan_start_pos = (0, 0)
+        
+        # 调整窗口大小停止后再高质量缩放
+        self.resize_timer = QTimer(self)
+        self.resize_timer.setSingleShot(True)
+        self.resize_timer.setInterval(150)
+        self.resize_timer.timeout.connect(self._on_resize_finished)
         self.render_cache = {}  # 用于缓存渲染结果
         
         # 拖拽相关变量
@@ -84,17 +140,57 @@ class ImageWatermarkTool(QMainWindow):
             '右下': (0.9, 0.9)
         }
         
-        # 导出相关配置
-        self.export_format = "JPEG"  # 默认导出格式
-        self.export_quality = 95  # 默认导出质量
-        self.use_suffix = True  # 默认使用后缀
-        self.suffix_text = "_watermark"  # 默认后缀文本
-        self.save_to_same_dir = False  # 默认不保存到原目录
-        self.last_export_dir = os.path.expanduser("~")  # 上次导出目录
-        
         # 初始化UI
         self.init_ui()
         
+    def paintEvent(self, event):
+        super().paintEvent(event)
+        if not self.startup_started:
+            # 窗口已经显示出来，再进行字体扫描、设置恢复等不影响首帧的初始化
+            self.startup_started = True
+            QTimer.singleShot(0, self._finish_startup)
+    
+    def _finish_startup(self):
+        """首帧显示后的初始化：后台扫描系统字体、恢复上次的设置、检查未完成的批量导出任务"""
+        if self.font_name_to_path is None:
+            self.font_task = BackgroundTask('扫描字体', lambda task: watermark_core.scan_system_fonts(), self)
+            self.font_task.succeeded.connect(self._on_fonts_scanned)
+            self.font_task.failed.connect(lambda message: print(f"扫描系统字体时出错: {message}"))
+            self.font_task.start()
+        
+        # 启动时不显示上次的水印（文本、图片水印、旋转角度和水印图层保持默认值）
+        self.restoring_settings = True
+        try:
+            self.load_last_settings(skip_keys=(
+                "watermark_text", "use_image_watermark", "watermark_image_path", "watermark_rotation",
+                "watermark_layers"
+            ))
+        finally:
+            self.restoring_settings = False
+        
+        self.check_unfinished_jobs()
+    
+    def _on_fonts_scanned(self, result):
+        """后台字体扫描完成（界面线程）"""
+        if self.font_name_to_path is None:
+            self.system_fonts, self.font_name_to_path = result
+        self._populate_font_combo()
+    
+    def _populate_font_combo(self):
+        """用系统字体填充字体下拉框，并选中当前设置的字体"""
+        system_font_names = [os.path.splitext(font)[0] for font in self.system_fonts]
+        # 只是显示已有的设置，不触发 on_font_changed
+        self.font_combo.blockSignals(True)
+        self.font_combo.clear()
+        self.font_combo.addItems(system_font_names)
+        index = self.font_combo.findText(self.watermark_font)
+        if index < 0:
+            # 设置默认字体，如果simhei可用则使用它，否则使用第一个字体
+            index = self.font_combo.findText("simhei")
+        self.font_combo.setCurrentIndex(max(index, 0) if system_font_names else -1)
+        self.font_combo.blockSignals(False)
+        self.font_combo.setEnabled(not self.use_image_watermark)
+        
     def init_ui(self):
         # 设置窗口标题和大小
         self.setWindowTitle('图片水印工具')
@@ -141,6 +237,23 @@ class ImageWatermarkTool(QMainWindow):
         export_action.setEnabled(False)  # 初始时禁用
         file_menu.addAction(export_action)
         
+        # 批量导出动作
+        self.batch_export_action = QAction('批量导出', self)
+        self.batch_export_action.setShortcut('Ctrl+Shift+E')
+        self.batch_export_action.triggered.connect(self.export_all_images)
+        self.batch_export_action.setEnabled(False)  # 初始时禁用
+        file_menu.addAction(self.batch_export_action)
+        
+        # 多规格导出动作
+        self.rendition_export_action = QAction('多规格导出', self)
+        self.rendition_export_action.triggered.connect(self.export_all_renditions)
+        self.rendition_export_action.setEnabled(False)  # 初始时禁用
+        file_menu.addAction(self.rendition_export_action)
+        
+        rendition_config_action = QAction('配置多规格导出...', self)
+        rendition_config_action.triggered.connect(self.configure_renditions)
+        file_menu.addAction(rendition_config_action)
+        
         file_menu.addSeparator()
         
         # 退出动作
@@ -167,14 +280,20 @@ class ImageWatermarkTool(QMainWindow):
         import_button.clicked.connect(self.import_images)
         left_layout.addWidget(import_button)
         
-        # 创建图片列表
-        self.image_list_widget = QListWidget()
-        self.image_list_widget.setViewMode(QListWidget.IconMode)
-        self.image_list_widget.setIconSize(QSize(120, 120))
-        self.image_list_widget.setResizeMode(QListWidget.Adjust)
-        self.image_list_widget.setMovement(QListWidget.Static)
-        self.image_list_widget.itemClicked.connect(self.on_image_item_clicked)
-        left_layout.addWidget(self.image_list_widget)
+        # 创建图片列表（所有项目尺寸相同，布局时不必逐项查询；大列表分批布局，界面不会卡住）
+        self.image_list_view = QListView()
+        self.image_list_view.setModel(self.image_model)
+        self.image_list_view.setViewMode(QListView.IconMode)
+        self.image_list_view.setIconSize(QSize(THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+        self.image_list_view.setGridSize(ITEM_SIZE)
+        self.image_list_view.setUniformItemSizes(True)
+        self.image_list_view.setResizeMode(QListView.Adjust)
+        self.image_list_view.setMovement(QListView.Static)
+        self.image_list_view.setLayoutMode(QListView.Batched)
+        self.image_list_view.setBatchSize(2000)
+        self.image_list_view.setWordWrap(True)
+        self.image_list_view.selectionModel().currentChanged.connect(self.on_image_selected)
+        left_layout.addWidget(self.image_list_view)
         
         # 添加到主布局
         main_layout.addWidget(left_panel, 1)
@@ -193,8 +312,34 @@ class ImageWatermarkTool(QMainWindow):
         self.preview_label.mousePressEvent = self.on_preview_mouse_press  # 鼠标按下事件
         self.preview_label.mouseMoveEvent = self.on_preview_mouse_move  # 鼠标移动事件
         self.preview_label.mouseReleaseEvent = self.on_preview_mouse_release  # 鼠标释放事件
+        self.preview_label.wheelEvent = self.on_preview_wheel  # 滚轮缩放
         center_layout.addWidget(self.preview_label)
         
+        # 缩放控制
+        zoom_layout = QHBoxLayout()
+        fit_button = QPushButton('适应窗口')
+        fit_button.clicked.connect(lambda: self.set_preview_zoom(None))
+        zoom_layout.addWidget(fit_button)
+        actual_size_button = QPushButton('1:1')
+        actual_size_button.setToolTip('按原图像素查看（以水印位置为中心）')
+        actual_size_button.clicked.connect(self.zoom_to_actual_size)
+        zoom_layout.addWidget(actual_size_button)
+        zoom_out_button = QPushButton('缩小')
+        zoom_out_button.clicked.connect(lambda: self.step_preview_zoom(-1))
+        zoom_layout.addWidget(zoom_out_button)
+        zoom_in_button = QPushButton('放大')
+        zoom_in_button.clicked.connect(lambda: self.step_preview_zoom(1))
+        zoom_layout.addWidget(zoom_in_button)
+        self.zoom_label = QLabel('')
+        self.zoom_label.setToolTip('滚轮缩放，中键或右键拖动平移')
+        zoom_layout.addWidget(self.zoom_label)
+        zoom_layout.addStretch()
+        center_layout.addLayout(zoom_layout)
+        
+        # 后台任务进度面板
+        self.progress_panel = ProgressPanel()
+        center_layout.addWidget(self.progress_panel)
+        
         # 添加到主布局
         main_layout.addWidget(center_panel, 3)
     
@@ -212,6 +357,11 @@ class ImageWatermarkTool(QMainWindow):
         self.export_button.setEnabled(False)  # 初始时禁用
         file_layout.addWidget(self.export_button)
         
+        self.batch_export_button = QPushButton('批量导出')
+        self.batch_export_button.clicked.connect(self.export_all_images)
+        self.batch_export_button.setEnabled(False)  # 初始时禁用
+        file_layout.addWidget(self.batch_export_button)
+        
         file_group.setLayout(file_layout)
         right_layout.addWidget(file_group)
         
@@ -248,7 +398,10 @@ class ImageWatermarkTool(QMainWindow):
         
         # 文本输入
         self.watermark_input = QLineEdit()
-        self.watermark_input.setPlaceholderText('请输入水印文本')
+        self.watermark_input.setPlaceholderText('请输入水印文本，可使用 {filename} {index} {exif_date} 等变量')
+        self.watermark_input.setToolTip('可用变量（按每张图片填写）：\n' + '\n'.join(
+            f'{{{name}}}  {description}' for name, description in watermark_core.TEXT_TOKENS.items()
+        ) + '\n序号可以指定格式，例如 {index:03d}')
         self.watermark_input.textChanged.connect(self.on_watermark_text_changed)
         
         # 图片水印选择
@@ -342,13 +495,8 @@ class ImageWatermarkTool(QMainWindow):
         # 字体选择
         font_layout = QHBoxLayout()
         self.font_combo = QComboBox()
-        # 使用系统已安装的字体填充下拉框
-        system_font_names = [os.path.splitext(font)[0] for font in self.system_fonts]
-        self.font_combo.addItems(system_font_names)
-        # 设置默认字体，如果simhei可用则使用它，否则使用第一个字体
-        default_font = "simhei" if "simhei" in system_font_names else (system_font_names[0] if system_font_names else "")
-        if default_font:
-            self.font_combo.setCurrentText(default_font)
+        # 系统字体扫描完成后再填充下拉框（见 _populate_font_combo）
+        self.font_combo.setEnabled(False)
         self.font_combo.currentTextChanged.connect(self.on_font_changed)
         font_layout.addWidget(self.font_combo)
         watermark_layout.addRow('字体:', font_layout)
@@ -394,6 +542,7 @@ class ImageWatermarkTool(QMainWindow):
         self.rotation_slider.setTickPosition(QSlider.TicksBelow)
         self.rotation_slider.setTickInterval(45)
         self.rotation_slider.valueChanged.connect(self.on_rotation_changed)
+        self.rotation_slider.sliderReleased.connect(self.save_current_settings)
         self.rotation_label = QLabel('0°')
         rotation_layout.addWidget(self.rotation_slider)
         rotation_layout.addWidget(self.rotation_label)
@@ -423,6 +572,26 @@ class ImageWatermarkTool(QMainWindow):
         effect_group.setLayout(effect_layout)
         watermark_layout.addRow(effect_group)
 
+        # 水印图层：把当前编辑的水印加入图层列表，再编辑下一个，导出时所有图层一起合成
+        layer_group = QGroupBox('水印图层')
+        layer_layout = QVBoxLayout()
+        self.layer_list = QListWidget()
+        self.layer_list.setMaximumHeight(90)
+        layer_layout.addWidget(self.layer_list)
+        layer_buttons_layout = QHBoxLayout()
+        add_layer_button = QPushButton('添加为图层')
+        add_layer_button.clicked.connect(self.add_watermark_layer)
+        edit_layer_button = QPushButton('取回编辑')
+        edit_layer_button.clicked.connect(self.edit_watermark_layer)
+        remove_layer_button = QPushButton('删除')
+        remove_layer_button.clicked.connect(self.remove_watermark_layer)
+        layer_buttons_layout.addWidget(add_layer_button)
+        layer_buttons_layout.addWidget(edit_layer_button)
+        layer_buttons_layout.addWidget(remove_layer_button)
+        layer_layout.addLayout(layer_buttons_layout)
+        layer_group.setLayout(layer_layout)
+        watermark_layout.addRow(layer_group)
+
         # 导出设置组
         export_group = QGroupBox('导出设置')
         export_layout = QFormLayout()
@@ -431,17 +600,29 @@ class ImageWatermarkTool(QMainWindow):
         self.format_group = QButtonGroup()
         self.jpeg_radio = QRadioButton('JPEG')
         self.png_radio = QRadioButton('PNG')
+        self.webp_radio = QRadioButton('WebP')
         self.format_group.addButton(self.jpeg_radio)
         self.format_group.addButton(self.png_radio)
-        self.jpeg_radio.setChecked(True)
+        self.format_group.addButton(self.webp_radio)
+        self.set_export_format_radio()
         self.jpeg_radio.toggled.connect(self.on_format_changed)
         self.png_radio.toggled.connect(self.on_format_changed)
+        self.webp_radio.toggled.connect(self.on_format_changed)
         
         format_layout = QHBoxLayout()
         format_layout.addWidget(self.jpeg_radio)
         format_layout.addWidget(self.png_radio)
+        format_layout.addWidget(self.webp_radio)
         export_layout.addRow('导出格式:', format_layout)
         
+        # 编码配置（速度与文件大小的取舍）
+        self.encoder_profile_combo = QComboBox()
+        for profile, display_name in watermark_core.ENCODER_PROFILE_NAMES.items():
+            self.encoder_profile_combo.addItem(display_name, profile)
+        self.encoder_profile_combo.setCurrentIndex(self.encoder_profile_combo.findData(self.encoder_profile))
+        self.encoder_profile_combo.currentIndexChanged.connect(self.on_encoder_profile_changed)
+        export_layout.addRow('编码配置:', self.encoder_profile_combo)
+        
         # 导出质量滑块
         self.quality_slider = QSlider(Qt.Horizontal)
         self.quality_slider.setRange(1, 100)
@@ -455,6 +636,47 @@ class ImageWatermarkTool(QMainWindow):
         self.quality_label = QLabel(f'{self.export_quality}%')
         export_layout.addRow('', self.quality_label)
         
+        # 目标文件大小（JPEG/WebP 自动选择不超过该大小的最高质量）
+        self.target_size_spin = QSpinBox()
+        self.target_size_spin.setRange(0, 100000)
+        self.target_size_spin.setSingleStep(50)
+        self.target_size_spin.setSuffix(' KB')
+        self.target_size_spin.setSpecialValueText('不限制')
+        self.target_size_spin.setValue(self.target_file_size_kb)
+        self.target_size_spin.valueChanged.connect(self.on_target_size_changed)
+        export_layout.addRow('文件大小上限:', self.target_size_spin)
+        
+        # 沿用原图JPEG量化表（避免重复量化带来的画质损失和体积膨胀）
+        self.keep_quality_checkbox = QCheckBox('JPEG原图沿用原始质量')
+        self.keep_quality_checkbox.setChecked(self.keep_source_quality)
+        self.keep_quality_checkbox.stateChanged.connect(self.on_keep_quality_toggled)
+        export_layout.addRow('', self.keep_quality_checkbox)
+        
+        # 批量导出并行数
+        self.workers_spin = QSpinBox()
+        self.workers_spin.setRange(1, max(1, os.cpu_count() or 1))
+        self.workers_spin.setValue(self.batch_workers)
+        self.workers_spin.valueChanged.connect(self.on_workers_changed)
+        export_layout.addRow('并行导出数:', self.workers_spin)
+        
+        # 批量导出内存预算
+        self.memory_budget_spin = QSpinBox()
+        self.memory_budget_spin.setRange(0, 1024 * 1024)
+        self.memory_budget_spin.setSingleStep(256)
+        self.memory_budget_spin.setSuffix(' MB')
+        self.memory_budget_spin.setSpecialValueText('不限制')
+        self.memory_budget_spin.setValue(self.batch_memory_budget_mb)
+        self.memory_budget_spin.valueChanged.connect(self.on_memory_budget_changed)
+        export_layout.addRow('导出内存预算:', self.memory_budget_spin)
+        
+        # 批量导出方式
+        self.batch_mode_combo = QComboBox()
+        for mode, display_name in BATCH_MODE_NAMES.items():
+            self.batch_mode_combo.addItem(display_name, mode)
+        self.batch_mode_combo.setCurrentIndex(self.batch_mode_combo.findData(self.batch_mode))
+        self.batch_mode_combo.currentIndexChanged.connect(self.on_batch_mode_changed)
+        export_layout.addRow('批量导出方式:', self.batch_mode_combo)
+        
         # 使用后缀复选框
         self.suffix_checkbox = QCheckBox('添加后缀')
         self.suffix_checkbox.setChecked(self.use_suffix)
@@ -524,51 +746,62 @@ class ImageWatermarkTool(QMainWindow):
             )
             
             if dir_path:
-                # 遍历文件夹中的所有图片文件
-                for root, _, files in os.walk(dir_path):
-                    for file in files:
-                        ext = os.path.splitext(file)[1].lower()
-                        if ext in ['.jpg', '.jpeg', '.png']:
-                            file_paths.append(os.path.join(root, file))
+                # 在后台遍历文件夹（网络磁盘上可能很慢），完成后再添加
+                self.scan_folder(dir_path)
+                return
         
         if file_paths:
             self.add_images(file_paths)
     
+    def scan_folder(self, dir_path):
+        """在后台遍历文件夹中的所有图片文件"""
+        def scan(task):
+            found = []
+            tracker = ProgressTracker(0)
+            for root, _, files in os.walk(dir_path):
+                if task.is_cancelled():
+                    break
+                for file in files:
+                    ext = os.path.splitext(file)[1].lower()
+                    if ext in watermark_core.SUPPORTED_EXTENSIONS:
+                        found.append(os.path.join(root, file))
+                        tracker.item_done()
+                task.report(tracker)
+            return found
+        
+        task = BackgroundTask('扫描文件夹', scan, self)
+        task.succeeded.connect(lambda found: self._on_folder_scanned(task, found))
+        task.failed.connect(lambda message: QMessageBox.warning(self, '错误', f'扫描文件夹时出错：\n{message}'))
+        self.progress_panel.start_task(task)
+    
+    def _on_folder_scanned(self, task, file_paths):
+        """文件夹扫描完成"""
+        self.progress_panel.finish_task(task, f'找到 {len(file_paths)} 张图片')
+        if file_paths:
+            self.add_images(file_paths)
+    
     def add_images(self, file_paths):
+        supported_paths = []
         for file_path in file_paths:
             # 检查文件格式
             ext = os.path.splitext(file_path)[1].lower()
             if ext not in ['.jpg', '.jpeg', '.png']:
                 QMessageBox.warning(self, '格式不支持', f'{file_path} 不是支持的图片格式')
                 continue
-            
-            # 添加到图片列表
-            if file_path not in self.image_list:
-                self.image_list.append(file_path)
-                
-                # 创建列表项
-                item = QListWidgetItem()
-                
-                # 加载图片并创建缩略图
-                pixmap = QPixmap(file_path)
-                if not pixmap.isNull():
-                    item.setIcon(QIcon(pixmap.scaled(120, 120, Qt.KeepAspectRatio, Qt.SmoothTransformation)))
-                    
-                    # 获取文件名作为显示文本
-                    file_name = os.path.basename(file_path)
-                    item.setText(file_name)
-                    item.setTextAlignment(Qt.AlignHCenter | Qt.AlignBottom)
-                    
-                    # 添加到列表
-                    self.image_list_widget.addItem(item)
+            supported_paths.append(file_path)
+        
+        # 添加到图片列表（已导入的图片跳过；缩略图在列表中显示到时才生成）
+        self.image_model.add_paths(supported_paths)
         
         # 如果这是第一次导入图片，自动选中第一张
         if self.image_list and self.current_image_index == -1:
-            self.image_list_widget.setCurrentRow(0)
-            self.on_image_item_clicked(self.image_list_widget.item(0))
+            self.image_list_view.setCurrentIndex(self.image_model.index(0))
         
         # 启用导出按钮
         self.export_button.setEnabled(True)
+        self.batch_export_button.setEnabled(bool(self.image_list))
+        self.batch_export_action.setEnabled(bool(self.image_list))
+        self.rendition_export_action.setEnabled(bool(self.image_list))
         
         # 启用菜单栏中的导出动作
         for action in self.menuBar().actions():
@@ -579,79 +812,77 @@ class ImageWatermarkTool(QMainWindow):
                         break
                 break
     
-    def on_image_item_clicked(self, item):
-        # 获取点击项的索引
-        index = self.image_list_widget.row(item)
+    def on_image_selected(self, current, previous=None):
+        # 获取选中项的索引（点击或用方向键切换）
+        index = current.row()
         if 0 <= index < len(self.image_list):
             self.current_image_index = index
             self.update_preview()
     
     def update_preview(self):
-        """请求更新预览（使用延迟机制避免频繁更新）"""
-        self.preview_timer.start()  # 重启计时器
+        """请求更新预览
+        
+        分两步：输入（拖动滑块、拖拽水印等）持续时节流显示低分辨率、最近邻缩放的快速帧；
+        输入停止片刻后换成准确渲染、平滑缩放的高质量帧。设置再次变化时两步都会被取消。
+        """
+        self.preview_generation += 1
+        if self.refine_task is not None:
+            self.refine_task.cancel()
+            self.refine_task = None
+        self.refine_timer.start()  # 重新计时
+        if not self.preview_timer.isActive():
+            self.preview_timer.start()
         
     def _update_preview_delayed(self):
-        """实际执行预览更新的方法（延迟执行）"""
+        """显示快速帧（已有准确的渲染结果时直接显示高质量帧）"""
         if 0 <= self.current_image_index < len(self.image_list):
             # 获取当前图片路径
             current_image_path = self.image_list[self.current_image_index]
             
-            # 生成缓存键
-            cache_key = (
-                current_image_path,
-                self.watermark_text,
-                self.watermark_position,
-                self.watermark_font_size,
-                self.watermark_opacity,
-                self.watermark_font,
-                self.watermark_bold,
-                self.watermark_italic,
-                self.watermark_color,
-                self.watermark_shadow,
-                self.watermark_stroke,
-                self.watermark_stroke_width,
-                self.watermark_stroke_color,
-                self.watermark_rotation,
-                self.use_image_watermark,
-                self.watermark_image_path,
-                self.watermark_image_size_ratio,
-                self.watermark_image_opacity
-            )
-            
-            # 检查是否有缓存的处理后图片
-            if cache_key in self.processed_image_cache:
-                q_image = self.processed_image_cache[cache_key]
+            # 渲染结果按影响水印像素的设置缓存
+            settings = self.get_watermark_settings()
+            settings_key = preview_settings_key(settings)
+            if self.preview_zoom is not None:
+                # 放大查看：只渲染可见的图块
+                try:
+                    pixmap = self._show_zoomed_preview(current_image_path, settings, settings_key, fast=True)
+                except Exception as e:
+                    print(f"渲染缩放预览时出错: {e}")
+                    self.preview_qimage = None
+                    self.preview_pixmap = None
+                    self.preview_label.setText('无法加载图片')
+                    return
             else:
-                # 检查是否有缓存的原始图片
-                if current_image_path not in self.original_image_cache:
-                    # 加载原始图片并缓存
-                    self.original_image_cache[current_image_path] = Image.open(current_image_path).copy()
-                
-                # 使用缓存的原始图片进行处理
-                image = self.original_image_cache[current_image_path].copy()
-                
-                # 如果有水印文本或选择了图片水印，应用水印
-                if self.watermark_text or (self.use_image_watermark and self.watermark_image_path):
-                    image = self.add_watermark_to_image(image)
-                
-                # 转换为QImage并缓存
-                q_image = self.pil_to_qimage(image)
-                self.processed_image_cache[cache_key] = q_image
-            
-            # 转换为QPixmap用于显示
-            pixmap = QPixmap.fromImage(q_image)
+                q_image = self.preview_cache.get_rendered(current_image_path, settings_key)
+                if q_image is not None:
+                    # 预取或之前渲染过：直接平滑缩放显示，不需要第二步
+                    self.refine_timer.stop()
+                    pixmap = self._show_preview_image(
+                        q_image, (current_image_path, settings_key), Qt.SmoothTransformation
+                    )
+                    self._prefetch_neighbors(settings)
+                else:
+                    try:
+                        # 在预览区域一半分辨率的代理图上渲染，最近邻放大
+                        display_size = self._preview_display_size()
+                        source, full_size = self.preview_cache.get_fast_source(
+                            current_image_path, max(1, max(display_size.width(), display_size.height()) // 2)
+                        )
+                    except Exception as e:
+                        print(f"加载预览图片时出错: {e}")
+                        self.preview_qimage = None
+                        self.preview_pixmap = None
+                        self.preview_label.setText('无法加载图片')
+                        return
+                    q_image, _ = self._render_preview_qimage(
+                        source, full_size, settings, fast=True,
+                        text_context=self._text_context(current_image_path, settings)
+                    )
+                    pixmap = self._show_preview_image(
+                        q_image, (current_image_path, settings_key, 'fast'), Qt.FastTransformation
+                    )
             
             if not pixmap.isNull():
-                # 调整图片大小以适应预览窗口
-                preview_size = self.preview_label.size()
-                scaled_pixmap = pixmap.scaled(
-                    preview_size.width() - 20, preview_size.height() - 20, 
-                    Qt.KeepAspectRatio, Qt.FastTransformation  # 使用FastTransformation代替SmoothTransformation
-                )
-                
-                # 更新预览标签
-                self.preview_label.setPixmap(scaled_pixmap)
-                
                 # 启用导出按钮（只在状态变化时更新）
                 if not self.export_button.isEnabled():
                     self.export_button.setEnabled(True)
@@ -666,8 +897,13 @@ class ImageWatermarkTool(QMainWindow):
                 # 显示错误信息
                 self.preview_label.setText('无法加载图片')
         else:
+            self.preview_qimage = None
+            self.preview_pixmap = None
             self.preview_label.setText('请导入图片')
             self.export_button.setEnabled(False)
+            self.batch_export_button.setEnabled(False)
+            self.batch_export_action.setEnabled(False)
+            self.rendition_export_action.setEnabled(False)
             for action in self.menuBar().actions():
                 if action.text() == '文件':
                     for sub_action in action.menu().actions():
@@ -676,10 +912,342 @@ class ImageWatermarkTool(QMainWindow):
                             break
                     break
             
+    def _preview_display_size(self):
+        """预览图在预览区域中可用的尺寸"""
+        size = self.preview_label.size()
+        return QSize(max(1, size.width() - 20), max(1, size.height() - 20))
+    
+    def _refine_preview(self):
+        """输入停止后显示高质量帧：在代理图上准确渲染后平滑缩放
+        
+        渲染和缩放在后台线程中进行，完成前设置又变化时结果只放入缓存、不显示。
+        放大查看时只需要渲染可见的图块，同样在后台线程中进行（见 _show_zoomed_preview）。
+        """
+        if not 0 <= self.current_image_index < len(self.image_list):
+            return
+        image_path = self.image_list[self.current_image_index]
+        settings = self.get_watermark_settings()
+        settings_key = preview_settings_key(settings)
+        if self.preview_zoom is not None:
+            try:
+                self._show_zoomed_preview(image_path, settings, settings_key)
+            except Exception as e:
+                print(f"渲染缩放预览时出错: {e}")
+            return
+        
+        q_image = self.preview_cache.get_rendered(image_path, settings_key)
+        if q_image is not None:
+            self._show_preview_image(q_image, (image_path, settings_key), Qt.SmoothTransformation)
+            self._prefetch_neighbors(settings)
+            return
+        
+        generation = self.preview_generation
+        display_size = self._preview_display_size()
+        text_context = self._text_context(image_path, settings)
+        
+        def render(task):
+            source, full_size = self.preview_cache.get_source(image_path)
+            if task.is_cancelled():
+                return None
+            q_image, cost = self._render_preview_qimage(source, full_size, settings, text_context=text_context)
+            self.preview_cache.put_rendered(image_path, settings_key, q_image, cost)
+            if task.is_cancelled():
+                return None
+            return q_image.scaled(display_size, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+        
+        task = BackgroundTask('渲染预览', render, self)
+        task.succeeded.connect(
+            lambda scaled: self._on_preview_refined(scaled, generation, image_path, settings, settings_key)
+        )
+        task.failed.connect(lambda message: print(f"渲染预览时出错: {message}"))
+        task.finished.connect(lambda: self.refine_tasks.discard(task))
+        self.refine_task = task
+        self.refine_tasks.add(task)
+        task.start()
+    
+    def _on_preview_refined(self, scaled, generation, image_path, settings, settings_key):
+        """高质量帧渲染完成（界面线程）"""
+        if scaled is None or generation != self.preview_generation:
+            return
+        self.refine_task = None
+        q_image = self.preview_cache.get_rendered(image_path, settings_key)
+        if q_image is not None:
+            self._show_preview_image(q_image, (image_path, settings_key), Qt.SmoothTransformation, scaled)
+        self._prefetch_neighbors(settings)
+    
+    def _prefetch_neighbors(self, settings):
+        """在后台预取前后几张图片，按当前设置预渲染（只在输入停止后进行，不与交互争抢CPU）"""
+        context_func = None
+        if watermark_core.has_text_tokens(settings):
+            context_func = lambda path: self._text_context(path, settings)
+        self.preview_cache.prefetch(
+            self.image_list, self.current_image_index, settings, self._render_preview_qimage, context_func
+        )
+    
+    def _show_preview_image(self, q_image, state_key, transformation, scaled=None):
+        """把渲染结果缩放到预览区域大小并显示，返回显示的像素图
+        
+        先缩放QImage再转换为QPixmap（只转换显示尺寸的像素），结果按 (设置状态, 尺寸) 缓存。
+        scaled 为已在后台缩放好的图片。
+        """
+        display_size = self._preview_display_size()
+        cache_key = (state_key, display_size.width(), display_size.height(), transformation == Qt.SmoothTransformation)
+        pixmap = self.display_pixmap_cache.get(cache_key)
+        if pixmap is None:
+            if scaled is None or scaled.size() != q_image.size().scaled(display_size, Qt.KeepAspectRatio):
+                scaled = q_image.scaled(display_size, Qt.KeepAspectRatio, transformation)
+            pixmap = QPixmap.fromImage(scaled)
+            self.display_pixmap_cache.put(cache_key, pixmap, pixmap.width() * pixmap.height() * 4)
+        self.preview_qimage = q_image
+        self.preview_state_key = state_key
+        self.preview_pixmap = pixmap
+        self.preview_view_rect = (0.0, 0.0, 1.0, 1.0)
+        self.preview_label.setPixmap(pixmap)
+        self._update_zoom_label()
+        return pixmap
+    
+    def _show_zoomed_preview(self, image_path, settings, settings_key, fast=False):
+        """按当前缩放比例显示视图范围，返回显示的像素图
+        
+        从金字塔中选择分辨率不低于显示所需的层，只取与视图相交的图块（每块单独合成水印并缓存），
+        拼接后缩放到显示尺寸；在 1:1 时显示的就是导出时的像素。
+        所需图块都已缓存时直接在界面线程中拼接；否则先放大显示代理图中的视图范围，
+        解码所需的层和渲染图块在后台线程中进行（大图解码第0层需要较长时间，不能阻塞界面）。
+        fast 为快速帧：所需图块没有全部缓存时也可以用低一级分辨率的层中已缓存的图块，最近邻缩放；
+        快速帧不启动后台渲染，输入停止后的高质量帧（见 _refine_preview）才启动。
+        """
+        pyramid = self.preview_pyramid
+        pyramid.font_name_to_path = self.get_font_name_to_path()
+        full_size = pyramid.full_size(image_path)
+        view = self._zoom_view(full_size)
+        level = choose_level(full_size, self.preview_zoom)
+        candidates = [(level, Qt.FastTransformation if fast else Qt.SmoothTransformation)]
+        if fast and level + 1 < level_count(full_size):
+            candidates.append((level + 1, Qt.FastTransformation))
+        for candidate_level, transformation in candidates:
+            rect = self._visible_level_rect(full_size, candidate_level, *view)
+            tiles = {}
+            for column, row in tiles_in_rect(level_size(full_size, candidate_level), *rect):
+                tile = pyramid.cached_tile(image_path, candidate_level, column, row, settings_key)
+                if tile is None:
+                    break
+                tiles[(column, row)] = tile
+            else:
+                return self._show_zoomed_tiles(image_path, settings_key, full_size, view, rect, tiles, transformation)
+        
+        # 所需图块还没有渲染：先显示代理图中的视图范围，图块在后台渲染
+        pixmap = self._show_zoom_proxy(image_path, settings, settings_key, full_size, view)
+        if not fast:
+            self._render_zoomed_tiles(image_path, settings, settings_key, full_size, view, level)
+        return pixmap
+    
+    def _zoom_view(self, full_size):
+        """当前缩放比例下视图在原图中的范围 (左, 上, 宽, 高)（图片比预览区域小的方向整体显示）"""
+        full_width, full_height = full_size
+        zoom = self.preview_zoom
+        display_size = self._preview_display_size()
+        view_width = min(full_width, display_size.width() / zoom)
+        view_height = min(full_height, display_size.height() / zoom)
+        left = self.preview_view_center[0] * full_width - view_width / 2
+        top = self.preview_view_center[1] * full_height - view_height / 2
+        left = max(0.0, min(left, full_width - view_width))
+        top = max(0.0, min(top, full_height - view_height))
+        self.preview_view_center = ((left + view_width / 2) / full_width, (top + view_height / 2) / full_height)
+        return left, top, view_width, view_height
+    
+    def _show_zoomed_tiles(self, image_path, settings_key, full_size, view, rect, tiles, transformation):
+        """拼接图块（{(列, 行): QImage}）并缩放到显示尺寸，返回显示的像素图"""
+        level_left, level_top, level_right, level_bottom = rect
+        canvas = QImage(level_right - level_left, level_bottom - level_top, QImage.Format_RGB32)
+        painter = QPainter(canvas)
+        for (column, row), tile in tiles.items():
+            painter.drawImage(column * TILE_SIZE - level_left, row * TILE_SIZE - level_top, tile)
+        painter.end()
+        return self._show_zoomed_image(image_path, settings_key, full_size, view, canvas, transformation)
+    
+    def _show_zoom_proxy(self, image_path, settings, settings_key, full_size, view):
+        """图块渲染完成前放大显示代理图中的视图范围，返回显示的像素图
+        
+        优先使用适应窗口时已渲染的代理图，没有时与适应窗口的快速帧一样在低分辨率代理图上快速渲染。
+        """
+        q_image = self.preview_cache.get_rendered(image_path, settings_key)
+        if q_image is None:
+            display_size = self._preview_display_size()
+            source, _ = self.preview_cache.get_fast_source(
+                image_path, max(1, max(display_size.width(), display_size.height()) // 2)
+            )
+            q_image, _ = self._render_preview_qimage(
+                source, full_size, settings, fast=True, text_context=self._text_context(image_path, settings)
+            )
+        scale_x = q_image.width() / full_size[0]
+        scale_y = q_image.height() / full_size[1]
+        left, top, view_width, view_height = view
+        crop = q_image.copy(int(left * scale_x), int(top * scale_y),
+                            max(1, int(math.ceil(view_width * scale_x))), max(1, int(math.ceil(view_height * scale_y))))
+        return self._show_zoomed_image(image_path, settings_key, full_size, view, crop, Qt.SmoothTransformation)
+    
+    def _show_zoomed_image(self, image_path, settings_key, full_size, view, canvas, transformation):
+        """把视图范围的图片缩放到显示尺寸并显示，返回显示的像素图"""
+        left, top, view_width, view_height = view
+        target = QSize(max(1, round(view_width * self.preview_zoom)), max(1, round(view_height * self.preview_zoom)))
+        if canvas.size() != target:
+            canvas = canvas.scaled(target, Qt.IgnoreAspectRatio, transformation)
+        pixmap = QPixmap.fromImage(canvas)
+        full_width, full_height = full_size
+        self.preview_qimage = None
+        self.preview_state_key = (image_path, settings_key)
+        self.preview_pixmap = pixmap
+        self.preview_view_rect = (left / full_width, top / full_height,
+                                  view_width / full_width, view_height / full_height)
+        self.preview_label.setPixmap(pixmap)
+        self._update_zoom_label()
+        return pixmap
+    
+    def _render_zoomed_tiles(self, image_path, settings, settings_key, full_size, view, level):
+        """在后台线程中解码所需的层并渲染视图中的图块，完成后设置和视图都没有变化时显示"""
+        pyramid = self.preview_pyramid
+        rect = self._visible_level_rect(full_size, level, *view)
+        needed = tiles_in_rect(level_size(full_size, level), *rect)
+        generation = self.preview_generation
+        text_context = self._text_context(image_path, settings)
+        
+        def render(task):
+            tiles = {}
+            for column, row in needed:
+                if task.is_cancelled():
+                    return None
+                tiles[(column, row)] = pyramid.tile(image_path, level, column, row, settings, settings_key,
+                                                    self._tile_to_qimage, text_context)
+            return tiles
+        
+        def show(tiles):
+            if tiles is None or generation != self.preview_generation:
+                return
+            self.refine_task = None
+            self._show_zoomed_tiles(image_path, settings_key, full_size, view, rect, tiles, Qt.SmoothTransformation)
+        
+        task = BackgroundTask('渲染缩放预览', render, self)
+        task.succeeded.connect(show)
+        task.failed.connect(lambda message: print(f"渲染缩放预览时出错: {message}"))
+        task.finished.connect(lambda: self.refine_tasks.discard(task))
+        self.refine_task = task
+        self.refine_tasks.add(task)
+        task.start()
+    
+    def _visible_level_rect(self, full_size, level, left, top, view_width, view_height):
+        """视图（原图坐标）在某层中的像素范围 (左, 上, 右, 下)"""
+        size = level_size(full_size, level)
+        scale = size[0] / full_size[0]
+        level_left = int(left * scale)
+        level_top = int(top * scale)
+        level_right = max(level_left + 1, min(size[0], int(math.ceil((left + view_width) * scale))))
+        level_bottom = max(level_top + 1, min(size[1], int(math.ceil((top + view_height) * scale))))
+        return level_left, level_top, level_right, level_bottom
+    
+    def _tile_to_qimage(self, tile):
+        """把渲染好的图块转换为QImage，返回 (QImage, 字节数)"""
+        return pil_to_qimage_copy(watermark_core.flatten_to_rgb(tile)), image_cost(tile)
+    
+    def _current_full_size(self):
+        """当前图片的原图尺寸，没有图片或无法读取时返回None"""
+        if not 0 <= self.current_image_index < len(self.image_list):
+            return None
+        try:
+            return self.preview_pyramid.full_size(self.image_list[self.current_image_index])
+        except Exception as e:
+            print(f"读取图片尺寸时出错: {e}")
+            return None
+    
+    def _fit_zoom(self, full_size):
+        """适应窗口时的缩放比例"""
+        display_size = self._preview_display_size()
+        return min(display_size.width() / full_size[0], display_size.height() / full_size[1])
+    
+    def _update_zoom_label(self):
+        full_size = self._current_full_size()
+        if full_size is None:
+            self.zoom_label.setText('')
+        elif self.preview_zoom is None:
+            self.zoom_label.setText(f"适应窗口 {min(1.0, self._fit_zoom(full_size)) * 100:.0f}%")
+        else:
+            self.zoom_label.setText(f"{self.preview_zoom * 100:.0f}%")
+    
+    def set_preview_zoom(self, zoom, anchor=None):
+        """设置预览缩放比例（None 为适应窗口）；anchor 为缩放时保持不动的预览区域坐标"""
+        full_size = self._current_full_size()
+        if full_size is None:
+            return
+        fit_zoom = self._fit_zoom(full_size)
+        if zoom is not None:
+            zoom = min(zoom, MAX_ZOOM)
+            # 不比适应窗口更大时回到适应窗口
+            if zoom <= fit_zoom:
+                zoom = None
+        if zoom is not None and anchor is not None:
+            # 让鼠标下的图片位置在缩放后保持在鼠标下
+            point = self._preview_point_to_image(anchor)
+            if point is not None:
+                offset_x = (anchor.x() - self.preview_label.width() / 2) / (zoom * full_size[0])
+                offset_y = (anchor.y() - self.preview_label.height() / 2) / (zoom * full_size[1])
+                self.preview_view_center = (point[0] - offset_x, point[1] - offset_y)
+        self.preview_zoom = zoom
+        self.update_preview()
+    
+    def step_preview_zoom(self, steps, anchor=None):
+        """按固定倍数放大（steps > 0）或缩小"""
+        full_size = self._current_full_size()
+        if full_size is None:
+            return
+        current = self.preview_zoom or self._fit_zoom(full_size)
+        self.set_preview_zoom(current * ZOOM_STEP ** steps, anchor)
+    
+    def zoom_to_actual_size(self):
+        """按原图像素查看；从适应窗口切换时以水印位置为中心"""
+        if self.preview_zoom is None:
+            self.preview_view_center = tuple(self.watermark_position)
+        self.set_preview_zoom(1.0)
+    
+    def _preview_point_to_image(self, pos):
+        """预览区域中的坐标转换为图片中的相对位置 (0-1)，不在图片上时返回None"""
+        pixmap = self.preview_label.pixmap()
+        if pixmap is None or pixmap.isNull():
+            return None
+        img_x = (self.preview_label.width() - pixmap.width()) // 2
+        img_y = (self.preview_label.height() - pixmap.height()) // 2
+        if not (img_x <= pos.x() < img_x + pixmap.width() and img_y <= pos.y() < img_y + pixmap.height()):
+            return None
+        left, top, width, height = self.preview_view_rect
+        return (left + (pos.x() - img_x) / pixmap.width() * width,
+                top + (pos.y() - img_y) / pixmap.height() * height)
+    
+    def on_preview_wheel(self, event):
+        """滚轮以鼠标位置为中心缩放预览"""
+        steps = event.angleDelta().y() / 120
+        if steps:
+            self.step_preview_zoom(steps, event.pos())
+        event.accept()
+    
+    def _on_resize_finished(self):
+        """调整窗口大小停止后，从渲染结果高质量缩放到新尺寸（缩放查看时重新取可见图块）"""
+        if self.preview_zoom is not None:
+            self.update_preview()
+        elif self.preview_qimage is not None:
+            self._show_preview_image(self.preview_qimage, self.preview_state_key, Qt.SmoothTransformation)
+    
     def clear_cache(self):
         """清除图片缓存，在必要时调用"""
-        self.original_image_cache.clear()
-        self.processed_image_cache.clear()
+        self.preview_cache.clear()
+        self.preview_pyramid.clear()
+        self.display_pixmap_cache.clear()
+    
+    def _render_preview_qimage(self, source, full_size, settings, fast=False, text_context=None):
+        """在代理图上渲染水印并转换为QImage，返回 (QImage, 字节数)（可在后台线程调用）
+        
+        fast 为 True 时（快速帧）旋转水印使用更快的插值方法，结果不要放入渲染缓存。
+        """
+        image = render_preview(source, full_size, settings, self.get_font_name_to_path(), fast, text_context)
+        q_image = pil_to_qimage_copy(watermark_core.flatten_to_rgb(image))
+        return q_image, image_cost(image)
                     
     def pil_to_qimage(self, pil_image):
         """将PIL Image转换为QImage（高性能版本）"""
@@ -707,493 +1275,47 @@ class ImageWatermarkTool(QMainWindow):
             return empty_image
         
     def get_system_fonts(self):
-        """获取系统已安装的字体列表（优化性能版本）"""
-        # 使用缓存避免重复扫描
-        if hasattr(self, 'cached_system_fonts') and hasattr(self, 'font_name_to_path'):
-            return self.cached_system_fonts
-        
-        fonts = []
-        
-        # 尝试从常见的字体目录获取字体
-        font_dirs = []
+        """获取系统已安装的字体列表（优化性能版本）
         
-        # 根据操作系统选择主要字体目录
-        if os.name == 'nt':
-            # Windows系统
-            font_dirs.append(r'C:\Windows\Fonts')
-        elif sys.platform == 'darwin':
-            # macOS系统
-            font_dirs.append('/Library/Fonts')
-        else:
-            # Linux/Unix系统
-            font_dirs.append('/usr/share/fonts')
-        
-        # 添加常用字体作为默认选项，包括更多支持中文的字体
-        common_fonts = [
-            'Arial.ttf', 'Arial.ttc', 'times.ttf', 'times.ttc',
-            # 中文字体
-            'simhei.ttf', 'simsun.ttc', 'msyh.ttc', 'msyhbd.ttc',
-            'msyhl.ttc', 'msyh_boot.ttf', 'msjh.ttc', 'msjhbd.ttc',
-            'msjh_boot.ttf', 'simsunb.ttf', 'simkai.ttf', 'simli.ttf',
-            'simfang.ttf', 'simyou.ttf', 'STSong.ttf', 'STZhongsong.ttf',
-            'STKaiti.ttf', 'STFangsong.ttf', 'STXihei.ttf', 'STCaiyun.ttf',
-            'STHupo.ttf', 'STLiti.ttf', 'STXingkai.ttf', 'STXingkai.ttf',
-            'STXingkai_boot.ttf',
-            # 其他常用字体
-            'calibri.ttf', 'verdana.ttf', 'tahoma.ttf', 'courier.ttf',
-            'comic.ttf', 'impact.ttf', 'georgia.ttf'
-        ]
-        
-        # 已知支持中文的字体名称列表
-        chinese_support_fonts = {
-            'simhei.ttf', 'simsun.ttc', 'simsunb.ttf',
-            'msyh.ttc', 'msyhbd.ttc', 'msyhl.ttc', 'msyh_boot.ttf',
-            'msjh.ttc', 'msjhbd.ttc', 'msjh_boot.ttf',
-            'simkai.ttf', 'simli.ttf', 'simfang.ttf', 'simyou.ttf',
-            'stsong.ttf', 'stzhongsong.ttf', 'stkaiti.ttf', 'stfangsong.ttf',
-            'stxihei.ttf', 'stcaiyun.ttf', 'sthupo.ttf', 'stliti.ttf',
-            'stxingkai.ttf', 'stxingkai_boot.ttf'
-        }
-        
-        for font_dir in font_dirs:
-            font_dir = os.path.expanduser(font_dir)
-            if os.path.exists(font_dir):
-                try:
-                    # 使用更快的os.listdir代替glob.glob
-                    items = os.listdir(font_dir)
-                    for item in items:
-                        
-                        # 检查文件扩展名
-                        ext = os.path.splitext(item)[1].lower()[1:]  # 获取不带点的扩展名
-                        if ext in ['ttf', 'ttc', 'otf']:
-                            fonts.append(os.path.join(font_dir, item))
-                except Exception:
-                    continue
-        
-        # 添加常用字体到结果中（如果它们不存在）
-        for common_font in common_fonts:
-            common_font_path = os.path.join(font_dirs[0], common_font) if font_dirs else common_font
-            if common_font_path not in fonts:
-                fonts.append(common_font_path)
-        
-        # 去重并保留顺序
-        seen = set()
-        unique_fonts = []
-        for font_path in fonts:
-            font_name = os.path.basename(font_path)
-            if font_name not in seen:
-                seen.add(font_name)
-                unique_fonts.append(font_path)
-        
-        # 创建字体名称到路径的映射
-        self.font_name_to_path = {}
-        result = []
-        
-        for font_path in unique_fonts:
-            font_name = os.path.basename(font_path)
-            # 检查是否支持中文
-            font_lower = font_name.lower()
-            supports_chinese = font_lower in chinese_support_fonts
-            
-            # 对于不支持中文的字体，添加标注
-            display_name = font_name
-            if not supports_chinese:
-                display_name = f"{font_name} [不支持中文]"
-            
-            result.append(display_name)
-            # 保存字体名称到完整路径的映射（使用原始名称作为键）
-            self.font_name_to_path[display_name] = font_path
-        
-        # 缓存结果
-        self.cached_system_fonts = result
+        启动时字体在后台扫描；扫描完成前需要字体时（例如立即渲染文本水印）在这里同步扫描。
+        """
+        # 使用缓存避免重复扫描
+        if self.font_name_to_path is not None:
+            return self.system_fonts
         
-        return result
+        # 扫描字体目录，同时创建字体名称到路径的映射
+        self.system_fonts, self.font_name_to_path = watermark_core.scan_system_fonts()
+        return self.system_fonts
+    
+    def get_font_name_to_path(self):
+        """字体显示名称到路径的映射（尚未扫描时先扫描）"""
+        self.get_system_fonts()
+        return self.font_name_to_path
+    
+    def get_watermark_settings(self):
+        """收集当前的水印与导出设置（供渲染核心和批量导出使用）"""
+        return {key: getattr(self, key) for key in watermark_core.DEFAULT_SETTINGS}
     
-    def add_watermark_to_image(self, image):
+    def add_watermark_to_image(self, image, text_context=None):
         """向图片添加水印（支持文本和图片，高性能版本）"""
-        # 快速路径：如果水印条件不满足，直接返回原图
-        if (not self.use_image_watermark and not self.watermark_text.strip()) or \
-           (self.use_image_watermark and not self.watermark_image_path):
-            return image
-        
-        # 获取图片尺寸
-        width, height = image.size
-        
-        # 根据水印类型执行不同的逻辑
-        if self.use_image_watermark:
-            # 图片水印逻辑
-            try:
-                # 加载水印图片
-                watermark_img = Image.open(self.watermark_image_path).convert('RGBA')
-                
-                # 计算水印图片尺寸（基于原图的百分比）
-                new_width = int(width * self.watermark_image_size_ratio / 100)
-                new_height = int(watermark_img.height * (new_width / watermark_img.width))
-                
-                # 调整水印图片大小
-                watermark_img = watermark_img.resize((new_width, new_height), Image.LANCZOS)
-                
-                # 应用旋转（如果需要）
-                if self.watermark_rotation != 0:
-                    # 计算旋转后的图像大小（确保不裁剪）
-                    radians = math.radians(self.watermark_rotation)
-                    rotated_width = int(abs(watermark_img.width * math.cos(radians)) + abs(watermark_img.height * math.sin(radians)))
-                    rotated_height = int(abs(watermark_img.width * math.sin(radians)) + abs(watermark_img.height * math.cos(radians)))
-                    
-                    # 旋转图像
-                    watermark_img = watermark_img.rotate(self.watermark_rotation, expand=True, resample=Image.BICUBIC)
-                    
-                    # 调整后的尺寸可能变化，更新尺寸变量
-                    new_width, new_height = watermark_img.size
-                
-                # 创建一个带有透明度的临时图像
-                temp_img = Image.new('RGBA', watermark_img.size)
-                for x in range(watermark_img.width):
-                    for y in range(watermark_img.height):
-                        r, g, b, a = watermark_img.getpixel((x, y))
-                        # 应用透明度
-                        new_a = int(a * self.watermark_image_opacity / 255)
-                        temp_img.putpixel((x, y), (r, g, b, new_a))
-                
-                # 计算水印位置
-                pos_x = int(self.watermark_position[0] * width - new_width / 2)
-                pos_y = int(self.watermark_position[1] * height - new_height / 2)
-                
-                # 确保位置在图片范围内
-                pos_x = max(0, min(pos_x, width - new_width))
-                pos_y = max(0, min(pos_y, height - new_height))
-                
-                # 将水印图片粘贴到原图上
-                image.paste(temp_img, (pos_x, pos_y), temp_img)
-            except Exception as e:
-                # 如果出现错误，记录日志但不中断程序
-                print(f"添加图片水印时出错: {str(e)}")
-        else:
-            # 文本水印逻辑
-            try:
-                # 尝试加载字体（使用缓存优化）
-                font = self._get_font()
-                
-                if font is None:
-                    # 如果无法加载字体，使用默认字体
-                    font = ImageFont.load_default()
-                
-                # 计算文本尺寸
-                try:
-                    # 兼容Pillow 9.0+的API变化
-                    bbox = ImageDraw.Draw(Image.new('RGBA', (1, 1))).textbbox((0, 0), self.watermark_text, font=font)
-                    text_width = bbox[2] - bbox[0]
-                    text_height = bbox[3] - bbox[1]
-                except:
-                    # 旧版Pillow
-                    try:
-                        text_width, text_height = ImageDraw.Draw(Image.new('RGBA', (1, 1))).textsize(self.watermark_text, font=font)
-                    except:
-                        # 降级为保守的默认值
-                        text_width, text_height = 100, 50
-                
-                # 如果需要旋转，创建一个足够大的临时图像来容纳旋转后的文本
-                if self.watermark_rotation != 0:
-                    # 创建一个足够大的临时图像来容纳原始文本
-                    temp_img = Image.new('RGBA', (text_width + 40, text_height + 40), (255, 255, 255, 0))
-                    draw = ImageDraw.Draw(temp_img, 'RGBA')
-                    
-                    # 将颜色名称转换为RGB值
-                    color_rgb = self.get_rgb_from_color(self.watermark_color)
-                    
-                    # 构建带透明度的颜色
-                    fill_color = (*color_rgb, self.watermark_opacity)
-                    
-                    # 计算文本在临时图像中的位置（居中）
-                    temp_pos_x = (temp_img.width - text_width) // 2
-                    temp_pos_y = (temp_img.height - text_height) // 2
-                    
-                    # 添加特效和文本
-                    if self.watermark_stroke:
-                        # 添加描边
-                        stroke_rgb = self.get_rgb_from_color(self.watermark_stroke_color)
-                        stroke_color = (*stroke_rgb, self.watermark_opacity)
-                        stroke_width = self.watermark_stroke_width
-                        
-                        # 基于文本尺寸的描边策略
-                        if text_width < 100 or text_height < 50:
-                            # 小文本：只绘制4个方向的描边
-                            for dx, dy in [(-1, 0), (1, 0), (0, -1), (0, 1)]:
-                                draw.text((temp_pos_x + dx * stroke_width, temp_pos_y + dy * stroke_width), 
-                                          self.watermark_text, fill=stroke_color, font=font)
-                        else:
-                            # 大文本：使用简化的偏移算法
-                            max_offset = min(stroke_width, 3)
-                            for dx in range(-max_offset, max_offset + 1):
-                                for dy in range(-max_offset, max_offset + 1):
-                                    if abs(dx) == max_offset or abs(dy) == max_offset:
-                                        draw.text((temp_pos_x + dx, temp_pos_y + dy), self.watermark_text, 
-                                                  fill=stroke_color, font=font)
-                    
-                    if self.watermark_shadow and not self.watermark_stroke:
-                        # 添加阴影
-                        shadow_offset = 2
-                        shadow_color = (0, 0, 0, int(self.watermark_opacity * 0.5))
-                        draw.text((temp_pos_x + shadow_offset, temp_pos_y + shadow_offset), self.watermark_text, 
-                                  fill=shadow_color, font=font)
-                    
-                    # 添加主水印文本
-                    draw.text((temp_pos_x, temp_pos_y), self.watermark_text, fill=fill_color, font=font)
-                    
-                    # 旋转文本图像，expand=True确保旋转后图像大小足够容纳整个文本
-                    temp_img = temp_img.rotate(self.watermark_rotation, expand=True, resample=Image.BICUBIC)
-                    
-                    # 计算旋转后图像的中心点位置
-                    rotated_width, rotated_height = temp_img.size
-                    
-                    # 计算水印在原图中的位置
-                    pos_x = int(self.watermark_position[0] * width - rotated_width / 2)
-                    pos_y = int(self.watermark_position[1] * height - rotated_height / 2)
-                    
-                    # 确保位置在图片范围内
-                    pos_x = max(0, min(pos_x, width - rotated_width))
-                    pos_y = max(0, min(pos_y, height - rotated_height))
-                    
-                    # 将旋转后的文本图像粘贴到原图上
-                    image.paste(temp_img, (pos_x, pos_y), temp_img)
-                else:
-                    # 不旋转的情况，直接在原图上绘制
-                    draw = ImageDraw.Draw(image, 'RGBA')
-                    
-                    # 计算水印位置
-                    pos_x = int(self.watermark_position[0] * width - text_width / 2)
-                    pos_y = int(self.watermark_position[1] * height - text_height / 2)
-                    
-                    # 确保位置在图片范围内
-                    pos_x = max(0, min(pos_x, width - text_width))
-                    pos_y = max(0, min(pos_y, height - text_height))
-                    
-                    # 将颜色名称转换为RGB值
-                    color_rgb = self.get_rgb_from_color(self.watermark_color)
-                    
-                    # 构建带透明度的颜色
-                    fill_color = (*color_rgb, self.watermark_opacity)
-                    
-                    # 添加特效 - 优先级优化
-                    if self.watermark_stroke:
-                        # 添加描边 - 高性能版本
-                        stroke_rgb = self.get_rgb_from_color(self.watermark_stroke_color)
-                        stroke_color = (*stroke_rgb, self.watermark_opacity)
-                        stroke_width = self.watermark_stroke_width
-                        
-                        # 基于文本尺寸的描边策略
-                        if text_width < 100 or text_height < 50:
-                            # 小文本：只绘制4个方向的描边
-                            for dx, dy in [(-1, 0), (1, 0), (0, -1), (0, 1)]:
-                                draw.text((pos_x + dx * stroke_width, pos_y + dy * stroke_width), 
-                                          self.watermark_text, fill=stroke_color, font=font)
-                        else:
-                            # 大文本：使用简化的偏移算法
-                            max_offset = min(stroke_width, 3)  # 限制最大偏移量以提高性能
-                            for dx in range(-max_offset, max_offset + 1):
-                                for dy in range(-max_offset, max_offset + 1):
-                                    # 只绘制边缘点，减少内部点的绘制
-                                    if abs(dx) == max_offset or abs(dy) == max_offset:
-                                        draw.text((pos_x + dx, pos_y + dy), self.watermark_text, 
-                                                  fill=stroke_color, font=font)
-                    
-                    if self.watermark_shadow and not self.watermark_stroke:
-                        # 只有在没有描边的情况下才添加阴影
-                        shadow_offset = 2
-                        shadow_color = (0, 0, 0, int(self.watermark_opacity * 0.5))
-                        draw.text((pos_x + shadow_offset, pos_y + shadow_offset), self.watermark_text, 
-                                  fill=shadow_color, font=font)
-                    
-                    # 添加主水印文本
-                    draw.text((pos_x, pos_y), self.watermark_text, fill=fill_color, font=font)
-            except Exception as e:
-                # 如果出现错误，记录日志但不中断程序
-                print(f"添加文本水印时出错: {str(e)}")
-        
-        return image
+        return watermark_core.add_watermark_to_image(
+            image, self.get_watermark_settings(), font=self._get_font(), text_context=text_context
+        )
+    
+    def _text_context(self, image_path, settings=None):
+        """图片的文本变量值（序号为图片在列表中的位置，从1开始）；水印中没有变量时返回 None（可在后台线程调用）"""
+        if not watermark_core.has_text_tokens(settings or self.get_watermark_settings()):
+            return None
+        row = self.image_model.row_of(image_path)
+        return watermark_core.get_text_context(image_path, row + 1 if row >= 0 else None)
         
     def _get_font(self):
         """获取字体（高性能版本，带缓存优化，增强中文显示支持）"""
-        # 生成字体缓存键
-        font_key = (
-            self.watermark_font,
-            self.watermark_font_size,
-            self.watermark_bold,
-            self.watermark_italic
-        )
-        
-        # 快速路径：检查是否有缓存的字体
-        if font_key in self.cached_fonts:
-            return self.cached_fonts[font_key]
-        
-        font_path = None
-        
-        try:
-            # 优先使用字体名称到路径的映射（最可靠的方法）
-            if hasattr(self, 'font_name_to_path') and self.watermark_font in self.font_name_to_path:
-                font_path = self.font_name_to_path[self.watermark_font]
-            else:
-                # 处理带标注的字体名称，提取原始字体名
-                original_font_name = self.watermark_font
-                if '[' in self.watermark_font:
-                    # 移除标注部分
-                    original_font_name = self.watermark_font.split('[')[0].strip()
-                
-                # 特殊处理常见字体，确保正确加载
-                # 增加更多中文字体支持
-                common_fonts = {
-                    'times': 'times.ttf',
-                    'times new roman': 'times.ttf',
-                    'calibri': 'calibri.ttf',
-                    'arial': 'arial.ttf',
-                    'courier': 'cour.ttf',
-                    'verdana': 'verdana.ttf',
-                    'tahoma': 'tahoma.ttf',
-                    'comic sans ms': 'comic.ttf',
-                    'impact': 'impact.ttf',
-                    'georgia': 'georgia.ttf',
-                    'palatino': 'pala.ttf',
-                    'bookman': 'bookman.ttf',
-                    'century': 'century.ttf',
-                    'simhei': 'simhei.ttf',
-                    'simsun': 'simsun.ttc',
-                    'msyh': 'msyh.ttc',
-                    'msyhbd': 'msyhbd.ttc',
-                    'microsoft yahei': 'msyh.ttc',
-                    'microsoft yahei bold': 'msyhbd.ttc',
-                    '微软雅黑': 'msyh.ttc',
-                    '微软雅黑粗体': 'msyhbd.ttc',
-                    '黑体': 'simhei.ttf',
-                    '宋体': 'simsun.ttc',
-                    'simsun': 'simsun.ttc'
-                }
-                
-                # 尝试常见字体映射
-                font_lower = original_font_name.lower()
-                system_font_dir = r'C:\Windows\Fonts'
-                
-                # 检查水印文本是否包含中文
-                has_chinese_text = False
-                if hasattr(self, 'watermark_text') and self.watermark_text:
-                    has_chinese_text = any('\u4e00-\u9fff' in char.encode().decode('unicode-escape') for char in self.watermark_text)
-                
-                # 检查字体名称是否包含中文
-                has_chinese_font_name = any('\u4e00-\u9fff' in char.encode().decode('unicode-escape') for char in self.watermark_font)
-                
-                # 如果水印文本包含中文，或者字体名称包含中文，或者找不到指定字体且是常用中文字体，优先使用中文字体
-                if has_chinese_text or has_chinese_font_name or (not font_lower in common_fonts and not os.path.isfile(self.watermark_font)):
-                    # 优先尝试中文字体
-                    for chinese_font in ['simhei.ttf', 'msyh.ttc', 'simsun.ttc']:
-                        candidate = os.path.join(system_font_dir, chinese_font)
-                        if os.path.exists(system_font_dir) and os.path.isfile(candidate):
-                            font_path = candidate
-                            break
-                
-                # 如果还没找到，尝试常见字体映射
-                if not font_path and font_lower in common_fonts and os.path.exists(system_font_dir):
-                    candidate = os.path.join(system_font_dir, common_fonts[font_lower])
-                    if os.path.isfile(candidate):
-                        font_path = candidate
-                
-                # 如果仍然没有找到，尝试构建完整路径
-                if not font_path:
-                    # 检查是否已经是完整路径
-                    if os.path.isfile(original_font_name):
-                        font_path = original_font_name
-                    else:
-                        # 尝试在系统字体目录中查找
-                        if os.path.exists(system_font_dir):
-                            # 尝试添加常见扩展名
-                            font_file = original_font_name
-                            if not any(font_file.lower().endswith(ext) for ext in ['.ttf', '.ttc', '.otf']):
-                                for ext in ['.ttf', '.ttc', '.otf']:
-                                    candidate = os.path.join(system_font_dir, f'{font_file}{ext}')
-                                    if os.path.isfile(candidate):
-                                        font_path = candidate
-                                        break
-            
-            # 如果找到了字体路径，尝试加载
-            if font_path and os.path.isfile(font_path):
-                # 确保使用支持中文的字体加载方式
-                font = ImageFont.truetype(font_path, self.watermark_font_size, encoding="utf-8")
-            else:
-                # 如果没有找到字体路径，尝试让PIL自动查找
-                try:
-                    font = ImageFont.truetype(original_font_name, self.watermark_font_size, encoding="utf-8")
-                except:
-                    # 回退到不指定encoding的方式
-                    font = ImageFont.truetype(original_font_name, self.watermark_font_size)
-            
-            # 缓存成功加载的字体
-            self.cached_fonts[font_key] = font
-        except Exception as e:
-            print(f"加载字体时出错: {str(e)}")
-            # 如果所有尝试都失败，强制使用中文字体
-            try:
-                # 优先尝试中文字体作为后备
-                fallback_fonts = ['simhei.ttf', 'msyh.ttc', 'simsun.ttc', 'Arial.ttf']
-                fallback_font = None
-                
-                system_font_dir = r'C:\Windows\Fonts'
-                if os.path.exists(system_font_dir):
-                    for fb_font in fallback_fonts:
-                        fb_path = os.path.join(system_font_dir, fb_font)
-                        if os.path.isfile(fb_path):
-                            fallback_font = fb_path
-                            break
-                
-                if fallback_font:
-                    font = ImageFont.truetype(fallback_font, self.watermark_font_size, encoding="utf-8")
-                else:
-                    # 最后使用PIL默认字体
-                    font = ImageFont.load_default()
-                
-                self.cached_fonts[font_key] = font
-            except Exception as fallback_error:
-                print(f"加载后备字体时出错: {str(fallback_error)}")
-                # 万不得已的情况
-                font = ImageFont.load_default()
-                self.cached_fonts[font_key] = font
-        
-        return font
+        return watermark_core.load_font(self.get_watermark_settings(), self.get_font_name_to_path())
     
     def get_rgb_from_color(self, color):
         """将颜色名称或代码转换为RGB值，确保颜色一致性"""
-        if isinstance(color, str):
-            # 如果是颜色名称，使用QColor转换
-            q_color = QColor(color)
-            # 确保颜色值有效
-            if q_color.isValid():
-                return (q_color.red(), q_color.green(), q_color.blue())
-            else:
-                # 尝试处理常见的十六进制格式
-                if color.startswith('#'):
-                    try:
-                        # 处理 #RGB 格式
-                        if len(color) == 4:
-                            r = int(color[1] * 2, 16)
-                            g = int(color[2] * 2, 16)
-                            b = int(color[3] * 2, 16)
-                            return (r, g, b)
-                        # 处理 #RRGGBB 格式
-                        elif len(color) == 7:
-                            r = int(color[1:3], 16)
-                            g = int(color[3:5], 16)
-                            b = int(color[5:7], 16)
-                            return (r, g, b)
-                    except ValueError:
-                        pass
-                # 默认返回白色
-                return (255, 255, 255)
-        elif isinstance(color, tuple):
-            # 确保RGB值在有效范围内
-            if len(color) == 3:
-                return tuple(max(0, min(255, int(c))) for c in color)
-            elif len(color) == 4:
-                # 忽略alpha通道，只返回RGB值
-                return tuple(max(0, min(255, int(c))) for c in color[:3])
-        # 默认返回白色
-        return (255, 255, 255)
+        return watermark_core.get_rgb_from_color(color)
         
     def on_watermark_text_changed(self, text):
         """水印文本变化时更新"""
@@ -1277,7 +1399,9 @@ class ImageWatermarkTool(QMainWindow):
         self.watermark_rotation = value
         self.rotation_label.setText(f'{value}°')
         self.update_preview()
-        self.save_current_settings()
+        # 拖动滑块时松开后再保存（见 sliderReleased），不必每一度都写一次设置文件
+        if not self.rotation_slider.isSliderDown():
+            self.save_current_settings()
         
     def on_watermark_text_changed(self, text):
         """水印文本变化时更新"""
@@ -1349,6 +1473,10 @@ class ImageWatermarkTool(QMainWindow):
                 
                 self.watermark_image_path = file_path
                 self.watermark_image_label.setText(os.path.basename(file_path))
+                # 重新选择同一文件时内容可能已变化
+                self.preview_cache.clear_rendered()
+                self.display_pixmap_cache.clear()
+                self.preview_pyramid.clear_tiles()
                 self.update_preview()
                 self.save_current_settings()
             except Exception as e:
@@ -1368,6 +1496,72 @@ class ImageWatermarkTool(QMainWindow):
         self.update_preview()
         self.save_current_settings()
         
+    def _current_layer(self):
+        """当前编辑的水印（主水印）的图层设置"""
+        return {key: getattr(self, key) for key in watermark_core.LAYER_SETTING_KEYS}
+    
+    def _layer_summary(self, layer):
+        """图层列表中显示的说明"""
+        position_name = self._get_position_name(tuple(layer["watermark_position"]))
+        if layer["use_image_watermark"]:
+            return f"图片: {os.path.basename(layer['watermark_image_path'])} ({position_name})"
+        return f"文本: {layer['watermark_text']} ({position_name})"
+    
+    def refresh_layer_list(self):
+        """按 watermark_layers 重新填充图层列表"""
+        self.layer_list.clear()
+        for layer in self.watermark_layers:
+            self.layer_list.addItem(self._layer_summary(layer))
+    
+    def _on_layers_changed(self):
+        self.refresh_layer_list()
+        self.update_preview()
+        self.save_current_settings()
+    
+    def add_watermark_layer(self):
+        """把当前编辑的水印加入图层列表，并清空编辑区以便添加下一个水印"""
+        layer = self._current_layer()
+        if not watermark_core.layer_has_watermark(layer):
+            QMessageBox.warning(self, "提示", "请先输入水印文本或选择水印图片")
+            return
+        self.watermark_layers = self.watermark_layers + [watermark_core.normalize_layer(layer)]
+        self.restoring_settings = True
+        try:
+            self.apply_settings({"watermark_text": "", "watermark_image_path": ""})
+            self.watermark_image_label.setText('未选择图片')
+        finally:
+            self.restoring_settings = False
+        self._on_layers_changed()
+    
+    def edit_watermark_layer(self):
+        """把选中的图层取回编辑区；编辑区原有的水印放回该图层的位置"""
+        row = self.layer_list.currentRow()
+        if row < 0:
+            QMessageBox.warning(self, "提示", "请先选择一个图层")
+            return
+        layers = list(self.watermark_layers)
+        layer = layers.pop(row)
+        current = self._current_layer()
+        if watermark_core.layer_has_watermark(current):
+            layers.insert(row, watermark_core.normalize_layer(current))
+        self.watermark_layers = layers
+        self.restoring_settings = True
+        try:
+            self.apply_settings(layer)
+            self.on_watermark_type_changed(True, self.use_image_watermark)
+        finally:
+            self.restoring_settings = False
+        self._on_layers_changed()
+    
+    def remove_watermark_layer(self):
+        """删除选中的图层"""
+        row = self.layer_list.currentRow()
+        if row < 0:
+            QMessageBox.warning(self, "提示", "请先选择一个图层")
+            return
+        self.watermark_layers = self.watermark_layers[:row] + self.watermark_layers[row + 1:]
+        self._on_layers_changed()
+    
     def set_watermark_position(self, position_name):
         """设置水印预设位置"""
         if position_name in self.position_presets:
@@ -1391,12 +1585,57 @@ class ImageWatermarkTool(QMainWindow):
             self.export_format = "JPEG"
         elif self.png_radio.isChecked():
             self.export_format = "PNG"
+        elif self.webp_radio.isChecked():
+            self.export_format = "WEBP"
+    
+    def set_export_format_radio(self):
+        """根据导出格式设置单选按钮状态"""
+        if self.export_format == "JPEG":
+            self.jpeg_radio.setChecked(True)
+        elif self.export_format == "WEBP":
+            self.webp_radio.setChecked(True)
+        else:
+            self.png_radio.setChecked(True)
+    
+    def on_encoder_profile_changed(self, index):
+        """编码配置变化时更新"""
+        profile = self.encoder_profile_combo.itemData(index)
+        if profile:
+            self.encoder_profile = profile
+            self.save_current_settings()
     
     def on_quality_changed(self, value):
         """导出质量变化时更新"""
         self.export_quality = value
         self.quality_label.setText(f'{value}%')
     
+    def on_target_size_changed(self, value):
+        """目标文件大小变化时更新"""
+        self.target_file_size_kb = value
+        self.save_current_settings()
+    
+    def on_keep_quality_toggled(self, state):
+        """是否沿用原图JPEG质量变化时更新"""
+        self.keep_source_quality = (state == Qt.Checked)
+        self.save_current_settings()
+    
+    def on_workers_changed(self, value):
+        """批量导出并行数变化时更新"""
+        self.batch_workers = value
+        self.save_current_settings()
+    
+    def on_memory_budget_changed(self, value):
+        """批量导出内存预算变化时更新"""
+        self.batch_memory_budget_mb = value
+        self.save_current_settings()
+    
+    def on_batch_mode_changed(self, index):
+        """批量导出方式变化时更新"""
+        mode = self.batch_mode_combo.itemData(index)
+        if mode:
+            self.batch_mode = mode
+            self.save_current_settings()
+    
     def on_suffix_toggled(self, state):
         """是否使用后缀变化时更新"""
         self.use_suffix = (state == Qt.Checked)
@@ -1430,28 +1669,9 @@ class ImageWatermarkTool(QMainWindow):
     
     def generate_output_filename(self, original_path):
         """生成输出文件名"""
-        dir_path, file_name = os.path.split(original_path)
-        base_name, ext = os.path.splitext(file_name)
-        
-        # 如果使用后缀，添加后缀
-        if self.use_suffix:
-            output_name = f"{base_name}{self.suffix_text}"
-        else:
-            output_name = base_name
-        
-        # 根据导出格式设置扩展名
-        if self.export_format == "JPEG":
-            output_ext = ".jpg"
-        else:
-            output_ext = ".png"
-        
-        # 根据保存选项确定保存目录
-        if self.save_to_same_dir:
-            save_dir = dir_path
-        else:
-            save_dir = self.last_export_dir
-        
-        return os.path.join(save_dir, output_name + output_ext)
+        return watermark_core.generate_output_filename(
+            original_path, self.get_watermark_settings(), self.last_export_dir
+        )
     
     def export_image(self):
         """导出图片功能"""
@@ -1471,30 +1691,24 @@ class ImageWatermarkTool(QMainWindow):
                 self, 
                 '保存图片', 
                 default_save_path,
-                'JPEG文件 (*.jpg);;PNG文件 (*.png);;所有文件 (*)'
+                'JPEG文件 (*.jpg);;PNG文件 (*.png);;WebP文件 (*.webp);;所有文件 (*)'
             )
             
             if file_path:
                 # 更新上次导出目录
                 self.last_export_dir = os.path.dirname(file_path)
                 
-                # 加载原图
+                # 加载原图（在添加水印前读取JPEG源图的量化表）
                 image = Image.open(current_image_path)
+                source_encoding = watermark_core.read_jpeg_encoding(image)
                 
-                # 应用水印
-                if self.watermark_text or (self.use_image_watermark and self.watermark_image_path):
-                    image = self.add_watermark_to_image(image)
+                # 应用水印（变量的EXIF字段从原图读取）
+                if watermark_core.has_watermark(self.get_watermark_settings()):
+                    text_context = self._text_context(current_image_path)
+                    image = self.add_watermark_to_image(image, text_context)
                 
                 # 保存图片
-                if self.export_format == "JPEG":
-                    # 确保图片模式兼容JPEG
-                    if image.mode == 'RGBA':
-                        background = Image.new('RGB', image.size, (255, 255, 255))
-                        background.paste(image, mask=image.split()[3])  # 3 is the alpha channel
-                        image = background
-                    image.save(file_path, 'JPEG', quality=self.export_quality)
-                else:
-                    image.save(file_path, 'PNG')
+                watermark_core.save_image_atomic(image, file_path, self.get_watermark_settings(), source_encoding)
                 
                 # 显示成功消息
                 QMessageBox.information(self, '成功', f'图片已成功保存到：\n{file_path}')
@@ -1502,6 +1716,145 @@ class ImageWatermarkTool(QMainWindow):
             # 显示错误消息
             QMessageBox.critical(self, '错误', f'导出图片时出错：\n{str(e)}')
     
+    def export_all_images(self):
+        """批量导出所有已导入的图片（增量导出，跳过未变化的图片）"""
+        self._run_batch_export()
+    
+    def export_all_renditions(self):
+        """按多规格配置批量导出（每张图片只解码一次）"""
+        self._run_batch_export(self.renditions)
+    
+    def configure_renditions(self):
+        """编辑多规格导出配置"""
+        text, ok = QInputDialog.getMultiLineText(
+            self, '配置多规格导出',
+            '每行一个规格：名称, 长边像素(0为原尺寸), 格式(JPEG/PNG/WEBP), 质量[, 模板名称]',
+            format_rendition_lines(self.renditions)
+        )
+        if not ok:
+            return
+        try:
+            renditions = parse_rendition_lines(text)
+            if not renditions:
+                raise ValueError('至少需要一个规格')
+        except ValueError as e:
+            QMessageBox.warning(self, '错误', f'规格配置有误：\n{str(e)}')
+            return
+        self.renditions = renditions
+        self.save_current_settings()
+    
+    def _run_batch_export(self, renditions=None):
+        """执行批量导出（renditions 不为空时为多规格导出）"""
+        if not self.image_list:
+            QMessageBox.warning(self, '错误', '请先导入图片')
+            return
+        
+        if self.export_task is not None:
+            QMessageBox.information(self, '提示', '已有批量导出任务正在进行')
+            return
+        
+        export_dir = self.last_export_dir
+        if not self.save_to_same_dir:
+            # 选择输出文件夹
+            export_dir = QFileDialog.getExistingDirectory(self, '选择输出文件夹', self.last_export_dir)
+            if not export_dir:
+                return
+            
+            # 默认禁止导出到原文件夹，防止覆盖原图
+            source_dirs = {os.path.normcase(os.path.dirname(os.path.abspath(p))) for p in self.image_list}
+            if os.path.normcase(os.path.abspath(export_dir)) in source_dirs:
+                QMessageBox.warning(self, '错误', '输出文件夹不能是原图所在文件夹')
+                return
+            self.last_export_dir = export_dir
+            self.save_current_settings()
+        
+        try:
+            # 创建任务日志，异常退出后可以继续
+            journal = BatchJournal.create(
+                get_jobs_dir(self.templates_dir), self.get_watermark_settings(), export_dir,
+                self.image_list, renditions=renditions, templates_dir=self.templates_dir
+            )
+            self._execute_batch_job(journal)
+        except Exception as e:
+            QMessageBox.critical(self, '错误', f'批量导出时出错：\n{str(e)}')
+    
+    def _execute_batch_job(self, journal):
+        """在后台按任务日志执行批量导出（新任务和续传共用）"""
+        job = journal.job
+        # 清理上次异常退出时遗留的临时文件
+        for output_dir in journal.output_dirs():
+            watermark_core.remove_stale_temp_files(output_dir)
+        
+        exporter = BatchExporter(
+            job["settings"], job["export_dir"], self.get_font_name_to_path(),
+            renditions=job.get("renditions"), templates_dir=job.get("templates_dir")
+        )
+        workers = self.batch_workers
+        batch_mode = self.batch_mode
+        memory_budget_mb = self.batch_memory_budget_mb
+        
+        def export(task):
+            try:
+                return exporter.run(
+                    job["image_paths"], progress_callback=task.report, journal=journal,
+                    workers=workers, cancel_event=task.cancel_event, memory_budget_mb=memory_budget_mb,
+                    use_processes=(batch_mode == "processes"), async_io=(batch_mode == "async_io")
+                )
+            finally:
+                journal.close()
+        
+        task = BackgroundTask('批量导出', export, self)
+        task.succeeded.connect(lambda result: self._on_batch_export_finished(task, journal, result))
+        task.failed.connect(lambda message: self._on_batch_export_failed(task, message))
+        self.export_task = task
+        self.progress_panel.start_task(task)
+    
+    def _on_batch_export_finished(self, task, journal, result):
+        """批量导出结束（完成或取消）"""
+        self.export_task = None
+        # 关闭窗口导致的取消保留任务日志，下次启动时可以继续
+        if not (result.cancelled and self.is_closing):
+            journal.finish()
+        
+        message = f'批量导出{"已取消" if result.cancelled else "完成"}：{result.summary()}'
+        self.progress_panel.finish_task(task, message)
+        self.statusBar().showMessage(message, 10000)
+        if result.failed and not self.is_closing:
+            failed_names = '\n'.join(os.path.basename(path) for path, _ in result.failed[:10])
+            QMessageBox.warning(self, '完成', f'{message}\n\n失败的图片：\n{failed_names}')
+    
+    def _on_batch_export_failed(self, task, message):
+        """批量导出出错"""
+        self.export_task = None
+        self.progress_panel.finish_task(task, f'批量导出出错：{message}')
+        QMessageBox.critical(self, '错误', f'批量导出时出错：\n{message}')
+    
+    def check_unfinished_jobs(self):
+        """启动时检查未完成的批量导出任务，询问是否继续"""
+        for journal in find_unfinished_jobs(get_jobs_dir(self.templates_dir)):
+            job = journal.job
+            total = len(job["image_paths"])
+            pending = len(journal.pending_paths())
+            reply = QMessageBox.question(
+                self, '继续未完成的任务',
+                f'发现未完成的批量导出任务：\n'
+                f'输出目录：{job["export_dir"]}\n'
+                f'已完成 {total - pending} / {total} 张\n\n'
+                f'• 是 - 从上次提交的图片继续导出\n'
+                f'• 否 - 放弃该任务\n'
+                f'• 取消 - 暂不处理，下次启动时再询问',
+                QMessageBox.Yes | QMessageBox.No | QMessageBox.Cancel,
+                QMessageBox.Yes
+            )
+            if reply == QMessageBox.Yes:
+                # 一次只续传一个任务，其余任务下次启动时再询问
+                self._execute_batch_job(journal)
+                break
+            elif reply == QMessageBox.No:
+                for output_dir in journal.output_dirs():
+                    watermark_core.remove_stale_temp_files(output_dir)
+                journal.finish()
+    
     def show_about(self):
         QMessageBox.about(self, '关于', '图片水印工具 v1.0\n\n一款用于为图片添加自定义文本水印的工具。')
     
@@ -1514,15 +1867,27 @@ class ImageWatermarkTool(QMainWindow):
         file_paths = [url.toLocalFile() for url in event.mimeData().urls()]
         self.add_images(file_paths)
     
-    # 调整窗口大小时更新预览
+    # 调整窗口大小时只缩放已显示的像素图，不重新渲染
     def resizeEvent(self, event):
         super().resizeEvent(event)
-        if 0 <= self.current_image_index < len(self.image_list):
-            self.update_preview()
+        if self.preview_zoom is not None:
+            # 缩放查看时比例不变，停止后按新的视图大小取图块
+            self.resize_timer.start()
+        elif self.preview_pixmap is not None and 0 <= self.current_image_index < len(self.image_list):
+            self.preview_label.setPixmap(self.preview_pixmap.scaled(
+                self._preview_display_size(), Qt.KeepAspectRatio, Qt.FastTransformation
+            ))
+            self.resize_timer.start()
     
     def on_preview_mouse_press(self, event):
-        """处理预览区域的鼠标按下事件，开始拖拽水印"""
-        if 0 <= self.current_image_index < len(self.image_list) and (self.watermark_text or (self.use_image_watermark and self.watermark_image_path)):
+        """处理预览区域的鼠标按下事件，开始拖拽水印（放大查看时中键或右键拖动平移）"""
+        if event.button() in (Qt.MiddleButton, Qt.RightButton):
+            if self.preview_zoom is not None:
+                self.is_panning = True
+                self.pan_start_pos = (event.pos().x(), event.pos().y())
+                self.setCursor(Qt.SizeAllCursor)
+            return
+        if event.button() == Qt.LeftButton and 0 <= self.current_image_index < len(self.image_list) and (self.watermark_text or (self.use_image_watermark and self.watermark_image_path)):
             self.is_dragging = True
             self.drag_start_pos = (event.pos().x(), event.pos().y())
             
@@ -1530,7 +1895,19 @@ class ImageWatermarkTool(QMainWindow):
             self.setCursor(Qt.ClosedHandCursor)
     
     def on_preview_mouse_move(self, event):
-        """处理预览区域的鼠标移动事件，更新水印位置"""
+        """处理预览区域的鼠标移动事件，更新水印位置或平移视图"""
+        if self.is_panning:
+            full_size = self._current_full_size()
+            if full_size is not None and self.preview_zoom is not None:
+                dx = event.pos().x() - self.pan_start_pos[0]
+                dy = event.pos().y() - self.pan_start_pos[1]
+                self.pan_start_pos = (event.pos().x(), event.pos().y())
+                self.preview_view_center = (
+                    self.preview_view_center[0] - dx / (self.preview_zoom * full_size[0]),
+                    self.preview_view_center[1] - dy / (self.preview_zoom * full_size[1]),
+                )
+                self.update_preview()
+            return
         if self.is_dragging:
             # 计算鼠标移动距离
             dx = event.pos().x() - self.drag_start_pos[0]
@@ -1553,18 +1930,9 @@ class ImageWatermarkTool(QMainWindow):
                 if (img_x <= event.pos().x() < img_x + pixmap_size.width() and 
                     img_y <= event.pos().y() < img_y + pixmap_size.height()):
                     
-                    # 获取当前图片的原始尺寸
-                    current_image_path = self.image_list[self.current_image_index]
-                    if current_image_path in self.original_image_cache:
-                        orig_width, orig_height = self.original_image_cache[current_image_path].size
-                    else:
-                        # 如果缓存中没有，直接加载图片获取尺寸
-                        with Image.open(current_image_path) as img:
-                            orig_width, orig_height = img.size
-                    
-                    # 计算移动距离对应的相对坐标变化
-                    rel_dx = dx / pixmap_size.width()
-                    rel_dy = dy / pixmap_size.height()
+                    # 计算移动距离对应的相对坐标变化（放大查看时像素图只对应图片的一部分）
+                    rel_dx = dx / pixmap_size.width() * self.preview_view_rect[2]
+                    rel_dy = dy / pixmap_size.height() * self.preview_view_rect[3]
                     
                     # 更新水印位置
                     new_x = self.watermark_position[0] + rel_dx
@@ -1582,6 +1950,10 @@ class ImageWatermarkTool(QMainWindow):
     
     def on_preview_mouse_release(self, event):
         """处理预览区域的鼠标释放事件，结束拖拽"""
+        if self.is_panning:
+            self.is_panning = False
+            self.unsetCursor()
+            return
         if self.is_dragging:
             self.is_dragging = False
             # 恢复默认鼠标指针
@@ -1591,6 +1963,8 @@ class ImageWatermarkTool(QMainWindow):
             
     def save_current_settings(self):
         """保存当前设置到文件"""
+        if self.restoring_settings:
+            return
         try:
             # 确保模板目录存在
             os.makedirs(self.templates_dir, exist_ok=True)
@@ -1611,6 +1985,13 @@ class ImageWatermarkTool(QMainWindow):
                 "watermark_stroke_color": self.watermark_stroke_color,
                 "export_format": self.export_format,
                 "export_quality": self.export_quality,
+                "encoder_profile": self.encoder_profile,
+                "target_file_size_kb": self.target_file_size_kb,
+                "keep_source_quality": self.keep_source_quality,
+                "renditions": self.renditions,
+                "batch_workers": self.batch_workers,
+                "batch_mode": self.batch_mode,
+                "batch_memory_budget_mb": self.batch_memory_budget_mb,
                 "use_suffix": self.use_suffix,
                 "suffix_text": self.suffix_text,
                 "save_to_same_dir": self.save_to_same_dir,
@@ -1619,7 +2000,8 @@ class ImageWatermarkTool(QMainWindow):
                 "watermark_image_path": self.watermark_image_path,
                 "watermark_image_size_ratio": self.watermark_image_size_ratio,
                 "watermark_image_opacity": self.watermark_image_opacity,
-                "watermark_rotation": self.watermark_rotation
+                "watermark_rotation": self.watermark_rotation,
+                "watermark_layers": self.watermark_layers
             }
             
             # 保存到文件
@@ -1628,147 +2010,190 @@ class ImageWatermarkTool(QMainWindow):
         except Exception as e:
             print(f"保存设置时出错: {e}")
             
-    def load_last_settings(self):
-        """加载上次保存的设置"""
+    def load_last_settings(self, skip_keys=()):
+        """加载上次保存的设置（skip_keys 中的设置不恢复）"""
         try:
             if os.path.exists(self.settings_file):
                 with open(self.settings_file, 'r', encoding='utf-8') as f:
                     settings = json.load(f)
-                    
-                # 恢复设置
-                if "watermark_text" in settings:
-                    self.watermark_text = settings["watermark_text"]
-                    if hasattr(self, 'watermark_input'):
-                        self.watermark_input.setText(self.watermark_text)
-                
-                if "watermark_position" in settings:
-                    self.watermark_position = tuple(settings["watermark_position"])
-                
-                if "watermark_font_size" in settings:
-                    self.watermark_font_size = settings["watermark_font_size"]
-                    if hasattr(self, 'font_size_combo'):
-                        size_str = str(self.watermark_font_size)
-                        index = self.font_size_combo.findText(size_str)
-                        if index >= 0:
-                            self.font_size_combo.setCurrentIndex(index)
-                
-                if "watermark_opacity" in settings:
-                    self.watermark_opacity = settings["watermark_opacity"]
-                    if hasattr(self, 'opacity_slider'):
-                        self.opacity_slider.setValue(self.watermark_opacity)
-                        
-                if "watermark_font" in settings:
-                    self.watermark_font = settings["watermark_font"]
-                    if hasattr(self, 'font_combo'):
-                        index = self.font_combo.findText(self.watermark_font)
-                        if index >= 0:
-                            self.font_combo.setCurrentIndex(index)
-                
-                if "watermark_bold" in settings:
-                    self.watermark_bold = settings["watermark_bold"]
-                    if hasattr(self, 'bold_checkbox'):
-                        self.bold_checkbox.setChecked(self.watermark_bold)
-                
-                if "watermark_italic" in settings:
-                    self.watermark_italic = settings["watermark_italic"]
-                    if hasattr(self, 'italic_checkbox'):
-                        self.italic_checkbox.setChecked(self.watermark_italic)
-                
-                if "watermark_color" in settings:
-                    self.watermark_color = settings["watermark_color"]
-                    if hasattr(self, 'color_button') and hasattr(self, 'color_label'):
-                        self.color_button.setStyleSheet(f"background-color: {self.watermark_color}")
-                        self.color_label.setText(self.watermark_color)
-                
-                if "watermark_shadow" in settings:
-                    self.watermark_shadow = settings["watermark_shadow"]
-                    if hasattr(self, 'shadow_checkbox'):
-                        self.shadow_checkbox.setChecked(self.watermark_shadow)
-                
-                if "watermark_stroke" in settings:
-                    self.watermark_stroke = settings["watermark_stroke"]
-                    if hasattr(self, 'stroke_checkbox'):
-                        self.stroke_checkbox.setChecked(self.watermark_stroke)
-                
-                if "watermark_stroke_width" in settings:
-                    self.watermark_stroke_width = settings["watermark_stroke_width"]
-                    if hasattr(self, 'stroke_width_spin') and hasattr(self, 'stroke_width_label'):
-                        self.stroke_width_spin.setValue(self.watermark_stroke_width)
-                        self.stroke_width_label.setText(str(self.watermark_stroke_width))
-                
-                if "watermark_stroke_color" in settings:
-                    self.watermark_stroke_color = settings["watermark_stroke_color"]
-                    if hasattr(self, 'stroke_color_button') and hasattr(self, 'stroke_color_label'):
-                        self.stroke_color_button.setStyleSheet(f"background-color: {self.watermark_stroke_color}")
-                        self.stroke_color_label.setText(self.watermark_stroke_color)
-                
-                if "export_format" in settings:
-                    self.export_format = settings["export_format"]
-                    if hasattr(self, 'jpeg_radio') and hasattr(self, 'png_radio'):
-                        if self.export_format == "JPEG":
-                            self.jpeg_radio.setChecked(True)
-                        else:
-                            self.png_radio.setChecked(True)
-                
-                if "export_quality" in settings:
-                    self.export_quality = settings["export_quality"]
-                    if hasattr(self, 'quality_slider') and hasattr(self, 'quality_label'):
-                        self.quality_slider.setValue(self.export_quality)
-                        self.quality_label.setText(f'{self.export_quality}%')
-                
-                if "use_suffix" in settings:
-                    self.use_suffix = settings["use_suffix"]
-                    if hasattr(self, 'suffix_checkbox'):
-                        self.suffix_checkbox.setChecked(self.use_suffix)
-                
-                if "suffix_text" in settings:
-                    self.suffix_text = settings["suffix_text"]
-                    if hasattr(self, 'suffix_edit'):
-                        self.suffix_edit.setText(self.suffix_text)
-                
-                if "save_to_same_dir" in settings:
-                    self.save_to_same_dir = settings["save_to_same_dir"]
-                    if hasattr(self, 'save_same_dir_checkbox'):
-                        self.save_same_dir_checkbox.setChecked(self.save_to_same_dir)
-                
-                if "last_export_dir" in settings:
-                    self.last_export_dir = settings["last_export_dir"]
-                    
-                # 图片水印设置
-                if "use_image_watermark" in settings:
-                    self.use_image_watermark = settings["use_image_watermark"]
-                    if hasattr(self, 'text_watermark_radio') and hasattr(self, 'image_watermark_radio'):
-                        if self.use_image_watermark:
-                            self.image_watermark_radio.setChecked(True)
-                        else:
-                            self.text_watermark_radio.setChecked(True)
-                    
-                if "watermark_image_path" in settings:
-                    self.watermark_image_path = settings["watermark_image_path"]
-                    if hasattr(self, 'watermark_image_label'):
-                        self.watermark_image_label.setText(os.path.basename(self.watermark_image_path) if self.watermark_image_path else "")
-                        
-                if "watermark_image_size_ratio" in settings:
-                    self.watermark_image_size_ratio = settings["watermark_image_size_ratio"]
-                    if hasattr(self, 'watermark_image_size_slider') and hasattr(self, 'watermark_image_size_label'):
-                        self.watermark_image_size_slider.setValue(self.watermark_image_size_ratio)
-                        self.watermark_image_size_label.setText(f'{self.watermark_image_size_ratio}%')
-                        
-                if "watermark_image_opacity" in settings:
-                    self.watermark_image_opacity = settings["watermark_image_opacity"]
-                    if hasattr(self, 'watermark_image_opacity_slider') and hasattr(self, 'watermark_image_opacity_label'):
-                        self.watermark_image_opacity_slider.setValue(self.watermark_image_opacity)
-                        self.watermark_image_opacity_label.setText(f'{int(self.watermark_image_opacity / 255 * 100)}%')
-                        
-                if "watermark_rotation" in settings:
-                    self.watermark_rotation = settings["watermark_rotation"]
-                    if hasattr(self, 'rotation_slider') and hasattr(self, 'rotation_label'):
-                        self.rotation_slider.setValue(self.watermark_rotation)
-                        self.rotation_label.setText(f'{self.watermark_rotation}°')
+                for key in skip_keys:
+                    settings.pop(key, None)
+                self.apply_settings(settings)
         except Exception as e:
             print(f"加载设置时出错: {e}")
             # 如果加载失败，使用默认设置
             pass
+    
+    def apply_settings(self, settings):
+        """把设置字典中的各项应用到属性和界面（字典中没有的设置保持不变）"""
+        # 恢复设置
+        if "watermark_text" in settings:
+            self.watermark_text = settings["watermark_text"]
+            if hasattr(self, 'watermark_input'):
+                self.watermark_input.setText(self.watermark_text)
+        
+        if "watermark_position" in settings:
+            self.watermark_position = tuple(settings["watermark_position"])
+        
+        if "watermark_font_size" in settings:
+            self.watermark_font_size = settings["watermark_font_size"]
+            if hasattr(self, 'font_size_combo'):
+                size_str = str(self.watermark_font_size)
+                index = self.font_size_combo.findText(size_str)
+                if index >= 0:
+                    self.font_size_combo.setCurrentIndex(index)
+        
+        if "watermark_opacity" in settings:
+            self.watermark_opacity = settings["watermark_opacity"]
+            if hasattr(self, 'opacity_slider'):
+                self.opacity_slider.setValue(self.watermark_opacity)
+                
+        if "watermark_font" in settings:
+            self.watermark_font = settings["watermark_font"]
+            if hasattr(self, 'font_combo'):
+                index = self.font_combo.findText(self.watermark_font)
+                if index >= 0:
+                    self.font_combo.setCurrentIndex(index)
+        
+        if "watermark_bold" in settings:
+            self.watermark_bold = settings["watermark_bold"]
+            if hasattr(self, 'bold_checkbox'):
+                self.bold_checkbox.setChecked(self.watermark_bold)
+        
+        if "watermark_italic" in settings:
+            self.watermark_italic = settings["watermark_italic"]
+            if hasattr(self, 'italic_checkbox'):
+                self.italic_checkbox.setChecked(self.watermark_italic)
+        
+        if "watermark_color" in settings:
+            self.watermark_color = settings["watermark_color"]
+            if hasattr(self, 'color_button') and hasattr(self, 'color_label'):
+                self.color_button.setStyleSheet(f"background-color: {self.watermark_color}")
+                self.color_label.setText(self.watermark_color)
+        
+        if "watermark_shadow" in settings:
+            self.watermark_shadow = settings["watermark_shadow"]
+            if hasattr(self, 'shadow_checkbox'):
+                self.shadow_checkbox.setChecked(self.watermark_shadow)
+        
+        if "watermark_stroke" in settings:
+            self.watermark_stroke = settings["watermark_stroke"]
+            if hasattr(self, 'stroke_checkbox'):
+                self.stroke_checkbox.setChecked(self.watermark_stroke)
+        
+        if "watermark_stroke_width" in settings:
+            self.watermark_stroke_width = settings["watermark_stroke_width"]
+            if hasattr(self, 'stroke_width_spin') and hasattr(self, 'stroke_width_label'):
+                self.stroke_width_spin.setValue(self.watermark_stroke_width)
+                self.stroke_width_label.setText(str(self.watermark_stroke_width))
+        
+        if "watermark_stroke_color" in settings:
+            self.watermark_stroke_color = settings["watermark_stroke_color"]
+            if hasattr(self, 'stroke_color_button') and hasattr(self, 'stroke_color_label'):
+                self.stroke_color_button.setStyleSheet(f"background-color: {self.watermark_stroke_color}")
+                self.stroke_color_label.setText(self.watermark_stroke_color)
+        
+        if "export_format" in settings:
+            self.export_format = settings["export_format"]
+            if hasattr(self, 'jpeg_radio') and hasattr(self, 'png_radio'):
+                self.set_export_format_radio()
+        
+        if "export_quality" in settings:
+            self.export_quality = settings["export_quality"]
+            if hasattr(self, 'quality_slider') and hasattr(self, 'quality_label'):
+                self.quality_slider.setValue(self.export_quality)
+                self.quality_label.setText(f'{self.export_quality}%')
+        
+        if "encoder_profile" in settings:
+            self.encoder_profile = settings["encoder_profile"]
+            if hasattr(self, 'encoder_profile_combo'):
+                self.encoder_profile_combo.setCurrentIndex(self.encoder_profile_combo.findData(self.encoder_profile))
+        
+        if "target_file_size_kb" in settings:
+            self.target_file_size_kb = settings["target_file_size_kb"]
+            if hasattr(self, 'target_size_spin'):
+                self.target_size_spin.setValue(self.target_file_size_kb)
+        
+        if "keep_source_quality" in settings:
+            self.keep_source_quality = settings["keep_source_quality"]
+            if hasattr(self, 'keep_quality_checkbox'):
+                self.keep_quality_checkbox.setChecked(self.keep_source_quality)
+        
+        if "renditions" in settings:
+            try:
+                self.renditions = [normalize_rendition(r) for r in settings["renditions"]]
+            except (ValueError, TypeError) as e:
+                print(f"加载多规格配置时出错: {e}")
+        
+        if "batch_workers" in settings:
+            self.batch_workers = max(1, int(settings["batch_workers"]))
+            if hasattr(self, 'workers_spin'):
+                self.workers_spin.setValue(self.batch_workers)
+        
+        if settings.get("batch_mode") in BATCH_MODE_NAMES:
+            self.batch_mode = settings["batch_mode"]
+            if hasattr(self, 'batch_mode_combo'):
+                self.batch_mode_combo.setCurrentIndex(self.batch_mode_combo.findData(self.batch_mode))
+        
+        if "batch_memory_budget_mb" in settings:
+            self.batch_memory_budget_mb = max(0, int(settings["batch_memory_budget_mb"]))
+            if hasattr(self, 'memory_budget_spin'):
+                self.memory_budget_spin.setValue(self.batch_memory_budget_mb)
+        
+        if "use_suffix" in settings:
+            self.use_suffix = settings["use_suffix"]
+            if hasattr(self, 'suffix_checkbox'):
+                self.suffix_checkbox.setChecked(self.use_suffix)
+        
+        if "suffix_text" in settings:
+            self.suffix_text = settings["suffix_text"]
+            if hasattr(self, 'suffix_edit'):
+                self.suffix_edit.setText(self.suffix_text)
+        
+        if "save_to_same_dir" in settings:
+            self.save_to_same_dir = settings["save_to_same_dir"]
+            if hasattr(self, 'save_same_dir_checkbox'):
+                self.save_same_dir_checkbox.setChecked(self.save_to_same_dir)
+        
+        if "last_export_dir" in settings:
+            self.last_export_dir = settings["last_export_dir"]
+            
+        # 图片水印设置
+        if "use_image_watermark" in settings:
+            self.use_image_watermark = settings["use_image_watermark"]
+            if hasattr(self, 'text_watermark_radio') and hasattr(self, 'image_watermark_radio'):
+                if self.use_image_watermark:
+                    self.image_watermark_radio.setChecked(True)
+                else:
+                    self.text_watermark_radio.setChecked(True)
+            
+        if "watermark_image_path" in settings:
+            self.watermark_image_path = settings["watermark_image_path"]
+            if hasattr(self, 'watermark_image_label'):
+                self.watermark_image_label.setText(os.path.basename(self.watermark_image_path) if self.watermark_image_path else "")
+                
+        if "watermark_image_size_ratio" in settings:
+            self.watermark_image_size_ratio = settings["watermark_image_size_ratio"]
+            if hasattr(self, 'watermark_image_size_slider') and hasattr(self, 'watermark_image_size_label'):
+                self.watermark_image_size_slider.setValue(self.watermark_image_size_ratio)
+                self.watermark_image_size_label.setText(f'{self.watermark_image_size_ratio}%')
+                
+        if "watermark_image_opacity" in settings:
+            self.watermark_image_opacity = settings["watermark_image_opacity"]
+            if hasattr(self, 'watermark_image_opacity_slider') and hasattr(self, 'watermark_image_opacity_label'):
+                self.watermark_image_opacity_slider.setValue(self.watermark_image_opacity)
+                self.watermark_image_opacity_label.setText(f'{int(self.watermark_image_opacity / 255 * 100)}%')
+                
+        if "watermark_rotation" in settings:
+            self.watermark_rotation = settings["watermark_rotation"]
+            if hasattr(self, 'rotation_slider') and hasattr(self, 'rotation_label'):
+                self.rotation_slider.setValue(self.watermark_rotation)
+                self.rotation_label.setText(f'{self.watermark_rotation}°')
+
+        if "watermark_layers" in settings:
+            self.watermark_layers = [watermark_core.normalize_layer(layer) for layer in settings["watermark_layers"]]
+            if hasattr(self, 'layer_list'):
+                self.refresh_layer_list()
             
     def save_template(self):
         """保存当前设置为模板"""
@@ -1798,13 +2223,18 @@ class ImageWatermarkTool(QMainWindow):
                 "watermark_rotation": self.watermark_rotation,
                 "export_format": self.export_format,
                 "export_quality": self.export_quality,
+                "encoder_profile": self.encoder_profile,
+                "target_file_size_kb": self.target_file_size_kb,
+                "keep_source_quality": self.keep_source_quality,
+                "renditions": self.renditions,
                 "use_suffix": self.use_suffix,
                 "suffix_text": self.suffix_text,
                 "save_to_same_dir": self.save_to_same_dir,
                 "use_image_watermark": self.use_image_watermark,
                 "watermark_image_path": self.watermark_image_path,
                 "watermark_image_size_ratio": self.watermark_image_size_ratio,
-                "watermark_image_opacity": self.watermark_image_opacity
+                "watermark_image_opacity": self.watermark_image_opacity,
+                "watermark_layers": self.watermark_layers
             }
                 
                 # 生成模板文件名
@@ -1892,16 +2322,28 @@ class ImageWatermarkTool(QMainWindow):
                 
                 if "export_format" in template:
                     self.export_format = template["export_format"]
-                    if self.export_format == "JPEG":
-                        self.jpeg_radio.setChecked(True)
-                    else:
-                        self.png_radio.setChecked(True)
+                    self.set_export_format_radio()
                 
                 if "export_quality" in template:
                     self.export_quality = template["export_quality"]
                     self.quality_slider.setValue(self.export_quality)
                     self.quality_label.setText(f'{self.export_quality}%')
                 
+                if "encoder_profile" in template:
+                    self.encoder_profile = template["encoder_profile"]
+                    self.encoder_profile_combo.setCurrentIndex(self.encoder_profile_combo.findData(self.encoder_profile))
+                
+                if "target_file_size_kb" in template:
+                    self.target_file_size_kb = template["target_file_size_kb"]
+                    self.target_size_spin.setValue(self.target_file_size_kb)
+                
+                if "keep_source_quality" in template:
+                    self.keep_source_quality = template["keep_source_quality"]
+                    self.keep_quality_checkbox.setChecked(self.keep_source_quality)
+                
+                if "renditions" in template:
+                    self.renditions = [normalize_rendition(r) for r in template["renditions"]]
+                
                 if "use_suffix" in template:
                     self.use_suffix = template["use_suffix"]
                     self.suffix_checkbox.setChecked(self.use_suffix)
@@ -1979,9 +2421,11 @@ class ImageWatermarkTool(QMainWindow):
                     self.watermark_image_path = template["watermark_image_path"]
                     if hasattr(self, 'watermark_image_label'):
                         self.watermark_image_label.setText(os.path.basename(self.watermark_image_path) if self.watermark_image_path else "")
-                    # 清除图片缓存，强制重新加载图片
-                    if hasattr(self, 'processed_image_cache'):
-                        self.processed_image_cache.clear()
+                    # 清除渲染缓存，强制重新加载水印图片
+                    if hasattr(self, 'preview_cache'):
+                        self.preview_cache.clear_rendered()
+                        self.display_pixmap_cache.clear()
+                        self.preview_pyramid.clear_tiles()
                     if hasattr(self, 'render_cache'):
                         self.render_cache.clear()
                         
@@ -1997,6 +2441,10 @@ class ImageWatermarkTool(QMainWindow):
                         self.watermark_image_opacity_slider.setValue(self.watermark_image_opacity)
                         self.watermark_image_opacity_label.setText(f'{int(self.watermark_image_opacity / 255 * 100)}%')
                         
+                if "watermark_layers" in template:
+                    self.watermark_layers = [watermark_core.normalize_layer(layer) for layer in template["watermark_layers"]]
+                    self.refresh_layer_list()
+                        
                 # 更新UI元素的可用性状态
                 if hasattr(self, 'on_watermark_type_changed'):
                     # 手动触发UI更新，传入当前的水印类型
@@ -2130,6 +2578,10 @@ class ImageWatermarkTool(QMainWindow):
                             details.append(f"描边颜色: {template.get('watermark_stroke_color', '黑色')}")
                         details.append(f"导出格式: {template.get('export_format', 'JPEG')}")
                         details.append(f"导出质量: {template.get('export_quality', 90)}%")
+                        if template.get('target_file_size_kb', 0):
+                            details.append(f"文件大小上限: {template['target_file_size_kb']} KB")
+                        details.append(f"沿用原图JPEG质量: {'是' if template.get('keep_source_quality', False) else '否'}")
+                        details.append(f"编码配置: {watermark_core.ENCODER_PROFILE_NAMES.get(template.get('encoder_profile', 'balanced'), '均衡')}")
                         details.append(f"使用后缀: {'是' if template.get('use_suffix', False) else '否'}")
                         if template.get('use_suffix', False):
                             details.append(f"后缀文本: {template.get('suffix_text', '')}")
@@ -2144,9 +2596,23 @@ class ImageWatermarkTool(QMainWindow):
     # 重写closeEvent方法，确保关闭时保存设置
     def closeEvent(self, event):
         self.save_current_settings()
+        # 停止后台任务（正在处理的图片完成后退出，未完成的导出下次启动时可以继续）
+        self.is_closing = True
+        self.preview_cache.shutdown()
+        self.image_model.shutdown()
+        self.refine_timer.stop()
+        for task in list(self.refine_tasks):
+            task.cancel()
+            task.wait()
+        if self.font_task is not None:
+            self.font_task.wait()
+        self.progress_panel.cancel_all(wait=True)
         event.accept()
 
 if __name__ == '__main__':
+    # 打包为exe后多进程导出需要
+    import multiprocessing
+    multiprocessing.freeze_support()
     app = QApplication(sys.argv)
     window = ImageWatermarkTool()
     window.show()
@@ -0,0 +1,260 @@
+"""预览缓存与相邻图片预取（不依赖Qt）
+
+浏览图片列表时，在后台按当前设置预先解码（并可选地预渲染）当前图片前后几张的代理图，
+结果放入有容量上限的缓存；选中的图片跳转后，不再相邻的预取任务会被取消。
+代理图的长边不超过 PREVIEW_PROXY_SIZE，预览窗口显示的尺寸总是比它小。
+"""
+import json
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+import watermark_core
+
+# 预览代理图的最大长边（像素）
+PREVIEW_PROXY_SIZE = 2048
+
+# 默认预取当前图片前后各几张
+DEFAULT_PREFETCH_RADIUS = 2
+
+# 默认缓存容量（MB）
+DEFAULT_CACHE_MB = 512
+
+# 交互时快速帧的低分辨率代理图缓存容量（MB）
+FAST_SOURCE_CACHE_MB = 32
+
+# 快速帧旋转水印时的插值方法（准确渲染和导出使用 BICUBIC）
+FAST_ROTATION_RESAMPLE = Image.BILINEAR
+
+
+class LRUCache:
+    """按占用字节数限制容量的最近最少使用缓存（线程安全）"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._items = OrderedDict()  # 键 -> (值, 字节数)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is None:
+                return None
+            self._items.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, value, cost):
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.total_bytes -= old[1]
+            self._items[key] = (value, cost)
+            self.total_bytes += cost
+            # 淘汰最久未使用的项目（至少保留刚放入的一项）
+            while self.total_bytes > self.max_bytes and len(self._items) > 1:
+                _, (_, evicted_cost) = self._items.popitem(last=False)
+                self.total_bytes -= evicted_cost
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._items
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.total_bytes = 0
+
+
+def image_cost(image):
+    """图片在内存中占用的字节数（Pillow 的 RGB/RGBA 每像素4字节）"""
+    return image.width * image.height * 4
+
+
+def load_preview_source(file_path, max_size=PREVIEW_PROXY_SIZE):
+    """解码预览用的代理图，返回 (代理图, 原图尺寸)
+
+    JPEG 利用DCT缩放直接解码到接近代理尺寸，比解码全图再缩小快得多。
+    """
+    with Image.open(file_path) as source:
+        full_size = source.size
+        if source.format == 'JPEG':
+            source.draft(source.mode, (max_size, max_size))
+        source.load()
+        image = source.copy()
+    if max(image.size) > max_size:
+        image.thumbnail((max_size, max_size), Image.BILINEAR)
+    return image, full_size
+
+
+def preview_settings_key(settings):
+    """只包含影响水印像素的设置，用作渲染结果的缓存键"""
+    data = {key: settings.get(key) for key in watermark_core.RENDER_SETTING_KEYS
+            if key not in watermark_core.ENCODE_SETTING_KEYS}
+    return json.dumps(data, sort_keys=True, ensure_ascii=False, default=list)
+
+
+def render_preview(source, full_size, settings, font_name_to_path=None, fast=False, text_context=None):
+    """在代理图上按原图比例渲染水印，返回新图片（不修改 source）
+
+    fast 为 True 时（交互中的快速帧）旋转水印使用更快的插值方法；
+    text_context 为文本变量的值（代理图没有EXIF，需由调用方按原图取得）。
+    """
+    scale = source.width / full_size[0] if full_size[0] else 1.0
+    image = source.copy()
+    if watermark_core.has_watermark(settings):
+        image = watermark_core.add_watermark_to_image(
+            image, watermark_core.scale_watermark_settings(settings, scale), font_name_to_path=font_name_to_path,
+            rotation_resample=FAST_ROTATION_RESAMPLE if fast else Image.BICUBIC, text_context=text_context
+        )
+    return image
+
+
+class PreviewCache:
+    """预览代理图与渲染结果的缓存，带相邻图片的后台预取
+
+    预取用单个后台线程，按 下一张、上一张、下两张…… 的顺序进行。选中的图片跳转后，
+    不再相邻的排队任务直接取消，运行中的任务在解码和渲染之间检查，不再需要时提前结束；
+    预渲染总是使用最近一次请求的设置。
+    """
+
+    def __init__(self, font_name_to_path=None, radius=DEFAULT_PREFETCH_RADIUS, max_cache_mb=DEFAULT_CACHE_MB,
+                 proxy_size=PREVIEW_PROXY_SIZE):
+        self.font_name_to_path = font_name_to_path
+        self.radius = radius
+        self.proxy_size = proxy_size
+        max_bytes = max_cache_mb * 1024 * 1024
+        self.sources = LRUCache(max_bytes * 2 // 3)  # 路径 -> (代理图, 原图尺寸)
+        self.rendered = LRUCache(max_bytes // 3)  # (路径, 设置键) -> 渲染结果
+        self.fast_sources = LRUCache(FAST_SOURCE_CACHE_MB * 1024 * 1024)  # (路径, 长边) -> 低分辨率代理图
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='preview-prefetch')
+        self._lock = threading.RLock()
+        self._wanted = set()  # 当前需要预取的路径
+        self._target = None  # 最近一次请求的 (设置, 设置键, 渲染函数, 变量函数)
+        self._pending = {}  # 路径 -> 排队或运行中的 Future
+
+    def get_source(self, file_path):
+        """取得代理图 (图片, 原图尺寸)；正在预取时等待其完成，否则立即解码"""
+        cached = self.sources.get(file_path)
+        if cached is not None:
+            return cached
+        with self._lock:
+            pending = self._pending.get(file_path)
+        if pending is not None and not pending.cancel():
+            # 已经在解码，等它完成比重新解码快
+            try:
+                pending.result()
+            except Exception:
+                pass
+            cached = self.sources.get(file_path)
+            if cached is not None:
+                return cached
+        return self._load_source(file_path)
+
+    def _load_source(self, file_path):
+        source = load_preview_source(file_path, self.proxy_size)
+        self.sources.put(file_path, source, image_cost(source[0]))
+        return source
+
+    def get_fast_source(self, file_path, max_size):
+        """取得交互时快速渲染用的低分辨率代理图 (图片, 原图尺寸)，从代理图最近邻缩小得到"""
+        key = (file_path, max_size)
+        cached = self.fast_sources.get(key)
+        if cached is not None:
+            return cached
+        source, full_size = self.get_source(file_path)
+        image = source
+        if max(source.size) > max_size:
+            image = source.copy()
+            image.thumbnail((max_size, max_size), Image.NEAREST)
+        self.fast_sources.put(key, (image, full_size), image_cost(image))
+        return image, full_size
+
+    def get_rendered(self, file_path, settings_key):
+        return self.rendered.get((file_path, settings_key))
+
+    def put_rendered(self, file_path, settings_key, value, cost):
+        self.rendered.put((file_path, settings_key), value, cost)
+
+    def prefetch(self, image_paths, index, settings, render_func=None, context_func=None):
+        """预取 index 前后 radius 张图片
+
+        render_func(代理图, 原图尺寸, 设置) 返回 (渲染结果, 字节数)，提供时同时预渲染；
+        context_func(图片路径) 提供时返回的文本变量值作为 text_context 关键字参数传给 render_func。
+        """
+        settings_key = preview_settings_key(settings)
+        order = []
+        for step in range(1, self.radius + 1):
+            for neighbor in (index + step, index - step):
+                if 0 <= neighbor < len(image_paths):
+                    order.append(image_paths[neighbor])
+        wanted = set(order)
+
+        with self._lock:
+            self._wanted = wanted
+            self._target = (settings, settings_key, render_func, context_func)
+            # 取消不再相邻的排队任务
+            for path, future in list(self._pending.items()):
+                if path not in wanted:
+                    future.cancel()
+            for path in order:
+                if path in self._pending:
+                    continue
+                needs_source = path not in self.sources
+                needs_render = render_func is not None and (path, settings_key) not in self.rendered
+                if not (needs_source or needs_render):
+                    continue
+                future = self._executor.submit(self._prefetch_one, path)
+                self._pending[path] = future
+                future.add_done_callback(lambda f, path=path: self._forget(path, f))
+
+    def _forget(self, file_path, future):
+        """预取任务结束（完成或取消）后移出排队表"""
+        with self._lock:
+            if self._pending.get(file_path) is future:
+                del self._pending[file_path]
+
+    def _prefetch_one(self, file_path):
+        try:
+            with self._lock:
+                if file_path not in self._wanted:
+                    return
+            source = self.sources.get(file_path) or self._load_source(file_path)
+            # 渲染期间设置又变化时，按新设置再渲染一次
+            while True:
+                with self._lock:
+                    if file_path not in self._wanted:
+                        return
+                    settings, settings_key, render_func, context_func = self._target
+                if render_func is None or (file_path, settings_key) in self.rendered:
+                    return
+                if context_func is not None:
+                    value, cost = render_func(source[0], source[1], settings, text_context=context_func(file_path))
+                else:
+                    value, cost = render_func(source[0], source[1], settings)
+                self.put_rendered(file_path, settings_key, value, cost)
+        except Exception as e:
+            print(f"预取预览 {file_path} 时出错: {e}")
+
+    def cancel(self):
+        """取消所有排队中的预取"""
+        with self._lock:
+            self._wanted = set()
+            for future in list(self._pending.values()):
+                future.cancel()
+
+    def clear(self):
+        """清空缓存（例如水印图片文件被替换后）"""
+        self.cancel()
+        self.sources.clear()
+        self.fast_sources.clear()
+        self.rendered.clear()
+
+    def clear_rendered(self):
+        self.rendered.clear()
+
+    def shutdown(self):
+        self.cancel()
+        self._executor.shutdown(wait=False)
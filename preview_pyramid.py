@@ -0,0 +1,170 @@
+"""缩放预览用的多分辨率金字塔与按需渲染的图块（不依赖Qt）
+
+第0层是原图，第 n 层的边长是原图的 1/2^n。放大查看时只取当前缩放比例对应的层，
+把可见区域切成固定大小的图块，每块单独合成水印并缓存；平移时只渲染新露出的图块，
+检查细节的开销与可见像素成正比，而不是整张图片。
+JPEG 的较低层利用DCT缩放直接解码，不必先解码全图。
+"""
+import math
+import threading
+
+from PIL import Image
+
+import watermark_core
+from preview_cache import LRUCache, image_cost
+
+# 图块边长（像素）
+TILE_SIZE = 256
+
+# 默认缓存容量（MB）：金字塔各层的图片、渲染好的图块
+DEFAULT_LEVEL_CACHE_MB = 768
+DEFAULT_TILE_CACHE_MB = 128
+
+# 每次放大/缩小的倍数与最大缩放比例
+ZOOM_STEP = 1.25
+MAX_ZOOM = 8.0
+
+# JPEG 解码时最多缩小到 1/8
+_MAX_JPEG_DRAFT_LEVEL = 3
+
+
+def level_size(full_size, level):
+    """第 level 层的尺寸（与 Image.reduce(2) 逐层缩小的结果一致）"""
+    width, height = full_size
+    for _ in range(level):
+        width, height = (width + 1) // 2, (height + 1) // 2
+    return width, height
+
+
+def level_count(full_size):
+    """金字塔的层数：最高一层的长边不超过一个图块"""
+    count = 1
+    size = full_size
+    while max(size) > TILE_SIZE:
+        size = level_size(size, 1)
+        count += 1
+    return count
+
+
+def choose_level(full_size, zoom):
+    """按缩放比例（显示像素/原图像素）选择分辨率不低于显示所需的最高层"""
+    if zoom >= 1.0:
+        return 0
+    level = int(math.floor(math.log2(1.0 / zoom)))
+    return max(0, min(level, level_count(full_size) - 1))
+
+
+def tiles_in_rect(size, left, top, right, bottom):
+    """与某层上的矩形区域相交的图块 (列, 行) 列表"""
+    columns = (size[0] + TILE_SIZE - 1) // TILE_SIZE
+    rows = (size[1] + TILE_SIZE - 1) // TILE_SIZE
+    first_column = max(0, int(left) // TILE_SIZE)
+    first_row = max(0, int(top) // TILE_SIZE)
+    last_column = min(columns - 1, (int(math.ceil(right)) - 1) // TILE_SIZE)
+    last_row = min(rows - 1, (int(math.ceil(bottom)) - 1) // TILE_SIZE)
+    return [(column, row)
+            for row in range(first_row, last_row + 1)
+            for column in range(first_column, last_column + 1)]
+
+
+def tile_box(size, column, row):
+    """图块在所在层中的范围 (左, 上, 右, 下)"""
+    left = column * TILE_SIZE
+    top = row * TILE_SIZE
+    return left, top, min(left + TILE_SIZE, size[0]), min(top + TILE_SIZE, size[1])
+
+
+class PreviewPyramid:
+    """按需生成的金字塔层与水印图块缓存（线程安全）
+
+    各层按需生成并缓存；图块按 (路径, 设置键, 层, 列, 行) 缓存，设置变化后旧图块自然被淘汰。
+    """
+
+    def __init__(self, font_name_to_path=None, level_cache_mb=DEFAULT_LEVEL_CACHE_MB,
+                 tile_cache_mb=DEFAULT_TILE_CACHE_MB):
+        self.font_name_to_path = font_name_to_path
+        self.levels = LRUCache(level_cache_mb * 1024 * 1024)  # (路径, 层) -> 图片
+        self.tiles = LRUCache(tile_cache_mb * 1024 * 1024)  # (路径, 设置键, 层, 列, 行) -> 图块
+        self._sizes = {}  # 路径 -> 原图尺寸
+        self._lock = threading.Lock()
+
+    def full_size(self, file_path):
+        """原图尺寸（只读取文件头）"""
+        with self._lock:
+            size = self._sizes.get(file_path)
+        if size is None:
+            with Image.open(file_path) as image:
+                size = image.size
+            with self._lock:
+                self._sizes[file_path] = size
+        return size
+
+    def level_image(self, file_path, level):
+        """第 level 层的图片（不要修改返回的图片）"""
+        image = self.levels.get((file_path, level))
+        if image is None:
+            image = self._load_level(file_path, level)
+            self.levels.put((file_path, level), image, image_cost(image))
+        return image
+
+    def _load_level(self, file_path, level):
+        expected = level_size(self.full_size(file_path), level)
+        if level <= _MAX_JPEG_DRAFT_LEVEL:
+            with Image.open(file_path) as source:
+                if level == 0 or source.format == 'JPEG':
+                    if level > 0:
+                        source.draft(source.mode, expected)
+                    if source.size == expected:
+                        source.load()
+                        return source.copy()
+        # 从下一层缩小
+        return self.level_image(file_path, level - 1).reduce(2)
+
+    def tile(self, file_path, level, column, row, settings, settings_key, convert=None, text_context=None):
+        """取得合成了水印的图块
+
+        convert(图块) 返回 (缓存的值, 字节数)，用于把图块转换为界面需要的格式后再缓存；
+        不提供时缓存 PIL 图片本身。text_context 为这张图片的文本变量值。
+        """
+        key = (file_path, settings_key, level, column, row)
+        value = self.tiles.get(key)
+        if value is not None:
+            return value
+        tile = self.render_tile(file_path, level, column, row, settings, text_context)
+        if convert is None:
+            value, cost = tile, image_cost(tile)
+        else:
+            value, cost = convert(tile)
+        self.tiles.put(key, value, cost)
+        return value
+
+    def has_tile(self, file_path, level, column, row, settings_key):
+        return (file_path, settings_key, level, column, row) in self.tiles
+
+    def cached_tile(self, file_path, level, column, row, settings_key):
+        """已缓存的图块（tile 的结果），没有时返回None，不渲染"""
+        return self.tiles.get((file_path, settings_key, level, column, row))
+
+    def render_tile(self, file_path, level, column, row, settings, text_context=None):
+        """渲染一个图块：裁剪所在层的区域，按整层画布的坐标合成水印"""
+        image = self.level_image(file_path, level)
+        box = tile_box(image.size, column, row)
+        tile = image.crop(box)
+        if watermark_core.has_watermark(settings):
+            scale = image.width / self.full_size(file_path)[0]
+            tile = watermark_core.add_watermark_to_image(
+                tile, watermark_core.scale_watermark_settings(settings, scale),
+                font_name_to_path=self.font_name_to_path, canvas_size=image.size, offset=box[:2],
+                text_context=text_context
+            )
+        return tile
+
+    def clear(self):
+        """清空缓存（例如图片或水印图片文件被替换后）"""
+        self.levels.clear()
+        self.tiles.clear()
+        with self._lock:
+            self._sizes.clear()
+
+    def clear_tiles(self):
+        self.tiles.clear()
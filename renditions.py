@@ -0,0 +1,185 @@
+import json
+import hashlib
+
+from PIL import Image
+
+import watermark_core
+
+# 默认的多规格配置：原尺寸、网页用 2048px、400px 缩略图
+DEFAULT_RENDITIONS = [
+    {"name": "full", "max_size": 0, "export_format": "JPEG", "export_quality": 92, "template": ""},
+    {"name": "web", "max_size": 2048, "export_format": "JPEG", "export_quality": 85, "template": ""},
+    {"name": "thumb", "max_size": 400, "export_format": "JPEG", "export_quality": 80, "template": ""},
+]
+
+
+def normalize_rendition(data):
+    """补全并校验单个规格配置"""
+    rendition = {
+        "name": str(data.get("name", "")).strip(),
+        "max_size": max(0, int(data.get("max_size", 0) or 0)),  # 长边像素，0 表示原尺寸
+        "export_format": str(data.get("export_format", "JPEG")).upper(),
+        "export_quality": max(1, min(100, int(data.get("export_quality", 95)))),
+        "template": str(data.get("template", "") or "").strip(),  # 模板名称，空表示使用当前设置
+    }
+    if rendition["export_format"] == "JPG":
+        rendition["export_format"] = "JPEG"
+    if not rendition["name"]:
+        raise ValueError("规格名称不能为空")
+    if rendition["export_format"] not in watermark_core.FORMAT_EXTENSIONS:
+        raise ValueError(f"不支持的导出格式：{rendition['export_format']}")
+    return rendition
+
+
+def parse_rendition_lines(text):
+    """解析规格配置文本，每行格式：名称, 长边像素, 格式, 质量[, 模板名称]"""
+    renditions = []
+    names = set()
+    for line_number, line in enumerate(text.splitlines(), 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        parts = [part.strip() for part in line.split(',')]
+        if len(parts) < 4:
+            raise ValueError(f"第 {line_number} 行格式错误：{line}")
+        try:
+            rendition = normalize_rendition({
+                "name": parts[0],
+                "max_size": parts[1],
+                "export_format": parts[2],
+                "export_quality": parts[3],
+                "template": parts[4] if len(parts) > 4 else "",
+            })
+        except ValueError as e:
+            raise ValueError(f"第 {line_number} 行：{e}")
+        if rendition["name"] in names:
+            raise ValueError(f"第 {line_number} 行：规格名称重复：{rendition['name']}")
+        names.add(rendition["name"])
+        renditions.append(rendition)
+    return renditions
+
+
+def format_rendition_lines(renditions):
+    """将规格配置转换为可编辑的文本"""
+    lines = []
+    for rendition in renditions:
+        fields = [rendition["name"], str(rendition["max_size"]), rendition["export_format"], str(rendition["export_quality"])]
+        if rendition.get("template"):
+            fields.append(rendition["template"])
+        lines.append(", ".join(fields))
+    return "\n".join(lines)
+
+
+def fit_size(size, max_size):
+    """按长边上限计算缩放后的尺寸（不放大）"""
+    width, height = size
+    if not max_size or max(width, height) <= max_size:
+        return size
+    scale = max_size / float(max(width, height))
+    return (max(1, round(width * scale)), max(1, round(height * scale)))
+
+
+# 缩小解码时记录原图尺寸的 image.info 键（水印按原图比例缩放）
+SOURCE_SIZE_KEY = "source_size"
+
+
+class RenditionPlan:
+    """多规格导出计划：一次解码生成多个规格的输出
+
+    规格按尺寸从大到小排列，小规格从上一级已缩小的（未加水印的）图片继续缩小；
+    尺寸和水印设置相同的规格共用同一张加水印的图片，只在编码参数上不同。
+    字号、描边宽度等以像素为单位的水印设置对应原图，各规格按缩小的比例缩放，水印与图片的比例保持一致。
+    """
+
+    def __init__(self, renditions, base_settings, templates_dir=None, font_name_to_path=None):
+        self.font_name_to_path = font_name_to_path
+        self.items = []
+        template_cache = {}
+        for data in renditions:
+            rendition = normalize_rendition(data)
+            settings = dict(base_settings)
+            template_name = rendition["template"]
+            if template_name:
+                if template_name not in template_cache:
+                    template_cache[template_name] = watermark_core.load_template_settings(templates_dir, template_name)
+                settings.update(template_cache[template_name])
+            # 规格的导出参数优先，输出文件名追加规格名称
+            settings["export_format"] = rendition["export_format"]
+            settings["export_quality"] = rendition["export_quality"]
+            settings["suffix_text"] = (settings.get("suffix_text", "") if settings.get("use_suffix", True) else "") + "_" + rendition["name"]
+            settings["use_suffix"] = True
+            settings = watermark_core.normalize_settings(settings)
+            self.items.append({
+                "rendition": rendition,
+                "settings": settings,
+                "digest": self._digest(rendition, settings),
+                "overlay_key": self._overlay_key(settings),
+            })
+        # 原尺寸（max_size 为 0）排在最前，其余按长边从大到小
+        self.items.sort(key=lambda item: -(item["rendition"]["max_size"] or float('inf')))
+
+    @staticmethod
+    def _digest(rendition, settings):
+        """规格输出的设置哈希（包含尺寸；水印按规格比例缩放之前导出的输出哈希不同，会重新导出）"""
+        data = json.dumps({"max_size": rendition["max_size"], "settings": watermark_core.settings_hash(settings),
+                           "scaled_watermark": True}, sort_keys=True)
+        return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _overlay_key(settings):
+        """只包含影响像素的水印设置（不含编码参数），用于共用加水印的结果"""
+        data = {key: settings[key] for key in watermark_core.RENDER_SETTING_KEYS
+                if key not in watermark_core.ENCODE_SETTING_KEYS}
+        return json.dumps(data, sort_keys=True, ensure_ascii=False, default=list)
+
+    def largest_size(self, source_size):
+        """所有规格中最大的输出尺寸"""
+        if not self.items:
+            return source_size
+        return fit_size(source_size, self.items[0]["rendition"]["max_size"])
+
+    def render(self, image, needed=None, text_context=None):
+        """依次生成各规格的图片，返回 [(计划项, 图片)]
+
+        needed 为需要输出的规格名称集合（None 表示全部）；跳过的规格仍参与缩小链。
+        text_context 为填写文本变量的值（见 watermark_core.get_text_context）。
+        """
+        results = []
+        level_image = image  # 当前缩小链上的干净图片
+        watermarked = {}  # (尺寸, 缩放比例, 水印设置) -> 加水印后的图片
+        source_width = image.info.get(SOURCE_SIZE_KEY, image.size)[0]
+        for item in self.items:
+            target = fit_size(image.size, item["rendition"]["max_size"])
+            if target != level_image.size:
+                # 从上一级（更大的）干净图片继续缩小
+                level_image = level_image.resize(target, Image.LANCZOS)
+            if needed is not None and item["rendition"]["name"] not in needed:
+                continue
+            scale = target[0] / source_width if source_width else 1.0
+            key = (target, scale, item["overlay_key"])
+            if key not in watermarked:
+                rendered = level_image.copy()
+                if watermark_core.has_watermark(item["settings"]):
+                    rendered = watermark_core.add_watermark_to_image(
+                        rendered, watermark_core.scale_watermark_settings(item["settings"], scale),
+                        font_name_to_path=self.font_name_to_path,
+                        text_context=text_context
+                    )
+                watermarked[key] = rendered
+            results.append((item, watermarked[key]))
+        return results
+
+
+def load_source_for_plan(input_path, plan):
+    """解码源图片；所有规格都明显小于原图时，利用JPEG的DCT缩放只解码到需要的尺寸"""
+    with Image.open(input_path) as source:
+        source_encoding = watermark_core.read_jpeg_encoding(source)
+        source_size = source.size
+        largest = plan.largest_size(source.size)
+        if source.format == 'JPEG' and largest != source.size:
+            source.draft(source.mode, largest)
+        source.load()
+        image = source.copy()
+        image.info[SOURCE_SIZE_KEY] = source_size
+    # draft 解码得到的图片仍可能大于目标尺寸，缩小链会处理剩余部分；水印按记录的原图尺寸缩放
+    return image, source_encoding
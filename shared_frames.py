@@ -0,0 +1,144 @@
+"""进程间通过共享内存传递解码后的图片
+
+多进程导出时，直接把 PIL 图片交给进程池会被序列化复制（2400万像素的RGB图片每次约72MB）。
+这里由解码进程把像素写入可复用的共享内存块，只把很小的描述信息（块名称、模式、尺寸）传给
+渲染进程，渲染进程用 Image.frombuffer 直接在共享内存上构建图片。
+"""
+import os
+import threading
+from multiprocessing import shared_memory
+
+from PIL import Image, ImageFile
+
+
+class SharedFramePool:
+    """可复用的共享内存块池（在创建它的进程中使用）
+
+    块的数量决定同时在传递中的图片数量上限；块不够大时按需重新分配。
+    需要在启动子进程之前创建，子进程才会与本进程共用同一个资源跟踪进程。
+    """
+
+    def __init__(self, slab_count, slab_bytes=0):
+        self.slab_count = max(1, slab_count)
+        self.slab_bytes = slab_bytes
+        self._slabs = {}  # 名称 -> SharedMemory（正在使用或空闲）
+        self._free = []  # 空闲块
+        self._unallocated = self.slab_count  # 尚未创建的块数
+        self._condition = threading.Condition()
+        self._closed = False
+        if os.name == 'posix':
+            # 提前启动资源跟踪进程；否则子进程各自启动一个，退出时会误报并清理仍在使用的共享内存
+            from multiprocessing import resource_tracker
+            resource_tracker.ensure_running()
+
+    def acquire(self, nbytes, timeout=None):
+        """取得一个至少 nbytes 字节的共享内存块，没有空闲块时等待；超时返回None"""
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._free or self._unallocated > 0 or self._closed, timeout):
+                return None
+            if self._closed:
+                raise RuntimeError("共享内存池已关闭")
+            if self._free:
+                slab = self._free.pop()
+                if slab.size >= nbytes:
+                    return slab
+                # 块太小，释放后重新分配
+                del self._slabs[slab.name]
+                slab.close()
+                slab.unlink()
+            else:
+                self._unallocated -= 1
+            slab = shared_memory.SharedMemory(create=True, size=max(nbytes, self.slab_bytes, 1))
+            self._slabs[slab.name] = slab
+            return slab
+
+    def release(self, name):
+        """归还共享内存块"""
+        with self._condition:
+            slab = self._slabs.get(name)
+            if slab is not None:
+                self._free.append(slab)
+                self._condition.notify()
+
+    def close(self):
+        """释放所有共享内存块"""
+        with self._condition:
+            self._closed = True
+            for slab in self._slabs.values():
+                try:
+                    slab.close()
+                    slab.unlink()
+                except (BufferError, OSError) as e:
+                    print(f"释放共享内存时出错: {e}")
+            self._slabs.clear()
+            self._free.clear()
+            self._condition.notify_all()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def frame_nbytes(image):
+    """图片按原始格式打包后的字节数（与 image.tobytes() 的长度相同，每行按字节对齐）"""
+    return len(image.crop((0, 0, image.width, 1)).tobytes()) * image.height
+
+
+def write_frame(pool, image, timeout=None):
+    """把图片像素写入共享内存块，返回描述信息（可以直接传给其他进程）；超时返回None
+
+    与 tobytes() 一样用 raw 编码器打包像素，但逐块直接写入共享内存，
+    不生成整张图片的字节串副本（2400万像素的RGB图片可以少占用约72MB）。
+    """
+    image.load()
+    nbytes = frame_nbytes(image)
+    slab = pool.acquire(nbytes, timeout)
+    if slab is None:
+        return None
+    offset = 0
+    status = 1
+    if nbytes:
+        encoder = Image._getencoder(image.mode, 'raw', image.mode)
+        encoder.setimage(image.im, (0, 0) + image.size)
+        bufsize = max(ImageFile.MAXBLOCK, image.width * 4)
+        status = 0
+        while status == 0:
+            _, status, chunk = encoder.encode(bufsize)
+            slab.buf[offset:offset + len(chunk)] = chunk
+            offset += len(chunk)
+    if status < 0 or offset != nbytes:
+        pool.release(slab.name)
+        raise RuntimeError(f"写入共享内存时出错: 编码器返回 {status}")
+    return {
+        "name": slab.name,
+        "mode": image.mode,
+        "size": image.size,
+        "nbytes": nbytes,
+        "source_size": image.info.get("source_size"),  # 缩小解码的图片的原图尺寸（见 renditions）
+    }
+
+
+def open_frame(descriptor):
+    """打开描述信息对应的共享内存，返回 (SharedMemory, 图片)
+
+    L、RGBA 等模式的图片直接映射共享内存（只读，修改时 Pillow 会自动复制）；
+    RGB 在 Pillow 内部按每像素4字节存储，打开时会在本进程内解包一次，但不经过进程间复制。
+    图片引用着共享内存，用完后要先释放图片再调用 close_frame。
+    """
+    shm = shared_memory.SharedMemory(name=descriptor["name"])
+    mode = descriptor["mode"]
+    image = Image.frombuffer(mode, tuple(descriptor["size"]), shm.buf[:descriptor["nbytes"]], 'raw', mode, 0, 1)
+    if descriptor.get("source_size"):
+        image.info["source_size"] = tuple(descriptor["source_size"])
+    return shm, image
+
+
+def close_frame(shm):
+    """断开共享内存（不删除，内存块由创建它的进程回收）"""
+    try:
+        shm.close()
+    except BufferError:
+        # 仍有对象引用映射的内存（例如异常回溯中的图片），留给垃圾回收
+        pass
@@ -0,0 +1,72 @@
+import time
+import threading
+
+
+class ProgressTracker:
+    """后台任务进度统计（线程安全，不依赖Qt）
+
+    统计已完成数量、吞吐量（张/秒、MB/秒）、工作线程利用率和预计剩余时间。
+    """
+
+    def __init__(self, total, workers=1):
+        self.total = total
+        self.workers = max(1, workers)
+        self.done = 0
+        self.skipped = 0  # 之前已完成、本次直接跳过的数量（不计入吞吐量）
+        self.processed_bytes = 0
+        self.busy_seconds = 0.0
+        self.start_time = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def add_skipped(self, count):
+        """记录无需处理的项目（例如续传时已提交的图片）"""
+        with self._lock:
+            self.skipped += count
+            self.done += count
+
+    def item_done(self, num_bytes=0, busy_seconds=0.0):
+        """记录一个已处理的项目"""
+        with self._lock:
+            self.done += 1
+            self.processed_bytes += num_bytes
+            self.busy_seconds += busy_seconds
+
+    def snapshot(self):
+        """返回当前统计数据的字典"""
+        with self._lock:
+            elapsed = max(time.perf_counter() - self.start_time, 1e-6)
+            processed = self.done - self.skipped
+            images_per_sec = processed / elapsed
+            remaining = self.total - self.done
+            return {
+                "done": self.done,
+                "total": self.total,
+                "elapsed": elapsed,
+                "images_per_sec": images_per_sec,
+                "mb_per_sec": self.processed_bytes / (1024 * 1024) / elapsed,
+                "utilization": min(1.0, self.busy_seconds / (elapsed * self.workers)),
+                "eta": remaining / images_per_sec if images_per_sec > 0 else None,
+            }
+
+
+def format_duration(seconds):
+    """将秒数格式化为 时:分:秒"""
+    if seconds is None:
+        return "--:--"
+    seconds = int(round(seconds))
+    hours, rest = divmod(seconds, 3600)
+    minutes, secs = divmod(rest, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{secs:02d}"
+    return f"{minutes:02d}:{secs:02d}"
+
+
+def format_progress(stats):
+    """将统计数据格式化为一行可读文本"""
+    return (
+        f"{stats['done']}/{stats['total']}  "
+        f"{stats['images_per_sec']:.1f} 张/秒  "
+        f"{stats['mb_per_sec']:.1f} MB/秒  "
+        f"利用率 {stats['utilization'] * 100:.0f}%  "
+        f"剩余 {format_duration(stats['eta'])}"
+    )
@@ -0,0 +1,40 @@
+"""测试公共设置：把项目根目录加入导入路径，提供生成测试图片和水印设置的辅助函数"""
+import os
+import sys
+
+import pytest
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# 测试用字体（DejaVu 随大多数 Linux 发行版和 Matplotlib 一起安装），找不到时跳过需要字体的测试
+FONT_CANDIDATES = [
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/dejavu/DejaVuSans.ttf",
+    "C:/Windows/Fonts/arial.ttf",
+    "/System/Library/Fonts/Supplemental/Arial.ttf",
+]
+
+
+@pytest.fixture(scope="session")
+def font_path():
+    for path in FONT_CANDIDATES:
+        if os.path.exists(path):
+            return path
+    pytest.skip("没有找到测试用字体")
+
+
+@pytest.fixture
+def make_images(tmp_path):
+    """在临时目录中生成 count 张纯色JPEG，返回路径列表"""
+    def make(count, size=(320, 240), directory="in"):
+        folder = tmp_path / directory
+        folder.mkdir(exist_ok=True)
+        paths = []
+        for i in range(count):
+            path = str(folder / f"img_{i:03d}.jpg")
+            Image.new("RGB", size, ((i * 37) % 256, 90, 160)).save(path, quality=90)
+            paths.append(path)
+        return paths
+    return make
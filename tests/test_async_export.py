@@ -0,0 +1,51 @@
+import os
+import threading
+
+from PIL import Image, ImageChops
+
+from async_export import read_file_bytes
+from batch_export import BatchExporter
+
+
+def test_read_file_bytes(tmp_path):
+    path = tmp_path / "data.bin"
+    path.write_bytes(b"x" * 100000)
+    assert read_file_bytes(str(path)) == b"x" * 100000
+
+
+def test_async_output_matches_threads_and_is_incremental(tmp_path, make_images, font_path):
+    paths = make_images(5)
+    settings = {"watermark_text": "Async", "watermark_font": font_path}
+    BatchExporter(settings, str(tmp_path / "threads")).run(paths, workers=2)
+    out_dir = str(tmp_path / "async")
+    result = BatchExporter(settings, out_dir).run(paths, workers=2, async_io=True, io_in_flight=3)
+    assert len(result.rendered) == 5 and not result.failed
+    for name in os.listdir(tmp_path / "threads"):
+        if name.startswith("."):
+            continue
+        expected = Image.open(tmp_path / "threads" / name)
+        assert ImageChops.difference(expected, Image.open(os.path.join(out_dir, name))).getbbox() is None
+    # 清单中记录的是内存中数据的哈希，再次导出时全部跳过
+    again = BatchExporter(settings, out_dir).run(paths, async_io=True)
+    assert len(again.skipped) == 5 and not again.rendered
+
+
+def test_async_progress_runs_on_calling_thread_and_reports_failures(tmp_path, make_images):
+    paths = make_images(8)
+    broken = str(tmp_path / "broken.jpg")
+    with open(broken, "wb") as f:
+        f.write(b"not an image")
+    threads = set()
+    counts = []
+
+    def progress(tracker):
+        threads.add(threading.get_ident())
+        counts.append(tracker.done)
+
+    result = BatchExporter({}, str(tmp_path / "out")).run(
+        paths + [broken], progress_callback=progress, async_io=True, workers=3, io_in_flight=4
+    )
+    assert threads == {threading.get_ident()}
+    # 每张图片一次回调，计数只增不减
+    assert len(counts) == 9 and counts == sorted(counts) and counts[-1] == 9
+    assert [path for path, _ in result.failed] == [broken] and len(result.rendered) == 8
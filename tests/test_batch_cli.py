@@ -0,0 +1,85 @@
+import os
+import json
+import signal
+
+import pytest
+
+import batch_cli
+
+
+@pytest.fixture(autouse=True)
+def restore_signal_handlers():
+    """main 会安装 SIGINT/SIGTERM 处理函数，测试结束后恢复"""
+    handlers = {signum: signal.getsignal(signum) for signum in (signal.SIGINT, signal.SIGTERM)}
+    yield
+    for signum, handler in handlers.items():
+        signal.signal(signum, handler)
+
+
+def run_cli(capsys, *argv):
+    code = batch_cli.main([str(arg) for arg in argv])
+    events = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    return code, events
+
+
+def write_template(path, **settings):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(dict({"name": "测试"}, **settings), f, ensure_ascii=False)
+    return str(path)
+
+
+def test_exports_and_skips_unchanged_images(tmp_path, make_images, capsys):
+    make_images(3)
+    template = write_template(tmp_path / "template.json", export_format="JPEG")
+    out_dir = tmp_path / "out"
+    pattern = tmp_path / "in" / "*.jpg"
+
+    code, events = run_cli(capsys, pattern, "--template", template, "--output", out_dir, "--format", "png",
+                           "--workers", 2)
+    assert code == batch_cli.EXIT_OK
+    assert events[0]["event"] == "start" and events[0]["total"] == 3
+    assert events[-1]["event"] == "summary" and events[-1]["rendered"] == 3
+    assert sorted(name for name in os.listdir(out_dir) if not name.startswith(".")) == [
+        f"img_{i:03d}_watermark.png" for i in range(3)
+    ]
+
+    code, events = run_cli(capsys, pattern, "--template", template, "--output", out_dir, "--format", "png")
+    assert code == batch_cli.EXIT_OK and events[-1]["skipped"] == 3 and events[-1]["rendered"] == 0
+    code, events = run_cli(capsys, pattern, "--template", template, "--output", out_dir, "--format", "png",
+                           "--force")
+    assert events[-1]["rendered"] == 3
+
+
+def test_error_exit_codes(tmp_path, make_images, capsys):
+    make_images(1)
+    template = write_template(tmp_path / "template.json")
+    out_dir = tmp_path / "out"
+
+    code, events = run_cli(capsys, tmp_path / "in", "--template", tmp_path / "missing.json", "--output", out_dir)
+    assert code == batch_cli.EXIT_ERROR and events[-1]["event"] == "error"
+    code, events = run_cli(capsys, tmp_path / "none-*.jpg", "--template", template, "--output", out_dir)
+    assert code == batch_cli.EXIT_NO_INPUTS and events[-1]["event"] == "error"
+    with pytest.raises(SystemExit) as exc_info:
+        batch_cli.main([str(tmp_path / "in"), "--template", template, "--output", str(out_dir), "--quality", "0"])
+    assert exc_info.value.code == batch_cli.EXIT_USAGE
+
+
+def test_renditions_use_templates_dir(tmp_path, make_images, capsys):
+    make_images(1)
+    templates_dir = tmp_path / "templates"
+    templates_dir.mkdir()
+    write_template(templates_dir / "template_小图.json", suffix_text="_tpl")
+    template = write_template(tmp_path / "template.json", renditions=[
+        {"name": "small", "max_size": 100, "export_format": "PNG", "export_quality": 80, "template": "小图"},
+    ])
+    out_dir = tmp_path / "out"
+
+    code, events = run_cli(capsys, tmp_path / "in", "--template", template, "--output", out_dir, "--renditions",
+                           "--templates-dir", templates_dir)
+    assert code == batch_cli.EXIT_OK and events[-1]["rendered"] == 1
+    assert os.path.exists(out_dir / "img_000_tpl_small.png")
+
+    # 引用的模板不在指定目录中时无法执行
+    code, events = run_cli(capsys, tmp_path / "in", "--template", template, "--output", out_dir, "--renditions",
+                           "--templates-dir", tmp_path / "elsewhere")
+    assert code == batch_cli.EXIT_ERROR and events[-1]["event"] == "error"
@@ -0,0 +1,89 @@
+import os
+import json
+import threading
+
+import pytest
+from PIL import Image
+
+import watermark_core
+from batch_journal import BatchJournal, find_unfinished_jobs, get_jobs_dir
+from batch_export import BatchExporter
+
+
+def test_journal_survives_torn_last_line(tmp_path):
+    jobs_dir = get_jobs_dir(str(tmp_path))
+    journal = BatchJournal.create(jobs_dir, {"watermark_text": "x"}, "/out", ["a.jpg", "b.jpg", "c.jpg"])
+    journal.mark_done("a.jpg")
+    journal.mark_done("c.jpg")
+    journal.close()
+    # 断电时最后一行只写了一半
+    with open(journal.path, "a", encoding="utf-8") as f:
+        f.write('{"done": "b.j')
+
+    loaded = BatchJournal.load(journal.path)
+    assert loaded.done == {"a.jpg", "c.jpg"}
+    assert loaded.pending_paths() == ["b.jpg"]
+    assert loaded.job["settings"] == {"watermark_text": "x"}
+
+
+def test_find_unfinished_jobs_skips_invalid_and_finished(tmp_path):
+    jobs_dir = get_jobs_dir(str(tmp_path))
+    first = BatchJournal.create(jobs_dir, {}, "/out", ["a.jpg"])
+    second = BatchJournal.create(jobs_dir, {}, "/out", ["b.jpg"])
+    finished = BatchJournal.create(jobs_dir, {}, "/out", ["c.jpg"])
+    finished.finish()
+    with open(os.path.join(jobs_dir, "job_old.jsonl"), "w", encoding="utf-8") as f:
+        f.write(json.dumps({"version": 0}) + "\n")
+    for journal in (first, second):
+        journal.close()
+    found = find_unfinished_jobs(jobs_dir)
+    assert [j.job["job_id"] for j in found] == [first.job["job_id"], second.job["job_id"]]
+    assert not os.path.exists(finished.path)
+
+
+def test_output_dirs_for_same_dir_exports(tmp_path):
+    journal = BatchJournal(str(tmp_path / "j.jsonl"), {
+        "settings": {"save_to_same_dir": True}, "export_dir": "/out",
+        "image_paths": ["/a/1.jpg", "/b/2.jpg", "/a/3.jpg"],
+    })
+    assert journal.output_dirs() == [os.path.abspath("/a"), os.path.abspath("/b")]
+
+
+@pytest.mark.parametrize("mode", [{}, {"workers": 2}, {"async_io": True, "io_in_flight": 2}])
+def test_cancelled_export_resumes_without_rerendering(tmp_path, make_images, mode):
+    paths = make_images(6)
+    out_dir = str(tmp_path / "out")
+    jobs_dir = get_jobs_dir(str(tmp_path))
+    journal = BatchJournal.create(jobs_dir, {}, out_dir, paths)
+    cancel = threading.Event()
+
+    def progress(tracker):
+        if tracker.done >= 2:
+            cancel.set()
+
+    first = BatchExporter({}, out_dir, incremental=False).run(
+        paths, progress_callback=progress, journal=journal, cancel_event=cancel, **mode
+    )
+    journal.close()
+    assert first.cancelled and 2 <= len(first.rendered) < len(paths)
+
+    resumed = BatchJournal.load(journal.path)
+    assert resumed.done == {p for p in paths if any(os.path.basename(p)[:-4] in r for r in first.rendered)}
+    # 续传时不检查清单（incremental=False），已完成的图片仍然不会重新渲染
+    second = BatchExporter({}, out_dir, incremental=False).run(resumed.job["image_paths"], journal=resumed)
+    assert len(first.rendered) + len(second.rendered) == len(paths)
+    assert not second.cancelled and not second.failed
+
+
+def test_atomic_save_leaves_no_partial_file(tmp_path):
+    output_path = str(tmp_path / "out.jpg")
+
+    with pytest.raises(Exception):
+        watermark_core.save_image_atomic("not an image", output_path, {"export_format": "JPEG"})
+    assert os.listdir(tmp_path) == []
+
+    # 异常退出遗留的临时文件在下次导出前清理
+    open(tmp_path / (watermark_core.TEMP_FILE_PREFIX + "abc.tmp"), "w").close()
+    watermark_core.save_image_atomic(Image.new("RGB", (8, 8)), output_path, {"export_format": "JPEG"})
+    assert watermark_core.remove_stale_temp_files(str(tmp_path)) == 1
+    assert os.listdir(tmp_path) == ["out.jpg"]
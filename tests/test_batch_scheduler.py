@@ -0,0 +1,119 @@
+import sys
+import time
+import types
+import ctypes
+import threading
+
+from PIL import Image
+
+from batch_scheduler import MemoryBudget, estimate_image_memory, order_largest_first, peak_rss_mb, BYTES_PER_PIXEL
+from batch_export import BatchExporter
+
+
+def test_budget_admits_within_limit():
+    budget = MemoryBudget(100)
+    assert budget.can_admit(60)
+    budget.admit(60)
+    assert budget.can_admit(40) and not budget.can_admit(41)
+    budget.admit(40)
+    budget.release(60)
+    assert budget.can_admit(60) and budget.in_use == 40 and budget.peak == 100
+
+
+def test_oversized_image_runs_alone():
+    budget = MemoryBudget(100)
+    assert budget.can_admit(500)  # 没有其他图片在处理时总能开始
+    budget.admit(500)
+    assert not budget.can_admit(1)
+    budget.release(500)
+    assert budget.running == 0 and budget.can_admit(1)
+
+
+def test_zero_budget_is_unlimited():
+    budget = MemoryBudget(0)
+    budget.admit(10 ** 12)
+    assert budget.can_admit(10 ** 12)
+
+
+def test_estimate_reads_only_the_header(tmp_path):
+    path = str(tmp_path / "a.png")
+    Image.new("RGB", (300, 200)).save(path)
+    assert estimate_image_memory(path) == 300 * 200 * BYTES_PER_PIXEL
+    assert estimate_image_memory(str(tmp_path / "missing.jpg")) == 0
+
+
+def test_order_largest_first(make_images):
+    small = make_images(1, size=(100, 100), directory="small")[0]
+    large = make_images(1, size=(400, 300), directory="large")[0]
+    assert [path for path, _ in order_largest_first([small, large])] == [large, small]
+
+
+def test_export_respects_memory_budget(tmp_path, make_images, monkeypatch):
+    paths = make_images(6, size=(320, 240))
+    lock = threading.Lock()
+    running = [0, 0]  # 当前, 峰值
+    original = BatchExporter.export_one
+
+    def tracked(self, *args, **kwargs):
+        with lock:
+            running[0] += 1
+            running[1] = max(running[1], running[0])
+        try:
+            time.sleep(0.02)
+            return original(self, *args, **kwargs)
+        finally:
+            with lock:
+                running[0] -= 1
+
+    monkeypatch.setattr(BatchExporter, "export_one", tracked)
+    cost_mb = 320 * 240 * BYTES_PER_PIXEL / (1024 * 1024)
+    # 预算只够同时处理两张
+    result = BatchExporter({}, str(tmp_path / "out")).run(paths, workers=4, memory_budget_mb=cost_mb * 2.5)
+    assert len(result.rendered) == 6 and running[1] == 2
+
+    running[1] = 0
+    BatchExporter({}, str(tmp_path / "out2")).run(paths, workers=4, memory_budget_mb=0)
+    assert running[1] > 2
+
+
+def test_peak_rss_is_reported():
+    assert peak_rss_mb() > 0
+
+
+def _without_resource(monkeypatch, psutil=None):
+    """模拟 Windows：没有 resource 模块，psutil 按参数提供或未安装"""
+    monkeypatch.setitem(sys.modules, "resource", None)
+    monkeypatch.setitem(sys.modules, "psutil", psutil)
+
+
+def test_peak_rss_uses_psutil_without_resource(monkeypatch):
+    memory_info = types.SimpleNamespace(peak_wset=512 * 1024 * 1024)
+    process = types.SimpleNamespace(memory_info=lambda: memory_info)
+    _without_resource(monkeypatch, types.SimpleNamespace(Process=lambda: process))
+    assert peak_rss_mb() == 512
+
+
+def test_peak_rss_calls_get_process_memory_info_on_windows(monkeypatch):
+    _without_resource(monkeypatch)
+    monkeypatch.setattr(sys, "platform", "win32")
+
+    def get_current_process():
+        return -1
+
+    def get_process_memory_info(handle, counters, size):
+        assert handle == -1 and size == counters._obj.cb
+        counters._obj.PeakWorkingSetSize = 300 * 1024 * 1024
+        return 1
+
+    libraries = {
+        "kernel32": types.SimpleNamespace(GetCurrentProcess=get_current_process),
+        "psapi": types.SimpleNamespace(GetProcessMemoryInfo=get_process_memory_info),
+    }
+    monkeypatch.setattr(ctypes, "WinDLL", libraries.__getitem__, raising=False)
+    assert peak_rss_mb(include_children=True) == 300
+
+
+def test_peak_rss_unavailable_without_resource_or_windows(monkeypatch):
+    _without_resource(monkeypatch)
+    monkeypatch.setattr(sys, "platform", "linux")
+    assert peak_rss_mb() is None
@@ -0,0 +1,140 @@
+import io
+
+import pytest
+from PIL import Image, ImageDraw, ImageFilter, features
+
+import watermark_core
+
+
+def _sample(size=(800, 600)):
+    """带噪点的彩色图片（编码大小随质量明显变化）"""
+    noise = Image.effect_noise(size, 60)
+    gradient = Image.linear_gradient("L").resize(size)
+    return Image.merge("RGB", (noise, gradient, gradient.transpose(Image.FLIP_LEFT_RIGHT)))
+
+
+def _settings(**kwargs):
+    return watermark_core.normalize_settings(kwargs)
+
+
+@pytest.mark.parametrize("profile", sorted(watermark_core.ENCODER_PROFILES))
+@pytest.mark.parametrize("export_format", sorted(watermark_core.FORMAT_EXTENSIONS))
+def test_every_profile_encodes_every_format(profile, export_format):
+    if export_format == "WEBP" and not features.check("webp"):
+        pytest.skip("Pillow 不支持 WebP")
+    settings = _settings(export_format=export_format, encoder_profile=profile, export_quality=80)
+    data = watermark_core.encode_image(_sample((200, 150)).convert("RGBA"), settings)
+    with Image.open(io.BytesIO(data)) as decoded:
+        assert decoded.format == export_format
+        assert decoded.size == (200, 150)
+
+
+def test_encoder_options_use_profile_and_quality():
+    options = watermark_core.get_encoder_options(_settings(export_format="JPEG", encoder_profile="smallest",
+                                                           export_quality=70))
+    assert options["progressive"] and options["quality"] == 70
+    # 未知的配置按均衡处理，PNG 不传质量
+    options = watermark_core.get_encoder_options({"export_format": "PNG", "encoder_profile": "nope"})
+    assert options == watermark_core.ENCODER_PROFILES["balanced"]["PNG"]
+
+
+def _photo_like(size=(1600, 1200)):
+    """带渐变、噪点和图形的平滑图片（与 benchmarks/bench_encoders.py 的样例图片类似）"""
+    gradient = Image.linear_gradient("L").resize(size)
+    noise = Image.effect_noise(size, 40)
+    image = Image.merge("RGB", (gradient, noise, gradient.transpose(Image.FLIP_LEFT_RIGHT)))
+    draw = ImageDraw.Draw(image)
+    for i in range(0, size[0], 150):
+        draw.ellipse((i, i % size[1], i + 120, i % size[1] + 120), outline=(255, 255, 255), width=4)
+    return image.filter(ImageFilter.SMOOTH)
+
+
+@pytest.mark.parametrize("budget_kb", [60, 150, 300])
+@pytest.mark.parametrize("export_format", ["JPEG", "WEBP"])
+def test_target_size_returns_highest_quality_within_budget(export_format, budget_kb):
+    if export_format == "WEBP" and not features.check("webp"):
+        pytest.skip("Pillow 不支持 WebP")
+    image = _photo_like()
+    settings = _settings(export_format=export_format, export_quality=95)
+    budget = budget_kb * 1024
+    data, quality = watermark_core.encode_to_target_size(image, settings, budget, sample_pixels=100000)
+    assert len(data) <= budget
+    options = watermark_core.get_encoder_options(settings)
+    options.pop("quality")
+    # 与逐个质量全尺寸编码的结果最多相差一档（WebP 低预算时曾因比例校正过度退到质量1）
+    if quality + 2 <= 95:
+        assert watermark_core._encoded_size(image, export_format, options, quality + 2) > budget
+
+
+def _soft_noisy(size):
+    """放大后模糊、再叠加少量噪点的图片（类似柔和的高像素照片，缩小的样图会高估全尺寸大小）"""
+    base = Image.merge("RGB", [Image.effect_noise((size[0] // 16, size[1] // 16), 80) for _ in range(3)])
+    base = base.resize(size, Image.BICUBIC).filter(ImageFilter.GaussianBlur(3))
+    return Image.blend(base, Image.effect_noise(size, 6).convert("RGB"), 0.08)
+
+
+@pytest.mark.parametrize("export_format, size, budget_kb", [
+    ("JPEG", (4000, 3000), 800),
+    ("JPEG", (4000, 3000), 1200),
+    ("WEBP", (2400, 1800), 300),
+])
+def test_target_size_searches_upward_when_sample_overestimates(export_format, size, budget_kb):
+    if export_format == "WEBP" and not features.check("webp"):
+        pytest.skip("Pillow 不支持 WebP")
+    image = _soft_noisy(size)
+    settings = _settings(export_format=export_format, export_quality=95)
+    budget = budget_kb * 1024
+    # 使用默认的样图大小：第一次全尺寸编码满足预算时也要继续尝试更高的质量
+    data, quality = watermark_core.encode_to_target_size(image, settings, budget)
+    assert len(data) <= budget
+    options = watermark_core.get_encoder_options(settings)
+    options.pop("quality")
+    assert quality + 2 > 95 or watermark_core._encoded_size(image, export_format, options, quality + 2) > budget
+
+
+def test_target_size_reports_smallest_result_when_budget_unreachable():
+    data, quality = watermark_core.encode_to_target_size(_sample(), _settings(export_format="JPEG"), 100)
+    assert quality == 1 and len(data) > 100
+
+
+def test_save_image_honours_target_file_size():
+    settings = _settings(export_format="JPEG", export_quality=95, target_file_size_kb=40)
+    assert len(watermark_core.encode_image(_sample(), settings)) <= 40 * 1024
+
+
+def _jpeg_source(quality, subsampling=0):
+    buffer = io.BytesIO()
+    _sample((240, 160)).save(buffer, "JPEG", quality=quality, subsampling=subsampling)
+    buffer.seek(0)
+    return watermark_core.load_source(buffer)
+
+
+def test_keep_source_quality_reuses_quantization_tables():
+    image, source_encoding = _jpeg_source(quality=63, subsampling=0)
+    assert source_encoding["subsampling"] == 0
+    settings = _settings(export_format="JPEG", export_quality=95, keep_source_quality=True)
+    with Image.open(io.BytesIO(watermark_core.encode_image(image, settings, source_encoding))) as output:
+        assert [list(t) for _, t in sorted(output.quantization.items())] == source_encoding["qtables"]
+        assert watermark_core.JpegImagePlugin.get_sampling(output) == 0
+
+
+def test_source_tables_ignored_when_disabled_or_not_jpeg():
+    image, source_encoding = _jpeg_source(quality=63)
+    settings = _settings(export_format="JPEG", export_quality=95)
+    with Image.open(io.BytesIO(watermark_core.encode_image(image, settings, source_encoding))) as output:
+        assert [list(t) for _, t in sorted(output.quantization.items())] != source_encoding["qtables"]
+    png = _settings(export_format="PNG", keep_source_quality=True)
+    assert watermark_core.get_source_quality_options(image, png, source_encoding) is None
+    assert watermark_core.read_jpeg_encoding(Image.new("RGB", (8, 8))) is None
+
+
+def test_grayscale_source_tables_apply_to_colour_output():
+    buffer = io.BytesIO()
+    Image.new("L", (64, 64), 128).save(buffer, "JPEG", quality=70)
+    buffer.seek(0)
+    image, source_encoding = watermark_core.load_source(buffer)
+    assert len(source_encoding["qtables"]) == 1
+    settings = _settings(export_format="JPEG", keep_source_quality=True)
+    data = watermark_core.encode_image(image.convert("RGB"), settings, source_encoding)
+    with Image.open(io.BytesIO(data)) as output:
+        assert output.mode == "RGB" and len(output.quantization) == 2
@@ -0,0 +1,88 @@
+import os
+
+from PIL import Image
+
+from export_manifest import ExportManifest, MANIFEST_FILENAME
+from batch_export import BatchExporter
+
+
+def _exported(tmp_path):
+    """一个输入文件和对应的输出文件，已记录在清单中"""
+    input_path = str(tmp_path / "a.jpg")
+    Image.new("RGB", (64, 48), (200, 10, 10)).save(input_path)
+    out_dir = tmp_path / "out"
+    out_dir.mkdir()
+    output_path = str(out_dir / "a_out.jpg")
+    Image.new("RGB", (64, 48)).save(output_path)
+    manifest = ExportManifest(str(out_dir))
+    manifest.record(input_path, "settings-1", output_path)
+    manifest.save()
+    return input_path, output_path, str(out_dir)
+
+
+def _bump_mtime(path):
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 5_000_000_000))
+
+
+def test_unchanged_output_is_up_to_date_after_reload(tmp_path):
+    input_path, output_path, out_dir = _exported(tmp_path)
+    manifest = ExportManifest(out_dir)
+    assert manifest.is_up_to_date(input_path, "settings-1", output_path)
+    assert not manifest.is_up_to_date(input_path, "settings-2", output_path)
+
+
+def test_touched_input_with_same_content_falls_back_to_sha(tmp_path):
+    input_path, output_path, out_dir = _exported(tmp_path)
+    _bump_mtime(input_path)
+    manifest = ExportManifest(out_dir)
+    assert manifest.is_up_to_date(input_path, "settings-1", output_path)
+    # 哈希一致后刷新了修改时间，下次走快速路径
+    assert manifest.dirty
+    assert manifest.entries[next(iter(manifest.entries))]["mtime_ns"] == os.stat(input_path).st_mtime_ns
+
+
+def test_changed_input_content_is_stale(tmp_path):
+    input_path, output_path, out_dir = _exported(tmp_path)
+    size = os.path.getsize(input_path)
+    with open(input_path, "r+b") as f:
+        f.seek(size - 10)
+        f.write(b"\x00" * 8)
+    _bump_mtime(input_path)
+    assert os.path.getsize(input_path) == size
+    assert not ExportManifest(out_dir).is_up_to_date(input_path, "settings-1", output_path)
+
+
+def test_deleted_or_modified_output_is_stale(tmp_path):
+    input_path, output_path, out_dir = _exported(tmp_path)
+    _bump_mtime(output_path)
+    assert not ExportManifest(out_dir).is_up_to_date(input_path, "settings-1", output_path)
+    os.remove(output_path)
+    assert not ExportManifest(out_dir).is_up_to_date(input_path, "settings-1", output_path)
+
+
+def test_corrupt_manifest_loads_empty(tmp_path):
+    with open(tmp_path / MANIFEST_FILENAME, "w") as f:
+        f.write("{not json")
+    assert ExportManifest(str(tmp_path)).entries == {}
+
+
+def test_batch_export_skips_unchanged_images(tmp_path, make_images, font_path):
+    paths = make_images(3)
+    out_dir = str(tmp_path / "out")
+    settings = {"watermark_text": "M", "watermark_font": font_path}
+    first = BatchExporter(settings, out_dir).run(paths)
+    assert len(first.rendered) == 3
+
+    second = BatchExporter(settings, out_dir).run(paths)
+    assert len(second.rendered) == 0 and len(second.skipped) == 3
+
+    Image.new("RGB", (320, 240), (1, 2, 3)).save(paths[1], quality=90)
+    third = BatchExporter(settings, out_dir).run(paths)
+    assert len(third.rendered) == 1 and len(third.skipped) == 2
+
+    changed = BatchExporter(dict(settings, watermark_text="N"), out_dir).run(paths)
+    assert len(changed.rendered) == 3
+
+    forced = BatchExporter(dict(settings, watermark_text="N"), out_dir, incremental=False).run(paths)
+    assert len(forced.rendered) == 3
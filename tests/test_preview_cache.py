@@ -0,0 +1,93 @@
+import time
+
+import pytest
+from PIL import Image
+
+from preview_cache import (
+    LRUCache, PreviewCache, load_preview_source, preview_settings_key, render_preview, image_cost,
+)
+
+
+def _wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("等待超时")
+        time.sleep(0.01)
+
+
+def test_lru_evicts_least_recently_used_by_bytes():
+    cache = LRUCache(100)
+    cache.put("a", 1, 40)
+    cache.put("b", 2, 40)
+    assert cache.get("a") == 1  # a 变为最近使用
+    cache.put("c", 3, 40)
+    assert "b" not in cache and "a" in cache and "c" in cache
+    assert cache.total_bytes == 80
+    # 超过容量的单项仍然保留
+    cache.put("huge", 4, 500)
+    assert cache.get("huge") == 4 and cache.total_bytes == 500
+
+
+def test_proxy_is_decoded_near_preview_size(tmp_path):
+    path = str(tmp_path / "a.jpg")
+    Image.new("RGB", (4000, 3000)).save(path)
+    proxy, full_size = load_preview_source(path, max_size=500)
+    assert full_size == (4000, 3000) and max(proxy.size) == 500
+
+
+def test_settings_key_ignores_encoding_settings():
+    base = {"watermark_text": "a", "export_quality": 90}
+    assert preview_settings_key(base) == preview_settings_key(dict(base, export_quality=50))
+    assert preview_settings_key(base) != preview_settings_key(dict(base, watermark_text="b"))
+
+
+def test_render_preview_scales_watermark_to_proxy(font_path):
+    settings = {"watermark_text": "WATERMARK", "watermark_font": font_path, "watermark_font_size": 200,
+                "watermark_color": "#FFFFFF", "watermark_opacity": 100}
+
+    def ink_ratio(image):
+        box = image.convert("L").point(lambda v: 255 if v > 128 else 0).getbbox()
+        return (box[2] - box[0]) / image.width
+
+    full = render_preview(Image.new("RGB", (4000, 3000)), (4000, 3000), settings)
+    proxy = render_preview(Image.new("RGB", (1000, 750)), (4000, 3000), settings)
+    assert abs(ink_ratio(full) - ink_ratio(proxy)) < 0.01
+
+
+def test_prefetch_decodes_and_renders_neighbours(make_images):
+    paths = make_images(7)
+    cache = PreviewCache(radius=2)
+    calls = []
+
+    def render(source, full_size, settings, text_context=None):
+        calls.append(text_context)
+        return source.copy(), image_cost(source)
+
+    try:
+        settings = {"watermark_text": "x"}
+        key = preview_settings_key(settings)
+        cache.prefetch(paths, 3, settings, render, context_func=lambda path: {"filename": path})
+        neighbours = [paths[i] for i in (1, 2, 4, 5)]
+        _wait_for(lambda: all(cache.get_rendered(path, key) is not None for path in neighbours))
+        assert sorted(context["filename"] for context in calls) == sorted(neighbours)
+        assert paths[0] not in cache.sources and paths[6] not in cache.sources
+        # 跳转后不再相邻的任务被取消，新的邻居被预取
+        cache.prefetch(paths, 5, settings, render)
+        _wait_for(lambda: cache.get_rendered(paths[6], key) is not None)
+        assert calls[-1] is None
+    finally:
+        cache.shutdown()
+
+
+def test_get_source_uses_cache(make_images, monkeypatch):
+    path = make_images(1)[0]
+    cache = PreviewCache()
+    try:
+        first = cache.get_source(path)
+        monkeypatch.setattr("preview_cache.load_preview_source", lambda *args: pytest.fail("不应再次解码"))
+        assert cache.get_source(path) is first
+        fast, full_size = cache.get_fast_source(path, 100)
+        assert max(fast.size) == 100 and full_size == (320, 240)
+    finally:
+        cache.shutdown()
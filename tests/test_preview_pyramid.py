@@ -0,0 +1,58 @@
+import pytest
+from PIL import Image, ImageChops
+
+import watermark_core
+from preview_pyramid import (
+    PreviewPyramid, TILE_SIZE, level_size, level_count, choose_level, tiles_in_rect, tile_box,
+)
+
+
+def test_level_geometry():
+    assert level_size((1001, 600), 1) == (501, 300)
+    assert level_size((1001, 600), 2) == (251, 150)
+    assert level_count((TILE_SIZE, 100)) == 1
+    assert level_count((1001, 600)) == 3
+    assert choose_level((4000, 3000), 2.0) == 0
+    assert choose_level((4000, 3000), 0.5) == 1
+    assert choose_level((4000, 3000), 0.3) == 1
+    assert choose_level((4000, 3000), 0.01) == level_count((4000, 3000)) - 1
+
+
+def test_tiles_in_rect_covers_the_visible_area():
+    size = (600, 300)
+    assert tiles_in_rect(size, 0, 0, 600, 300) == [(0, 0), (1, 0), (2, 0), (0, 1), (1, 1), (2, 1)]
+    assert tiles_in_rect(size, 255.5, 10, 256.5, 20) == [(0, 0), (1, 0)]
+    assert tiles_in_rect(size, -50, -50, 10, 10) == [(0, 0)]
+    assert tile_box(size, 2, 1) == (512, 256, 600, 300)
+
+
+def test_jpeg_levels_match_expected_sizes(make_images):
+    path = make_images(1, size=(1001, 600))[0]
+    pyramid = PreviewPyramid()
+    for level in range(level_count((1001, 600))):
+        assert pyramid.level_image(path, level).size == level_size((1001, 600), level)
+
+
+@pytest.mark.parametrize("rotation", [0, 30])
+def test_stitched_tiles_match_whole_level(tmp_path, font_path, rotation):
+    path = str(tmp_path / "source.png")
+    Image.new("RGB", (900, 700), (40, 90, 160)).save(path)
+    settings = watermark_core.normalize_settings({
+        "watermark_text": "Tile Test", "watermark_font": font_path, "watermark_font_size": 120,
+        "watermark_rotation": rotation, "watermark_opacity": 255,
+    })
+    pyramid = PreviewPyramid()
+    level = 1
+    image = pyramid.level_image(path, level)
+    expected = watermark_core.add_watermark_to_image(
+        image.copy(), watermark_core.scale_watermark_settings(settings, image.width / 900)
+    )
+    stitched = Image.new("RGB", image.size)
+    for column, row in tiles_in_rect(image.size, 0, 0, *image.size):
+        tile = pyramid.tile(path, level, column, row, settings, "key")
+        stitched.paste(tile, tile_box(image.size, column, row)[:2])
+    assert ImageChops.difference(stitched, expected).getbbox() is None
+    assert pyramid.has_tile(path, level, 0, 0, "key")
+    assert not pyramid.has_tile(path, level, 0, 0, "other")
+    # 命中缓存时返回同一个图块
+    assert pyramid.tile(path, level, 0, 0, settings, "key") is pyramid.tile(path, level, 0, 0, settings, "key")
@@ -0,0 +1,117 @@
+import os
+import json
+
+import pytest
+from PIL import Image
+
+from renditions import (
+    RenditionPlan, DEFAULT_RENDITIONS, parse_rendition_lines, format_rendition_lines, fit_size,
+    load_source_for_plan, SOURCE_SIZE_KEY,
+)
+from batch_export import BatchExporter
+
+
+def test_parse_and_format_round_trip():
+    text = "full, 0, jpeg, 92\nthumb, 400, png, 80, 小图模板\n# 注释\n"
+    parsed = parse_rendition_lines(text)
+    assert [r["export_format"] for r in parsed] == ["JPEG", "PNG"]
+    assert parsed[1]["template"] == "小图模板"
+    assert parse_rendition_lines(format_rendition_lines(parsed)) == parsed
+
+
+@pytest.mark.parametrize("text", ["a, 100, JPEG", "a, 100, BMP, 80", "a, 0, JPEG, 80\na, 10, JPEG, 80"])
+def test_parse_rejects_invalid_lines(text):
+    with pytest.raises(ValueError):
+        parse_rendition_lines(text)
+
+
+def test_fit_size_never_upscales():
+    assert fit_size((4000, 3000), 400) == (400, 300)
+    assert fit_size((300, 200), 400) == (300, 200)
+    assert fit_size((300, 200), 0) == (300, 200)
+
+
+def test_render_chains_levels_from_largest_to_smallest(monkeypatch):
+    plan = RenditionPlan(list(reversed(DEFAULT_RENDITIONS)), {})
+    assert [item["rendition"]["name"] for item in plan.items] == ["full", "web", "thumb"]
+    resized = []
+    original_resize = Image.Image.resize
+
+    def spy(self, size, *args, **kwargs):
+        resized.append((self.size, tuple(size)))
+        return original_resize(self, size, *args, **kwargs)
+
+    monkeypatch.setattr(Image.Image, "resize", spy)
+    outputs = plan.render(Image.new("RGB", (4000, 3000)))
+    assert [output.size for _, output in outputs] == [(4000, 3000), (2048, 1536), (400, 300)]
+    # 缩略图从网页尺寸继续缩小，而不是从原图
+    assert resized == [((4000, 3000), (2048, 1536)), ((2048, 1536), (400, 300))]
+
+
+def test_render_shares_identical_levels_and_skips_unneeded():
+    plan = RenditionPlan([
+        {"name": "a", "max_size": 400, "export_format": "JPEG"},
+        {"name": "b", "max_size": 400, "export_format": "PNG"},
+        {"name": "c", "max_size": 100},
+    ], {})
+    outputs = plan.render(Image.new("RGB", (800, 600)))
+    assert outputs[0][1] is outputs[1][1]
+    needed = plan.render(Image.new("RGB", (800, 600)), needed={"c"})
+    assert [(item["rendition"]["name"], image.size) for item, image in needed] == [("c", (100, 75))]
+
+
+def _ink_width_ratio(image):
+    ink = image.convert("L").point(lambda v: 255 if v > 128 else 0).getbbox()
+    return (ink[2] - ink[0]) / image.width
+
+
+def test_watermark_keeps_its_proportion_at_every_level(font_path):
+    settings = {"watermark_text": "WATERMARK", "watermark_font": font_path, "watermark_font_size": 200,
+                "watermark_color": "#FFFFFF", "watermark_opacity": 100}
+    plan = RenditionPlan(DEFAULT_RENDITIONS, settings)
+    outputs = plan.render(Image.new("RGB", (4000, 3000), (20, 20, 20)))
+    ratios = [_ink_width_ratio(image) for _, image in outputs]
+    assert max(ratios) - min(ratios) < 0.01
+
+
+def test_draft_decode_records_source_size(tmp_path, font_path):
+    path = str(tmp_path / "a.jpg")
+    Image.new("RGB", (4000, 3000), (20, 20, 20)).save(path, quality=90)
+    plan = RenditionPlan([{"name": "thumb", "max_size": 400}], {
+        "watermark_text": "WATERMARK", "watermark_font": font_path, "watermark_font_size": 200,
+        "watermark_color": "#FFFFFF", "watermark_opacity": 100,
+    })
+    image, _ = load_source_for_plan(path, plan)
+    assert image.size == (500, 375) and image.info[SOURCE_SIZE_KEY] == (4000, 3000)
+    (_, thumb), = plan.render(image)
+    full = RenditionPlan([{"name": "full", "max_size": 0}], plan.items[0]["settings"])
+    (_, reference), = full.render(Image.new("RGB", (4000, 3000), (20, 20, 20)))
+    assert abs(_ink_width_ratio(thumb) - _ink_width_ratio(reference)) < 0.01
+
+
+def test_rendition_template_overrides_base_settings(tmp_path):
+    templates_dir = tmp_path / "templates"
+    templates_dir.mkdir()
+    with open(templates_dir / "template_小图.json", "w", encoding="utf-8") as f:
+        json.dump({"name": "小图", "watermark_text": "small"}, f, ensure_ascii=False)
+    plan = RenditionPlan([{"name": "thumb", "max_size": 100, "template": "小图"}, {"name": "full"}],
+                         {"watermark_text": "base"}, templates_dir=str(templates_dir))
+    texts = {item["rendition"]["name"]: item["settings"]["watermark_text"] for item in plan.items}
+    assert texts == {"thumb": "small", "full": "base"}
+
+
+def test_batch_export_writes_every_rendition_once(tmp_path, make_images):
+    paths = make_images(2, size=(1000, 800))
+    out_dir = str(tmp_path / "out")
+    result = BatchExporter({}, out_dir, renditions=DEFAULT_RENDITIONS).run(paths)
+    assert len(result.rendered) == 6 and not result.failed
+    sizes = sorted(Image.open(os.path.join(out_dir, name)).size for name in os.listdir(out_dir)
+                   if not name.startswith("."))
+    assert sizes == [(400, 320)] * 2 + [(1000, 800)] * 4
+    again = BatchExporter({}, out_dir, renditions=DEFAULT_RENDITIONS).run(paths)
+    assert len(again.rendered) == 0 and len(again.skipped) == 6
+
+
+def test_unknown_template_fails_plan(tmp_path):
+    with pytest.raises(OSError):
+        RenditionPlan([{"name": "a", "template": "missing"}], {}, templates_dir=str(tmp_path))
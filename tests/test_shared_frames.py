@@ -0,0 +1,75 @@
+import os
+import glob
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+from PIL import Image, ImageChops
+
+from shared_frames import SharedFramePool, write_frame, open_frame, close_frame
+from batch_export import BatchExporter
+
+
+def _checksum_in_child(descriptor):
+    shm, image = open_frame(descriptor)
+    try:
+        expected = Image.new(image.mode, image.size, (1, 2, 3))
+        return image.size, image.mode, image.tobytes() == expected.tobytes(), image.info.get("source_size")
+    finally:
+        del image
+        close_frame(shm)
+
+
+@pytest.mark.parametrize("mode", ["RGB", "RGBA", "L", "LA", "CMYK", "I;16", "1"])
+@pytest.mark.parametrize("size", [(37, 23), (1500, 700)])
+def test_frame_round_trip(mode, size):
+    # 大图的像素分多块写入共享内存
+    image = Image.effect_noise(size, 60).convert(mode)
+    image.info["source_size"] = (370, 230)
+    with SharedFramePool(1) as pool:
+        descriptor = write_frame(pool, image)
+        assert descriptor["nbytes"] == len(image.tobytes())
+        shm, copy = open_frame(descriptor)
+        assert copy.tobytes() == image.tobytes() and copy.info["source_size"] == (370, 230)
+        del copy
+        close_frame(shm)
+
+
+def test_write_frame_does_not_copy_whole_image(monkeypatch):
+    image = Image.new("RGB", (640, 480), (10, 20, 30))
+    heights = []
+    tobytes = Image.Image.tobytes
+    monkeypatch.setattr(Image.Image, "tobytes", lambda self, *args: heights.append(self.height) or tobytes(self, *args))
+    with SharedFramePool(1) as pool:
+        write_frame(pool, image)
+    # 只为计算每行字节数打包过一行
+    assert heights == [1]
+
+
+def test_frame_is_readable_from_another_process():
+    with SharedFramePool(1) as pool, ProcessPoolExecutor(1) as executor:
+        descriptor = write_frame(pool, Image.new("RGB", (64, 48), (1, 2, 3)))
+        assert executor.submit(_checksum_in_child, descriptor).result() == ((64, 48), "RGB", True, None)
+
+
+def test_pool_limits_frames_in_flight_and_reuses_slabs():
+    with SharedFramePool(2, slab_bytes=1024) as pool:
+        first = pool.acquire(100)
+        second = pool.acquire(100)
+        assert pool.acquire(100, timeout=0.05) is None
+        pool.release(first.name)
+        assert pool.acquire(100, timeout=0.05) is first
+        pool.release(second.name)
+        # 块太小时重新分配
+        bigger = pool.acquire(4096)
+        assert bigger.size >= 4096 and bigger is not second
+
+
+def test_process_mode_matches_thread_mode(tmp_path, make_images, font_path):
+    paths = make_images(4)
+    settings = {"watermark_text": "Shared", "watermark_font": font_path, "watermark_font_size": 40}
+    BatchExporter(settings, str(tmp_path / "threads")).run(paths, workers=2)
+    result = BatchExporter(settings, str(tmp_path / "processes")).run(paths, workers=2, use_processes=True)
+    assert len(result.rendered) == 4 and not result.failed
+    for path in glob.glob(str(tmp_path / "threads" / "*.jpg")):
+        other = str(tmp_path / "processes" / os.path.basename(path))
+        assert ImageChops.difference(Image.open(path), Image.open(other)).getbbox() is None
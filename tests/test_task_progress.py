@@ -0,0 +1,57 @@
+import threading
+
+import task_progress
+from task_progress import ProgressTracker, format_duration, format_progress
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_snapshot_rates_exclude_skipped_items(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(task_progress.time, "perf_counter", clock)
+    tracker = ProgressTracker(total=10, workers=2)
+    tracker.add_skipped(4)
+    for _ in range(3):
+        tracker.item_done(num_bytes=1024 * 1024, busy_seconds=1.5)
+    clock.now += 3.0
+    stats = tracker.snapshot()
+    assert stats["done"] == 7 and stats["total"] == 10
+    assert stats["images_per_sec"] == 1.0  # 跳过的4张不计入吞吐量
+    assert stats["mb_per_sec"] == 1.0
+    assert stats["utilization"] == 0.75  # 4.5 秒忙碌 / (3 秒 * 2 个工作线程)
+    assert stats["eta"] == 3.0
+
+
+def test_eta_unknown_before_first_item():
+    stats = ProgressTracker(total=5).snapshot()
+    assert stats["eta"] is None
+    assert format_duration(stats["eta"]) == "--:--"
+
+
+def test_item_done_is_thread_safe():
+    tracker = ProgressTracker(total=8000)
+
+    def work():
+        for _ in range(1000):
+            tracker.item_done(1)
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert tracker.done == 8000 and tracker.processed_bytes == 8000
+
+
+def test_formatting():
+    assert format_duration(59.6) == "01:00"
+    assert format_duration(3725) == "1:02:05"
+    text = format_progress({"done": 3, "total": 9, "images_per_sec": 2.0, "mb_per_sec": 1.5,
+                            "utilization": 0.5, "eta": 3})
+    assert text.startswith("3/9") and "50%" in text and "00:03" in text
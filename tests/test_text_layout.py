@@ -0,0 +1,76 @@
+import os
+
+import pytest
+from PIL import Image, ImageChops
+
+from watermark_core import (
+    normalize_settings, load_font, get_text_layout, render_text_layer, render_rotated_text, load_watermark_image,
+    add_watermark_to_image,
+)
+
+
+def ink_box(image, background):
+    """与背景色不同的像素范围 (左, 上, 右, 下)"""
+    return ImageChops.difference(image, Image.new(image.mode, image.size, background)).getbbox()
+
+
+def test_layout_is_cached_per_font_and_text(font_path):
+    font = load_font(normalize_settings({"watermark_font": font_path, "watermark_font_size": 64}))
+    layout = get_text_layout(font, "Ag")
+    assert get_text_layout(font, "Ag") is layout
+    assert layout.width == layout.bbox[2] - layout.bbox[0] and layout.bbox[1] > 0
+    assert layout.origin_for(10, 20) == (10 - layout.bbox[0], 20 - layout.bbox[1])
+    multiline = get_text_layout(font, "Ag\nAg")
+    assert [line for line, _ in multiline.lines] == ["Ag", "Ag"]
+    assert multiline.height > layout.height + multiline.line_height // 2
+
+
+@pytest.mark.parametrize("text", ["Centre", "Two\nlines"])
+def test_ink_box_is_centred_on_position(font_path, text):
+    background = (40, 90, 160)
+    settings = normalize_settings({"watermark_text": text, "watermark_font": font_path, "watermark_font_size": 64})
+    image = add_watermark_to_image(Image.new("RGB", (600, 400), background), settings)
+    left, top, right, bottom = ink_box(image, background)
+    # 墨迹的中心落在指定位置（绘制原点已减去墨迹相对原点的偏移）
+    assert abs((left + right) / 2 - 300) <= 1
+    assert abs((top + bottom) / 2 - 200) <= 1
+
+
+def test_rotated_layers_are_cached_per_angle_and_resample(font_path):
+    settings = normalize_settings({"watermark_font": font_path, "watermark_stroke": True})
+    font = load_font(settings)
+    layout = get_text_layout(font, "Rotate")
+    base = render_text_layer(font, layout, settings)
+    assert render_text_layer(font, layout, settings) is base
+    rotated = render_rotated_text(font, layout, settings, 30)
+    assert render_rotated_text(font, layout, settings, 30) is rotated
+    assert rotated.size == base.rotate(30, expand=True).size
+    fast = render_rotated_text(font, layout, settings, 30, Image.BILINEAR)
+    assert fast is not rotated
+    expected = base.rotate(30, expand=True, resample=Image.BICUBIC)
+    # RGBA 图片的 getbbox 默认只看透明度，这里要比较所有通道
+    assert ImageChops.difference(rotated, expected).getbbox(alpha_only=False) is None
+
+
+def test_export_rotation_uses_bicubic_by_default(font_path):
+    settings = normalize_settings({"watermark_text": "Rotate", "watermark_font": font_path, "watermark_rotation": 30})
+    source = Image.new("RGB", (400, 300), (40, 90, 160))
+    default = add_watermark_to_image(source.copy(), settings)
+    bicubic = add_watermark_to_image(source.copy(), settings, rotation_resample=Image.BICUBIC)
+    bilinear = add_watermark_to_image(source.copy(), settings, rotation_resample=Image.BILINEAR)
+    assert ImageChops.difference(default, bicubic).getbbox() is None
+    assert ImageChops.difference(default, bilinear).getbbox() is not None
+
+
+def test_watermark_image_cache_follows_file_changes(tmp_path):
+    path = str(tmp_path / "logo.png")
+    Image.new("RGBA", (100, 50), (255, 0, 0, 255)).save(path)
+    first = load_watermark_image(path, 80, 0, 128)
+    assert load_watermark_image(path, 80, 0, 128) is first
+    assert first.size == (80, 40) and first.getpixel((10, 10)) == (255, 0, 0, 128)
+    # 不同角度共用缩放好的图片，只重新旋转
+    assert load_watermark_image(path, 80, 45, 128).size == first.rotate(45, expand=True).size
+
+    Image.new("RGBA", (100, 50), (0, 0, 255, 255)).save(path)
+    os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 10 ** 9))
+    assert load_watermark_image(path, 80, 0, 128).getpixel((10, 10)) == (0, 0, 255, 128)
@@ -0,0 +1,87 @@
+import pytest
+from PIL import Image, ImageChops
+
+import watermark_core
+from watermark_core import (
+    expand_text_tokens, text_has_tokens, has_text_tokens, get_text_context, normalize_settings,
+    load_font, get_text_layout, render_text_layer, render_text_layer_from_atlas, generate_output_filename,
+)
+from batch_export import BatchExporter
+
+
+def test_expand_fills_known_tokens_and_keeps_unknown():
+    context = {"name": "IMG_01", "index": 7, "artist": "张三"}
+    assert expand_text_tokens("{artist} {name} #{index:03d}", context) == "张三 IMG_01 #007"
+    # 图片没有的信息替换为空，不认识的变量保持原样
+    assert expand_text_tokens("{camera}|{unknown}|{index}", {"index": 1}) == "|{unknown}|1"
+    # 格式说明不适用时按原值输出
+    assert expand_text_tokens("{name:03d}", {"name": "a"}) == "a"
+    assert expand_text_tokens("{index}", None) == ""
+
+
+def test_text_has_tokens():
+    assert text_has_tokens("© {artist}")
+    assert not text_has_tokens("© {unknown} {}")
+    assert not has_text_tokens(normalize_settings({"watermark_text": "固定文本"}))
+    assert has_text_tokens(normalize_settings({"watermark_text": "#{index}"}))
+
+
+def test_text_context_reads_file_name_and_exif(tmp_path):
+    path = str(tmp_path / "photo.jpg")
+    exif = Image.Exif()
+    exif[0x013B] = "Artist Name"
+    exif[0x0132] = "2024:05:01 12:30:00"
+    Image.new("RGB", (16, 16)).save(path, exif=exif)
+    context = get_text_context(path, index=3)
+    assert context == {"filename": "photo.jpg", "name": "photo", "index": 3,
+                       "artist": "Artist Name", "exif_date": "2024-05-01"}
+    # 没有EXIF的图片只有文件名和序号
+    plain = str(tmp_path / "plain.png")
+    Image.new("RGB", (16, 16)).save(plain)
+    assert get_text_context(plain) == {"filename": "plain.png", "name": "plain"}
+
+
+@pytest.mark.parametrize("style", [
+    {},
+    {"watermark_shadow": True},
+    {"watermark_stroke": True, "watermark_stroke_width": 2},
+])
+@pytest.mark.parametrize("text", ["Hello 123", "AV Wa\n#0042"])
+def test_atlas_matches_whole_text_rendering(font_path, style, text):
+    settings = normalize_settings(dict(style, watermark_font=font_path, watermark_font_size=40,
+                                       watermark_color="#ff8000", watermark_opacity=200))
+    font = load_font(settings)
+    expected = render_text_layer(font, get_text_layout(font, text), settings)
+    layer, layout = render_text_layer_from_atlas(font, text, settings)
+    assert layer.size == expected.size
+    assert layout.bbox == get_text_layout(font, text).bbox
+    assert max(high for _, high in ImageChops.difference(layer, expected).getextrema()) <= 1
+
+
+def test_atlas_returns_none_without_ink(font_path):
+    settings = normalize_settings({"watermark_font": font_path})
+    assert render_text_layer_from_atlas(load_font(settings), "   ", settings) == (None, None)
+
+
+def test_batch_export_fills_tokens_per_image(tmp_path, make_images, font_path):
+    paths = make_images(3)
+    # 源图片相同，输出只因序号不同而不同
+    for path in paths:
+        Image.new("RGB", (320, 240), (40, 90, 160)).save(path, quality=90)
+    out_dir = str(tmp_path / "out")
+    settings = {"watermark_text": "#{index:02d} {name}", "watermark_font": font_path,
+                "watermark_font_size": 40, "export_format": "PNG"}
+    result = BatchExporter(settings, out_dir).run(paths)
+    assert len(result.rendered) == 3 and not result.failed
+    outputs = [Image.open(path) for path in sorted(result.rendered)]
+    assert ImageChops.difference(outputs[0], outputs[1]).getbbox() is not None
+    assert ImageChops.difference(outputs[1], outputs[2]).getbbox() is not None
+
+    # 每张图片按各自的文件名和在列表中的序号填写
+    for index, path in enumerate(paths, 1):
+        image = Image.open(path).convert("RGB")
+        expected = watermark_core.add_watermark_to_image(
+            image, settings, text_context=get_text_context(path, index, image)
+        )
+        output = generate_output_filename(path, normalize_settings(settings), out_dir)
+        assert ImageChops.difference(Image.open(output), expected).getbbox() is None
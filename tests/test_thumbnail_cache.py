@@ -0,0 +1,70 @@
+import os
+
+from PIL import Image
+
+import watermark_core
+from thumbnail_cache import ThumbnailCache
+
+
+def _cached_files(cache_dir):
+    return [os.path.join(root, name) for root, _, names in os.walk(cache_dir) for name in names]
+
+
+def test_load_generates_once_then_reads_cache(tmp_path, make_images, monkeypatch):
+    path = make_images(1, size=(800, 600))[0]
+    cache = ThumbnailCache(str(tmp_path / "cache"))
+    first = cache.load(path, 120)
+    assert max(first.size) == 120
+
+    def fail(*args, **kwargs):
+        raise AssertionError("缓存命中时不应解码原图")
+
+    monkeypatch.setattr(watermark_core, "load_thumbnail", fail)
+    assert cache.load(path, 120).size == first.size
+    assert len(_cached_files(cache.cache_dir)) == 1
+
+
+def test_modified_source_gets_new_entry(tmp_path, make_images):
+    path = make_images(1)[0]
+    cache = ThumbnailCache(str(tmp_path / "cache"))
+    cache.load(path, 120)
+    old_entry = cache.entry_path(path, 120)
+    Image.new("RGB", (300, 200), "red").save(path, quality=90)
+    os.utime(path, ns=(0, os.stat(old_entry).st_mtime_ns + 10 ** 9))
+    assert cache.entry_path(path, 120) != old_entry
+    assert cache.get(path, 120) is None
+    # 不同尺寸的缩略图分别缓存
+    assert cache.entry_path(path, 120) != cache.entry_path(path, 240)
+
+
+def test_corrupt_entry_is_removed(tmp_path, make_images):
+    path = make_images(1)[0]
+    cache = ThumbnailCache(str(tmp_path / "cache"))
+    cache.load(path, 120)
+    entry = cache.entry_path(path, 120)
+    with open(entry, "wb") as f:
+        f.write(b"not an image")
+    assert cache.get(path, 120) is None
+    assert not os.path.exists(entry)
+    assert cache.load(path, 120) is not None
+
+
+def test_prune_removes_least_recently_used(tmp_path, make_images):
+    paths = make_images(5)
+    cache = ThumbnailCache(str(tmp_path / "cache"))
+    for index, path in enumerate(paths):
+        cache.load(path, 120)
+        os.utime(cache.entry_path(path, 120), (1000 + index, 1000 + index))
+    # 读取最早的一张，它的最后使用时间变为最新
+    assert cache.get(paths[0], 120) is not None
+    sizes = {path: os.path.getsize(cache.entry_path(path, 120)) for path in paths}
+    limit = sum(sizes.values()) - 1
+    removed = cache.prune(limit)
+    assert removed >= 1
+    assert os.path.exists(cache.entry_path(paths[0], 120))
+    assert not os.path.exists(cache.entry_path(paths[1], 120))
+    assert sum(os.path.getsize(p) for p in _cached_files(cache.cache_dir)) <= limit * 0.8
+
+    remaining = len(_cached_files(cache.cache_dir))
+    assert cache.clear() == remaining
+    assert not _cached_files(cache.cache_dir)
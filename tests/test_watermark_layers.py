@@ -0,0 +1,93 @@
+import pytest
+from PIL import Image, ImageChops
+
+from watermark_core import (
+    normalize_settings, get_watermark_layers, build_layer_overlay, add_watermark_to_image, settings_hash,
+)
+
+
+@pytest.fixture
+def logos(tmp_path):
+    """两个半透明的纯色水印图片"""
+    paths = []
+    for name, color in (("red", (255, 0, 0, 200)), ("green", (0, 255, 0, 160))):
+        path = str(tmp_path / f"{name}.png")
+        Image.new("RGBA", (100, 100), color).save(path)
+        paths.append(path)
+    return paths
+
+
+def logo_layer(path, position, ratio=20):
+    return {"use_image_watermark": True, "watermark_image_path": path, "watermark_position": position,
+            "watermark_image_size_ratio": ratio, "watermark_image_opacity": 255}
+
+
+def test_layers_are_drawn_before_the_main_watermark(logos):
+    settings = normalize_settings(dict(
+        logo_layer(logos[1], (0.5, 0.5)),
+        watermark_layers=[logo_layer(logos[0], (0.1, 0.1)), {"watermark_text": "  "}],
+    ))
+    layers = get_watermark_layers(settings)
+    # 没有内容的图层被跳过，主水印最后绘制
+    assert [layer["watermark_image_path"] for layer in layers] == logos
+
+
+def test_overlay_groups_only_overlapping_layers(logos):
+    canvas = (1000, 500)
+    corners = normalize_settings(dict(
+        logo_layer(logos[1], (0.9, 0.9)), watermark_layers=[logo_layer(logos[0], (0.1, 0.1))],
+    ))
+    overlay = build_layer_overlay(get_watermark_layers(corners), canvas)
+    # 分散在角落的图层各自成块，不分配整张画布大小的覆盖层
+    assert [patch.size for patch, _ in overlay] == [(200, 200), (200, 200)]
+    assert build_layer_overlay(get_watermark_layers(corners), canvas) is overlay
+
+    stacked = normalize_settings(dict(
+        logo_layer(logos[1], (0.5, 0.5)), watermark_layers=[logo_layer(logos[0], (0.45, 0.5))],
+    ))
+    overlay = build_layer_overlay(get_watermark_layers(stacked), canvas)
+    assert len(overlay) == 1 and overlay[0][0].size == (250, 200)
+
+
+def test_layers_composite_like_sequential_drawing(logos):
+    background = Image.new("RGB", (1000, 500), (40, 90, 160))
+    layers = [logo_layer(logos[0], (0.45, 0.5)), logo_layer(logos[1], (0.5, 0.5))]
+    combined = add_watermark_to_image(
+        background.copy(), normalize_settings(dict(layers[1], watermark_layers=[layers[0]]))
+    )
+    sequential = background.copy()
+    for layer in layers:
+        sequential = add_watermark_to_image(sequential, normalize_settings(layer))
+    # 预先合成再贴一次与逐个贴上只有取整的差别
+    assert max(high for _, high in ImageChops.difference(combined, sequential).getextrema()) <= 2
+
+
+def test_layered_tiles_match_whole_image(logos, font_path):
+    settings = normalize_settings(dict(
+        logo_layer(logos[1], (0.5, 0.5)),
+        watermark_layers=[
+            logo_layer(logos[0], (0.2, 0.3)),
+            {"watermark_text": "Layer", "watermark_font": font_path, "watermark_font_size": 60,
+             "watermark_position": (0.6, 0.5), "watermark_rotation": 20},
+        ],
+    ))
+    background = Image.new("RGB", (600, 400), (40, 90, 160))
+    whole = add_watermark_to_image(background.copy(), settings)
+    stitched = background.copy()
+    for left in (0, 300):
+        for top in (0, 200):
+            box = (left, top, left + 300, top + 200)
+            tile = add_watermark_to_image(background.crop(box), settings, canvas_size=(600, 400), offset=box[:2])
+            stitched.paste(tile, box[:2])
+    assert ImageChops.difference(stitched, whole).getbbox() is None
+
+
+def test_settings_hash_covers_layers(logos):
+    base = normalize_settings({"watermark_text": "a"})
+    layered = normalize_settings(dict(base, watermark_layers=[logo_layer(logos[0], (0.1, 0.1))]))
+    assert settings_hash(base) == settings_hash(dict(base, watermark_layers=[]))
+    assert settings_hash(layered) != settings_hash(base)
+    # 图层的水印图片内容被替换时哈希随之变化
+    before = settings_hash(layered)
+    Image.new("RGBA", (100, 100), (0, 0, 255, 255)).save(logos[0])
+    assert settings_hash(layered) != before
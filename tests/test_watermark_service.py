@@ -0,0 +1,99 @@
+import io
+import json
+import threading
+import http.client
+
+import pytest
+from PIL import Image
+
+from watermark_service import WatermarkService, LatencyHistogram, create_server
+
+
+def test_latency_histogram_percentiles():
+    histogram = LatencyHistogram()
+    assert histogram.snapshot()["p50_ms"] is None
+    for _ in range(90):
+        histogram.record(0.003)
+    for _ in range(10):
+        histogram.record(0.150)
+    snapshot = histogram.snapshot()
+    assert snapshot["count"] == 100 and snapshot["p50_ms"] == 5 and snapshot["p99_ms"] == 150
+    histogram.record(30.0)
+    assert histogram.snapshot()["max_ms"] == 30000
+
+
+@pytest.fixture(scope="module")
+def server(tmp_path_factory):
+    templates_dir = tmp_path_factory.mktemp("templates")
+    with open(templates_dir / "template_默认.json", "w", encoding="utf-8") as f:
+        json.dump({"name": "默认", "export_format": "JPEG"}, f, ensure_ascii=False)
+    # 一个工作进程、不排队：同时只能处理一个请求
+    service = WatermarkService(str(templates_dir), workers=1, max_queue=0)
+    server = create_server(service, port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    service.close()
+
+
+def request(server, method, path, body=None, headers=None):
+    connection = http.client.HTTPConnection(*server.server_address, timeout=30)
+    try:
+        connection.putrequest(method, path)
+        headers = dict(headers or {})
+        if body is not None:
+            headers.setdefault("Content-Length", str(len(body)))
+        for name, value in headers.items():
+            connection.putheader(name, value)
+        connection.endheaders(body)
+        response = connection.getresponse()
+        return response.status, response.getheader("Content-Type"), response.read()
+    finally:
+        connection.close()
+
+
+def jpeg_bytes(size=(200, 150)):
+    buffer = io.BytesIO()
+    Image.new("RGB", size, (40, 90, 160)).save(buffer, "JPEG")
+    return buffer.getvalue()
+
+
+def test_watermarks_uploaded_image(server):
+    status, content_type, body = request(server, "POST", "/watermark?template=%E9%BB%98%E8%AE%A4&format=png",
+                                         jpeg_bytes())
+    assert status == 200 and content_type == "image/png"
+    assert Image.open(io.BytesIO(body)).size == (200, 150)
+    status, _, body = request(server, "GET", "/stats")
+    stats = json.loads(body)
+    # 名额在工作进程完成时释放
+    assert stats["in_flight"] == 0 and stats["requests"]["ok"] >= 1
+
+
+@pytest.mark.parametrize("path, body, headers, expected", [
+    ("/watermark?template=missing", jpeg_bytes(), None, 404),
+    ("/watermark?template=%E9%BB%98%E8%AE%A4", b"not an image", None, 400),
+    ("/watermark?template=%E9%BB%98%E8%AE%A4", jpeg_bytes()[:200], None, 400),
+    ("/watermark?template=%E9%BB%98%E8%AE%A4&quality=0", jpeg_bytes(), None, 400),
+    ("/watermark?template=%E9%BB%98%E8%AE%A4&format=bmp", jpeg_bytes(), None, 400),
+    ("/watermark?template=%E9%BB%98%E8%AE%A4", b"", {"Content-Length": "abc"}, 400),
+    ("/watermark?template=%E9%BB%98%E8%AE%A4", b"", {"Content-Length": "-5"}, 400),
+    ("/other", b"", None, 404),
+])
+def test_rejects_invalid_requests(server, path, body, headers, expected):
+    status, _, _ = request(server, "POST", path, body, headers)
+    assert status == expected
+    assert json.loads(request(server, "GET", "/stats")[2])["in_flight"] == 0
+
+
+def test_returns_503_when_slots_are_taken(server):
+    slots = server.service._slots
+    assert slots.acquire(blocking=False)
+    try:
+        status, _, _ = request(server, "POST", "/watermark?template=%E9%BB%98%E8%AE%A4", jpeg_bytes())
+        assert status == 503
+    finally:
+        slots.release()
+    status, _, _ = request(server, "POST", "/watermark?template=%E9%BB%98%E8%AE%A4", jpeg_bytes())
+    assert status == 200
@@ -0,0 +1,67 @@
+import pytest
+from PIL import Image
+
+np = pytest.importorskip("numpy")  # NumPy 是可选依赖
+
+import watermarker
+from watermarker import Watermarker
+
+
+@pytest.fixture
+def marker(font_path):
+    return Watermarker({"watermark_text": "Test", "watermark_font": font_path, "watermark_font_size": 24,
+                        "watermark_color": "#FF0000"})
+
+
+def _rgba_array():
+    return np.full((120, 200, 4), (10, 20, 30, 255), dtype=np.uint8)
+
+
+def test_pillow_frombuffer_writes_through():
+    # apply_array(inplace=True) 依赖 Pillow 未公开的行为；这个测试失败说明升级后的 Pillow 不再直接写入，
+    # 就地处理会退化为复制后写回（结果仍然正确，但多一次复制）
+    assert watermarker.frombuffer_writes_through()
+
+
+def test_apply_array_inplace_rgba_matches_copy(marker):
+    expected = marker.apply_array(_rgba_array())
+    array = _rgba_array()
+    pointer = array.__array_interface__["data"][0]
+    result = marker.apply_array(array, inplace=True)
+    assert result is array and array.__array_interface__["data"][0] == pointer
+    assert np.array_equal(array, expected)
+    assert not np.array_equal(array, _rgba_array())
+
+
+def test_apply_array_inplace_falls_back_when_not_writable(marker, monkeypatch):
+    monkeypatch.setattr(watermarker, "_frombuffer_writable", False)
+    expected = marker.apply_array(_rgba_array())
+    array = _rgba_array()
+    assert marker.apply_array(array, inplace=True) is array
+    assert np.array_equal(array, expected)
+
+
+def test_apply_array_shapes(marker):
+    rgb = np.full((60, 80, 3), 100, dtype=np.uint8)
+    assert marker.apply_array(rgb).shape == (60, 80, 3)
+    assert marker.apply_array(np.full((60, 80), 100, dtype=np.uint8)).shape == (60, 80, 3)
+    with pytest.raises(ValueError):
+        marker.apply_array(rgb.astype(np.float32))
+    with pytest.raises(ValueError):
+        marker.apply_array(np.zeros((60, 80), dtype=np.uint8), inplace=True)
+
+
+def test_apply_does_not_modify_input(marker):
+    image = Image.new("RGB", (200, 120), (10, 20, 30))
+    result = marker.apply(image)
+    assert result is not image
+    assert image.getextrema() == ((10, 10), (20, 20), (30, 30))
+
+
+def test_apply_iter_keeps_order_and_reports_errors(marker, make_images):
+    paths = make_images(4)
+    items = paths[:2] + ["/nonexistent.jpg"] + paths[2:]
+    errors = []
+    results = list(marker.apply_iter(items, workers=3, on_error=lambda item, e: errors.append(item)))
+    assert len(results) == 4 and errors == ["/nonexistent.jpg"]
+    assert [r.size for r in results] == [(320, 240)] * 4
@@ -0,0 +1,139 @@
+import os
+import sys
+import json
+import threading
+import subprocess
+
+import pytest
+
+import work_queue
+from work_queue import create_job, job_status, QueueWorker
+from batch_export import BatchResult
+
+WORKER_PROCESSES = 4
+
+
+def _job(tmp_path, paths, font_path, lease_seconds=work_queue.DEFAULT_LEASE_SECONDS):
+    job_dir = str(tmp_path / "job")
+    settings = {"watermark_text": "Q", "watermark_font": font_path}
+    create_job(job_dir, paths, settings, str(tmp_path / "out"), lease_seconds=lease_seconds)
+    return job_dir
+
+
+def test_create_job_refuses_existing_job(tmp_path, make_images, font_path):
+    paths = make_images(3)
+    job_dir = _job(tmp_path, paths, font_path)
+    with pytest.raises(ValueError):
+        create_job(job_dir, paths, {}, str(tmp_path / "out"))
+    assert job_status(job_dir) == {"todo": 3, "claimed": 0, "done": 0, "failed": 0}
+
+
+def test_claim_is_exclusive(tmp_path, make_images, font_path):
+    job_dir = _job(tmp_path, make_images(3), font_path)
+    first = QueueWorker(job_dir, "a", font_name_to_path={})
+    second = QueueWorker(job_dir, "b", font_name_to_path={})
+    claimed = [first.claim(), second.claim(), first.claim()]
+    assert len(set(claimed)) == 3
+    assert second.claim() is None and first.claim() is None
+    assert job_status(job_dir)["claimed"] == 3
+
+
+def test_reap_uses_lease_age_on_file_server_clock(tmp_path, make_images, font_path):
+    job_dir = _job(tmp_path, make_images(2), font_path, lease_seconds=60)
+    worker = QueueWorker(job_dir, "a", font_name_to_path={})
+    live, expired = worker.claim(), worker.claim()
+    now = worker.server_time()
+    os.utime(os.path.join(job_dir, "claimed", expired), (now - 120, now - 120))
+    assert worker.reap_expired() == 1
+    assert os.listdir(os.path.join(job_dir, "todo")) == [work_queue._item_name(expired)]
+    assert os.listdir(os.path.join(job_dir, "claimed")) == [live]
+
+
+def test_reaped_slow_worker_does_not_move_the_new_claim(tmp_path, make_images, font_path):
+    job_dir = _job(tmp_path, make_images(1), font_path, lease_seconds=60)
+    slow = QueueWorker(job_dir, "slow", font_name_to_path={})
+    fast = QueueWorker(job_dir, "fast", font_name_to_path={})
+    started, release = threading.Event(), threading.Event()
+
+    def stalled_export(input_path, result, index=None):
+        # 处理期间租约过期（例如机器休眠，心跳没有刷新）
+        started.set()
+        release.wait(30)
+
+    slow.exporter.export_one = stalled_export
+    slow_name = slow.claim()
+    slow_result = BatchResult()
+    slow_done = []
+    thread = threading.Thread(target=lambda: slow_done.append(slow.process(slow_name, slow_result)))
+    thread.start()
+    assert started.wait(30)
+
+    now = fast.server_time()
+    os.utime(os.path.join(job_dir, "claimed", slow_name), (now - 120, now - 120))
+    assert fast.reap_expired() == 1
+    fast_name = fast.claim()
+    assert fast_name is not None and fast_name != slow_name
+    # 收回后慢的工作进程才完成：不能把新的领取移到 done/
+    release.set()
+    thread.join(30)
+    assert slow_done == [False]
+    assert job_status(job_dir) == {"todo": 0, "claimed": 1, "done": 0, "failed": 0}
+    assert os.listdir(os.path.join(job_dir, "claimed")) == [fast_name]
+    # 新领取的租约仍然有效，不会被收回
+    assert slow.reap_expired() == 0
+
+    result = BatchResult()
+    assert fast.process(fast_name, result)
+    assert len(result.rendered) == 1
+    assert job_status(job_dir) == {"todo": 0, "claimed": 0, "done": 1, "failed": 0}
+
+
+def test_process_skips_claim_reaped_before_open(tmp_path, make_images, font_path):
+    job_dir = _job(tmp_path, make_images(1), font_path, lease_seconds=60)
+    worker = QueueWorker(job_dir, "a", font_name_to_path={})
+    other = QueueWorker(job_dir, "b", font_name_to_path={})
+    name = worker.claim()
+    now = other.server_time()
+    os.utime(os.path.join(job_dir, "claimed", name), (now - 120, now - 120))
+    assert other.reap_expired() == 1
+    result = BatchResult()
+    assert worker.process(name, result) is False
+    assert not result.rendered and not result.failed
+    assert job_status(job_dir) == {"todo": 1, "claimed": 0, "done": 0, "failed": 0}
+
+
+def test_run_moves_items_to_done(tmp_path, make_images, font_path):
+    paths = make_images(3)
+    job_dir = _job(tmp_path, paths, font_path)
+    result = QueueWorker(job_dir, "a", font_name_to_path={}).run()
+    assert len(result.rendered) == 3 and not result.failed
+    assert job_status(job_dir) == {"todo": 0, "claimed": 0, "done": 3, "failed": 0}
+    # 探测文件在结束时删除
+    assert not [name for name in os.listdir(job_dir) if name.startswith(".clock-")]
+
+
+def test_multiple_processes_process_each_item_once(tmp_path, make_images, font_path):
+    paths = make_images(24)
+    job_dir = _job(tmp_path, paths, font_path)
+    workers = [
+        subprocess.Popen(
+            [sys.executable, work_queue.__file__, "worker", "--job-dir", job_dir, "--worker-id", f"w{i}"],
+            stdout=subprocess.PIPE, text=True,
+        )
+        for i in range(WORKER_PROCESSES)
+    ]
+    reports = []
+    for process in workers:
+        stdout, _ = process.communicate(timeout=120)
+        assert process.returncode == 0
+        reports.append(json.loads(stdout.strip().splitlines()[-1]))
+
+    assert job_status(job_dir) == {"todo": 0, "claimed": 0, "done": len(paths), "failed": 0}
+    done_inputs = []
+    for name in os.listdir(os.path.join(job_dir, "done")):
+        with open(os.path.join(job_dir, "done", name), encoding="utf-8") as f:
+            done_inputs.append(json.load(f)["input"])
+    assert sorted(done_inputs) == sorted(os.path.abspath(p) for p in paths)
+    # 每张图片只被渲染一次
+    assert sum(report["rendered"] for report in reports) == len(paths)
+    assert len(os.listdir(tmp_path / "out")) == len(paths)
@@ -0,0 +1,159 @@
+"""跨会话保存的磁盘缩略图缓存（不依赖Qt）
+
+缩略图按 (源文件路径, 缩略图尺寸, 源文件修改时间, 源文件大小) 的摘要命名，保存在程序数据目录下，
+源文件被修改后摘要随之变化，旧缩略图不会被误用，最终按最近最少使用被清理。
+再次导入同一批图片时直接读取几KB的缩略图文件，不必解码原图。
+缓存总大小超过上限时，按最后使用时间（命中时更新文件的修改时间）删除最久未用的缩略图。
+"""
+import os
+import io
+import hashlib
+import tempfile
+import threading
+
+from PIL import Image, features
+
+import watermark_core
+from watermark_core import DEFAULT_TEMPLATES_DIR
+
+# 默认缓存目录与容量上限（MB）
+DEFAULT_THUMBNAIL_CACHE_DIR = os.path.join(DEFAULT_TEMPLATES_DIR, "thumbnails")
+DEFAULT_THUMBNAIL_DISK_CACHE_MB = 200
+
+# 超过上限时清理到上限的这个比例，避免每次写入都触发清理
+PRUNE_TARGET_RATIO = 0.8
+
+# 缩略图编码格式（Pillow 不支持 WebP 时使用 JPEG）与质量
+THUMBNAIL_FORMAT = "WEBP" if features.check("webp") else "JPEG"
+THUMBNAIL_QUALITY = 80
+_EXTENSION = ".webp" if THUMBNAIL_FORMAT == "WEBP" else ".jpg"
+# WebP 用最快的压缩方法（文件只大几个百分点，编码快一倍多）
+_SAVE_OPTIONS = {"method": 0} if THUMBNAIL_FORMAT == "WEBP" else {}
+
+
+class ThumbnailCache:
+    """磁盘缩略图缓存（线程安全）"""
+
+    def __init__(self, cache_dir=DEFAULT_THUMBNAIL_CACHE_DIR, max_mb=DEFAULT_THUMBNAIL_DISK_CACHE_MB):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_mb * 1024 * 1024
+        self._total_bytes = None  # 第一次写入时扫描目录得到
+        self._lock = threading.Lock()
+
+    def entry_path(self, file_path, size):
+        """缩略图文件路径；源文件无法访问时抛出 OSError"""
+        stat = os.stat(file_path)
+        key = f"{os.path.normcase(os.path.abspath(file_path))}|{size}|{stat.st_mtime_ns}|{stat.st_size}"
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, digest[:2], digest + _EXTENSION)
+
+    def get(self, file_path, size):
+        """读取缓存的缩略图，没有时返回 None"""
+        entry_path = self.entry_path(file_path, size)
+        try:
+            with Image.open(entry_path) as cached:
+                cached.load()
+                image = cached.copy()
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            # 文件损坏（例如写入时断电），删除后重新生成
+            print(f"读取缓存的缩略图 {entry_path} 时出错: {e}")
+            self._remove(entry_path)
+            return None
+        try:
+            os.utime(entry_path)  # 记录最后使用时间
+        except OSError:
+            pass
+        return image
+
+    def put(self, file_path, size, image):
+        """保存缩略图"""
+        entry_path = self.entry_path(file_path, size)
+        buffer = io.BytesIO()
+        image.save(buffer, THUMBNAIL_FORMAT, quality=THUMBNAIL_QUALITY, **_SAVE_OPTIONS)
+        data = buffer.getvalue()
+        entry_dir = os.path.dirname(entry_path)
+        os.makedirs(entry_dir, exist_ok=True)
+        # 缓存丢失只需重新生成，不必像导出那样落盘；临时文件重命名保证不会读到半个文件
+        fd, temp_path = tempfile.mkstemp(prefix=watermark_core.TEMP_FILE_PREFIX, suffix=".tmp", dir=entry_dir)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, entry_path)
+        except BaseException:
+            self._remove(temp_path)
+            raise
+        with self._lock:
+            if self._total_bytes is None:
+                self._total_bytes = self._scan_total()
+            else:
+                self._total_bytes += len(data)
+            needs_prune = self._total_bytes > self.max_bytes
+        if needs_prune:
+            self.prune()
+
+    def load(self, file_path, size):
+        """取得缩略图：优先读取缓存，没有时从源文件生成并写入缓存"""
+        image = self.get(file_path, size)
+        if image is not None:
+            return image
+        image = watermark_core.load_thumbnail(file_path, size)
+        try:
+            self.put(file_path, size, image)
+        except OSError as e:
+            print(f"保存缩略图缓存时出错: {e}")
+        return image
+
+    def _entries(self):
+        """[(最后使用时间, 字节数, 路径)]"""
+        entries = []
+        try:
+            subdirs = list(os.scandir(self.cache_dir))
+        except OSError:
+            return entries
+        for subdir in subdirs:
+            if not subdir.is_dir():
+                continue
+            try:
+                with os.scandir(subdir.path) as it:
+                    for entry in it:
+                        if entry.is_file():
+                            stat = entry.stat()
+                            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            except OSError:
+                continue
+        return entries
+
+    def _scan_total(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def prune(self, max_bytes=None):
+        """删除最久未用的缩略图，直到总大小不超过上限的 PRUNE_TARGET_RATIO，返回删除的数量"""
+        limit = self.max_bytes if max_bytes is None else max_bytes
+        with self._lock:
+            entries = sorted(self._entries())
+            total = sum(size for _, size, _ in entries)
+            removed = 0
+            if total > limit:
+                target = limit * PRUNE_TARGET_RATIO
+                for _, size, path in entries:
+                    if total <= target:
+                        break
+                    if self._remove(path):
+                        total -= size
+                        removed += 1
+            self._total_bytes = total
+        return removed
+
+    def clear(self):
+        """删除所有缓存的缩略图"""
+        return self.prune(0)
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+            return True
+        except OSError:
+            return False
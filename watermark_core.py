@@ -0,0 +1,1444 @@
+import os
+import io
+import re
+import sys
+import json
+import math
+import tempfile
+import threading
+import hashlib
+import weakref
+import bisect
+from PIL import Image, ImageDraw, ImageFont, ImageColor, JpegImagePlugin
+
+# 水印与导出设置的默认值（与GUI中的属性名保持一致，也是模板JSON的字段名）
+DEFAULT_SETTINGS = {
+    "watermark_text": "",
+    "watermark_position": (0.5, 0.5),
+    "watermark_font_size": 30,
+    "watermark_opacity": 128,
+    "watermark_font": "simhei.ttf",
+    "watermark_bold": False,
+    "watermark_italic": False,
+    "watermark_color": "white",
+    "watermark_shadow": False,
+    "watermark_stroke": False,
+    "watermark_stroke_width": 1,
+    "watermark_stroke_color": "black",
+    "watermark_rotation": 0,
+    "use_image_watermark": False,
+    "watermark_image_path": "",
+    "watermark_image_size_ratio": 20,
+    "watermark_image_opacity": 128,
+    # 额外的水印图层（按顺序绘制在主水印之下），每一项是由 LAYER_SETTING_KEYS 组成的字典
+    "watermark_layers": [],
+    "export_format": "JPEG",
+    "export_quality": 95,
+    "encoder_profile": "balanced",
+    "target_file_size_kb": 0,  # 目标文件大小上限（KB），0 表示不限制
+    "keep_source_quality": False,  # JPEG源图沿用原量化表和色度抽样
+    "use_suffix": True,
+    "suffix_text": "_watermark",
+    "save_to_same_dir": False,
+}
+
+# 影响渲染结果的设置项（用于计算设置哈希，命名相关的设置不影响像素）
+RENDER_SETTING_KEYS = (
+    "watermark_text", "watermark_position", "watermark_font_size", "watermark_opacity",
+    "watermark_font", "watermark_bold", "watermark_italic", "watermark_color",
+    "watermark_shadow", "watermark_stroke", "watermark_stroke_width", "watermark_stroke_color",
+    "watermark_rotation", "use_image_watermark", "watermark_image_path",
+    "watermark_image_size_ratio", "watermark_image_opacity", "watermark_layers",
+    "export_format", "export_quality", "encoder_profile", "target_file_size_kb",
+    "keep_source_quality",
+)
+
+# 其中只影响编码、不影响水印像素的设置（预览和多规格共用加水印结果时不区分）
+ENCODE_SETTING_KEYS = (
+    "export_format", "export_quality", "encoder_profile", "target_file_size_kb", "keep_source_quality",
+)
+
+# 一个水印图层包含的设置（主水印也由这些设置描述）
+LAYER_SETTING_KEYS = (
+    "watermark_text", "watermark_position", "watermark_font_size", "watermark_opacity",
+    "watermark_font", "watermark_bold", "watermark_italic", "watermark_color",
+    "watermark_shadow", "watermark_stroke", "watermark_stroke_width", "watermark_stroke_color",
+    "watermark_rotation", "use_image_watermark", "watermark_image_path",
+    "watermark_image_size_ratio", "watermark_image_opacity",
+)
+
+# 导出格式对应的扩展名
+FORMAT_EXTENSIONS = {
+    "JPEG": ".jpg",
+    "PNG": ".png",
+    "WEBP": ".webp",
+}
+
+# 编码配置：在编码速度和文件大小之间取舍（参数直接传给 Image.save）
+ENCODER_PROFILES = {
+    # 最快：关闭熵编码优化，PNG使用最低压缩级别，适合校样批次
+    "fastest": {
+        "JPEG": {"optimize": False, "progressive": False, "subsampling": 2},
+        "PNG": {"compress_level": 1},
+        "WEBP": {"method": 0},
+    },
+    # 均衡：优化哈夫曼表（无损、代价小），PNG使用默认压缩级别
+    "balanced": {
+        "JPEG": {"optimize": True, "progressive": False, "subsampling": 2},
+        "PNG": {"compress_level": 6},
+        "WEBP": {"method": 4},
+    },
+    # 最小：渐进式JPEG，PNG最高压缩并优化，WebP最慢的编码方法，适合CDN上传
+    "smallest": {
+        "JPEG": {"optimize": True, "progressive": True, "subsampling": 2},
+        "PNG": {"optimize": True},
+        "WEBP": {"method": 6},
+    },
+}
+
+# 编码配置的显示名称
+ENCODER_PROFILE_NAMES = {
+    "fastest": "最快",
+    "balanced": "均衡",
+    "smallest": "最小",
+}
+
+# 支持导入的图片扩展名
+SUPPORTED_EXTENSIONS = ['.jpg', '.jpeg', '.png']
+
+# 程序保存设置和模板的默认目录
+DEFAULT_TEMPLATES_DIR = os.path.join(os.path.expanduser("~"), ".photo_watermark_templates")
+
+# 字体缓存（按线程区分，FreeType字体对象不能被多个线程同时使用）
+_font_cache_local = threading.local()
+
+
+def _get_font_cache():
+    """返回当前线程的字体缓存"""
+    cache = getattr(_font_cache_local, 'fonts', None)
+    if cache is None:
+        cache = _font_cache_local.fonts = {}
+    return cache
+
+
+def normalize_settings(settings):
+    """用默认值补全设置字典，返回新的字典"""
+    result = dict(DEFAULT_SETTINGS)
+    for key, value in settings.items():
+        if key in DEFAULT_SETTINGS:
+            result[key] = value
+    result["watermark_position"] = tuple(result["watermark_position"])
+    result["watermark_layers"] = [normalize_layer(layer) for layer in result["watermark_layers"] or ()]
+    return result
+
+
+def normalize_layer(layer):
+    """用默认值补全一个水印图层，返回只包含图层设置的新字典"""
+    result = {key: layer.get(key, DEFAULT_SETTINGS[key]) for key in LAYER_SETTING_KEYS}
+    result["watermark_position"] = tuple(result["watermark_position"])
+    return result
+
+
+def settings_hash(settings):
+    """计算影响输出的设置哈希（水印图片按内容参与哈希）"""
+    data = {key: settings.get(key, DEFAULT_SETTINGS[key]) for key in RENDER_SETTING_KEYS}
+    data["watermark_position"] = list(data["watermark_position"])
+    if not data["watermark_layers"]:
+        # 没有额外图层时哈希与旧版本一致，已有的导出清单和任务不会被当作设置已修改
+        del data["watermark_layers"]
+    digest = hashlib.sha256(json.dumps(data, sort_keys=True, ensure_ascii=False, default=list).encode('utf-8'))
+    # 水印图片路径不变但内容被替换时也要重新渲染
+    for layer in [data, *data.get("watermark_layers", ())]:
+        image_path = layer.get("watermark_image_path")
+        if layer.get("use_image_watermark") and image_path and os.path.isfile(image_path):
+            digest.update(file_sha256(image_path).encode('ascii'))
+    return digest.hexdigest()
+
+
+def file_sha256(file_path, chunk_size=1024 * 1024):
+    """计算文件内容的SHA-256"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def layer_has_watermark(layer):
+    """判断一个水印图层（或主水印）是否有需要绘制的内容"""
+    if layer.get("use_image_watermark"):
+        return bool(layer.get("watermark_image_path"))
+    return bool(layer.get("watermark_text", "").strip())
+
+
+def has_watermark(settings):
+    """判断当前设置是否需要添加水印（主水印或任一图层）"""
+    return layer_has_watermark(settings) or any(layer_has_watermark(layer) for layer in settings.get("watermark_layers") or ())
+
+
+def get_watermark_layers(settings):
+    """按绘制顺序返回需要绘制的水印图层：先是 watermark_layers 中的图层，最后是主水印"""
+    settings = normalize_settings(settings)
+    layers = [layer for layer in settings["watermark_layers"] if layer_has_watermark(layer)]
+    primary = {key: settings[key] for key in LAYER_SETTING_KEYS}
+    if layer_has_watermark(primary):
+        layers.append(primary)
+    return layers
+
+
+def needs_fonts(settings):
+    """是否有文本水印（需要系统字体映射按显示名称查找字体文件）"""
+    return any(not layer["use_image_watermark"] for layer in get_watermark_layers(settings))
+
+
+# 文本水印中可以使用的变量（按每张图片填写），例如 "© {artist} {exif_date} #{index:03d}"；
+# 冒号后可以跟 Python 的格式说明。图片没有对应的信息时变量替换为空，不认识的变量保持原样
+TEXT_TOKENS = {
+    "filename": "文件名（含扩展名）",
+    "name": "文件名（不含扩展名）",
+    "index": "图片在列表中的序号（从1开始）",
+    "artist": "EXIF 作者",
+    "copyright": "EXIF 版权信息",
+    "camera": "EXIF 相机型号",
+    "exif_date": "EXIF 拍摄日期",
+}
+_TOKEN_PATTERN = re.compile(r"\{(\w+)(?::([^{}]*))?\}")
+
+# 变量用到的 EXIF 标签
+_EXIF_TAGS = {
+    "artist": 0x013B,
+    "copyright": 0x8298,
+    "camera": 0x0110,
+}
+_EXIF_IFD = 0x8769
+_EXIF_DATETIME = 0x0132
+_EXIF_DATETIME_ORIGINAL = 0x9003
+
+# 从文件读取的 EXIF 字段缓存（按文件修改时间和大小区分），预览时不必每帧重新读取文件头
+_exif_fields_cache = {}
+_exif_fields_cache_lock = threading.Lock()
+EXIF_FIELDS_CACHE_SIZE = 256
+
+
+def text_has_tokens(text):
+    """文本中是否有需要按图片填写的变量"""
+    return any(match.group(1) in TEXT_TOKENS for match in _TOKEN_PATTERN.finditer(text))
+
+
+def has_text_tokens(settings):
+    """是否有文本水印（主水印或任一图层）使用了变量"""
+    return any(not layer["use_image_watermark"] and text_has_tokens(layer["watermark_text"])
+               for layer in get_watermark_layers(settings))
+
+
+def expand_text_tokens(text, context):
+    """用 context（见 get_text_context）填写文本中的变量"""
+    context = context or {}
+
+    def replace(match):
+        name, spec = match.group(1), match.group(2)
+        if name not in TEXT_TOKENS:
+            return match.group(0)
+        value = context.get(name)
+        if value is None:
+            return ""
+        try:
+            return format(value, spec or "")
+        except (ValueError, TypeError):
+            return str(value)
+
+    return _TOKEN_PATTERN.sub(replace, text)
+
+
+def read_exif_fields(image):
+    """从图片的EXIF中读取变量用到的字段，返回字典（图片中没有的字段不包含）"""
+    try:
+        exif = image.getexif()
+    except Exception as e:
+        print(f"读取EXIF时出错: {e}")
+        return {}
+    fields = {}
+    for name, tag in _EXIF_TAGS.items():
+        value = exif.get(tag)
+        if isinstance(value, bytes):
+            value = value.decode('utf-8', 'replace')
+        if value:
+            value = str(value).strip().strip('\x00')
+            if value:
+                fields[name] = value
+    try:
+        date = exif.get_ifd(_EXIF_IFD).get(_EXIF_DATETIME_ORIGINAL) or exif.get(_EXIF_DATETIME)
+    except Exception:
+        date = exif.get(_EXIF_DATETIME)
+    if date:
+        # EXIF 日期格式为 "YYYY:MM:DD HH:MM:SS"
+        fields["exif_date"] = str(date)[:10].replace(":", "-")
+    return fields
+
+
+def _read_exif_fields_from_file(file_path):
+    stat = os.stat(file_path)
+    key = (file_path, stat.st_mtime_ns, stat.st_size)
+    with _exif_fields_cache_lock:
+        cached = _exif_fields_cache.get(key)
+    if cached is not None:
+        return cached
+    with Image.open(file_path) as source:
+        fields = read_exif_fields(source)
+    with _exif_fields_cache_lock:
+        _cache_put(_exif_fields_cache, key, fields, EXIF_FIELDS_CACHE_SIZE)
+    return fields
+
+
+def get_text_context(file_path=None, index=None, image=None):
+    """一张图片的变量值：文件名、序号和 EXIF 字段
+
+    image 为已解码的源图片（load_source 的结果保留了EXIF），不提供时从 file_path 读取文件头；
+    file_path 也可以是文件对象（此时没有文件名）。
+    """
+    context = {}
+    is_path = isinstance(file_path, (str, os.PathLike))
+    if is_path:
+        filename = os.path.basename(os.fspath(file_path))
+        context["filename"] = filename
+        context["name"] = os.path.splitext(filename)[0]
+    if index is not None:
+        context["index"] = index
+    try:
+        if image is not None:
+            context.update(read_exif_fields(image))
+        elif is_path:
+            context.update(_read_exif_fields_from_file(file_path))
+    except OSError as e:
+        print(f"读取EXIF时出错: {e}")
+    return context
+
+
+def get_rgb_from_color(color):
+    """将颜色名称或代码转换为RGB值（不依赖Qt）"""
+    if isinstance(color, str):
+        try:
+            return ImageColor.getrgb(color)[:3]
+        except ValueError:
+            # 默认返回白色
+            return (255, 255, 255)
+    elif isinstance(color, (tuple, list)):
+        # 确保RGB值在有效范围内，忽略alpha通道
+        if len(color) in (3, 4):
+            return tuple(max(0, min(255, int(c))) for c in color[:3])
+    # 默认返回白色
+    return (255, 255, 255)
+
+
+def get_font_dirs():
+    """根据操作系统返回主要字体目录"""
+    if os.name == 'nt':
+        # Windows系统
+        return [r'C:\Windows\Fonts']
+    elif sys.platform == 'darwin':
+        # macOS系统
+        return ['/Library/Fonts']
+    # Linux/Unix系统
+    return ['/usr/share/fonts']
+
+
+def scan_system_fonts():
+    """扫描系统字体，返回 (显示名称列表, 显示名称到路径的映射)"""
+    fonts = []
+    font_dirs = get_font_dirs()
+
+    # 添加常用字体作为默认选项，包括更多支持中文的字体
+    common_fonts = [
+        'Arial.ttf', 'Arial.ttc', 'times.ttf', 'times.ttc',
+        # 中文字体
+        'simhei.ttf', 'simsun.ttc', 'msyh.ttc', 'msyhbd.ttc',
+        'msyhl.ttc', 'msyh_boot.ttf', 'msjh.ttc', 'msjhbd.ttc',
+        'msjh_boot.ttf', 'simsunb.ttf', 'simkai.ttf', 'simli.ttf',
+        'simfang.ttf', 'simyou.ttf', 'STSong.ttf', 'STZhongsong.ttf',
+        'STKaiti.ttf', 'STFangsong.ttf', 'STXihei.ttf', 'STCaiyun.ttf',
+        'STHupo.ttf', 'STLiti.ttf', 'STXingkai.ttf', 'STXingkai.ttf',
+        'STXingkai_boot.ttf',
+        # 其他常用字体
+        'calibri.ttf', 'verdana.ttf', 'tahoma.ttf', 'courier.ttf',
+        'comic.ttf', 'impact.ttf', 'georgia.ttf'
+    ]
+
+    # 已知支持中文的字体名称列表
+    chinese_support_fonts = {
+        'simhei.ttf', 'simsun.ttc', 'simsunb.ttf',
+        'msyh.ttc', 'msyhbd.ttc', 'msyhl.ttc', 'msyh_boot.ttf',
+        'msjh.ttc', 'msjhbd.ttc', 'msjh_boot.ttf',
+        'simkai.ttf', 'simli.ttf', 'simfang.ttf', 'simyou.ttf',
+        'stsong.ttf', 'stzhongsong.ttf', 'stkaiti.ttf', 'stfangsong.ttf',
+        'stxihei.ttf', 'stcaiyun.ttf', 'sthupo.ttf', 'stliti.ttf',
+        'stxingkai.ttf', 'stxingkai_boot.ttf'
+    }
+
+    for font_dir in font_dirs:
+        font_dir = os.path.expanduser(font_dir)
+        if os.path.exists(font_dir):
+            try:
+                # 使用更快的os.listdir代替glob.glob
+                for item in os.listdir(font_dir):
+                    # 检查文件扩展名
+                    ext = os.path.splitext(item)[1].lower()[1:]  # 获取不带点的扩展名
+                    if ext in ['ttf', 'ttc', 'otf']:
+                        fonts.append(os.path.join(font_dir, item))
+            except Exception:
+                continue
+
+    # 添加常用字体到结果中（如果它们不存在）
+    for common_font in common_fonts:
+        common_font_path = os.path.join(font_dirs[0], common_font) if font_dirs else common_font
+        if common_font_path not in fonts:
+            fonts.append(common_font_path)
+
+    # 去重并保留顺序
+    seen = set()
+    unique_fonts = []
+    for font_path in fonts:
+        font_name = os.path.basename(font_path)
+        if font_name not in seen:
+            seen.add(font_name)
+            unique_fonts.append(font_path)
+
+    # 创建字体名称到路径的映射
+    font_name_to_path = {}
+    result = []
+
+    for font_path in unique_fonts:
+        font_name = os.path.basename(font_path)
+        # 对于不支持中文的字体，添加标注
+        display_name = font_name
+        if font_name.lower() not in chinese_support_fonts:
+            display_name = f"{font_name} [不支持中文]"
+
+        result.append(display_name)
+        # 保存字体名称到完整路径的映射（使用原始名称作为键）
+        font_name_to_path[display_name] = font_path
+
+    return result, font_name_to_path
+
+
+def load_font(settings, font_name_to_path=None):
+    """按设置加载字体（带进程级缓存，增强中文显示支持）"""
+    font_name = settings.get("watermark_font", DEFAULT_SETTINGS["watermark_font"])
+    font_size = settings.get("watermark_font_size", DEFAULT_SETTINGS["watermark_font_size"])
+    watermark_text = settings.get("watermark_text", "")
+
+    # 生成字体缓存键
+    font_key = (
+        font_name,
+        font_size,
+        settings.get("watermark_bold", False),
+        settings.get("watermark_italic", False)
+    )
+
+    # 快速路径：检查是否有缓存的字体
+    font_cache = _get_font_cache()
+    if font_key in font_cache:
+        return font_cache[font_key]
+
+    font_path = None
+    original_font_name = font_name
+
+    try:
+        # 优先使用字体名称到路径的映射（最可靠的方法）
+        if font_name_to_path and font_name in font_name_to_path:
+            font_path = font_name_to_path[font_name]
+        else:
+            # 处理带标注的字体名称，提取原始字体名
+            if '[' in font_name:
+                # 移除标注部分
+                original_font_name = font_name.split('[')[0].strip()
+
+            # 特殊处理常见字体，确保正确加载
+            common_fonts = {
+                'times': 'times.ttf',
+                'times new roman': 'times.ttf',
+                'calibri': 'calibri.ttf',
+                'arial': 'arial.ttf',
+                'courier': 'cour.ttf',
+                'verdana': 'verdana.ttf',
+                'tahoma': 'tahoma.ttf',
+                'comic sans ms': 'comic.ttf',
+                'impact': 'impact.ttf',
+                'georgia': 'georgia.ttf',
+                'palatino': 'pala.ttf',
+                'bookman': 'bookman.ttf',
+                'century': 'century.ttf',
+                'simhei': 'simhei.ttf',
+                'simsun': 'simsun.ttc',
+                'msyh': 'msyh.ttc',
+                'msyhbd': 'msyhbd.ttc',
+                'microsoft yahei': 'msyh.ttc',
+                'microsoft yahei bold': 'msyhbd.ttc',
+                '微软雅黑': 'msyh.ttc',
+                '微软雅黑粗体': 'msyhbd.ttc',
+                '黑体': 'simhei.ttf',
+                '宋体': 'simsun.ttc',
+            }
+
+            # 尝试常见字体映射
+            font_lower = original_font_name.lower()
+            system_font_dir = r'C:\Windows\Fonts'
+
+            # 检查水印文本或字体名称是否包含中文
+            has_chinese_text = any('\u4e00' <= char <= '\u9fff' for char in watermark_text)
+            has_chinese_font_name = any('\u4e00' <= char <= '\u9fff' for char in font_name)
+
+            # 如果水印文本包含中文，或者字体名称包含中文，或者找不到指定字体，优先使用中文字体
+            if has_chinese_text or has_chinese_font_name or (font_lower not in common_fonts and not os.path.isfile(font_name)):
+                for chinese_font in ['simhei.ttf', 'msyh.ttc', 'simsun.ttc']:
+                    candidate = os.path.join(system_font_dir, chinese_font)
+                    if os.path.exists(system_font_dir) and os.path.isfile(candidate):
+                        font_path = candidate
+                        break
+
+            # 如果还没找到，尝试常见字体映射
+            if not font_path and font_lower in common_fonts and os.path.exists(system_font_dir):
+                candidate = os.path.join(system_font_dir, common_fonts[font_lower])
+                if os.path.isfile(candidate):
+                    font_path = candidate
+
+            # 如果仍然没有找到，尝试构建完整路径
+            if not font_path:
+                if os.path.isfile(original_font_name):
+                    font_path = original_font_name
+                elif os.path.exists(system_font_dir):
+                    # 尝试添加常见扩展名
+                    if not any(original_font_name.lower().endswith(ext) for ext in ['.ttf', '.ttc', '.otf']):
+                        for ext in ['.ttf', '.ttc', '.otf']:
+                            candidate = os.path.join(system_font_dir, f'{original_font_name}{ext}')
+                            if os.path.isfile(candidate):
+                                font_path = candidate
+                                break
+
+        # 如果找到了字体路径，尝试加载
+        if font_path and os.path.isfile(font_path):
+            font = ImageFont.truetype(font_path, font_size, encoding="utf-8")
+        else:
+            # 如果没有找到字体路径，尝试让PIL自动查找
+            try:
+                font = ImageFont.truetype(original_font_name, font_size, encoding="utf-8")
+            except Exception:
+                # 回退到不指定encoding的方式
+                font = ImageFont.truetype(original_font_name, font_size)
+    except Exception as e:
+        print(f"加载字体时出错: {str(e)}")
+        # 如果所有尝试都失败，强制使用中文字体
+        try:
+            fallback_font = None
+            system_font_dir = r'C:\Windows\Fonts'
+            if os.path.exists(system_font_dir):
+                for fb_font in ['simhei.ttf', 'msyh.ttc', 'simsun.ttc', 'Arial.ttf']:
+                    fb_path = os.path.join(system_font_dir, fb_font)
+                    if os.path.isfile(fb_path):
+                        fallback_font = fb_path
+                        break
+
+            if fallback_font:
+                font = ImageFont.truetype(fallback_font, font_size, encoding="utf-8")
+            else:
+                # 最后使用PIL默认字体
+                font = ImageFont.load_default()
+        except Exception as fallback_error:
+            print(f"加载后备字体时出错: {str(fallback_error)}")
+            font = ImageFont.load_default()
+
+    # 缓存加载的字体
+    font_cache[font_key] = font
+    return font
+
+
+# 文本排版缓存：字体对象 -> {文本: TextLayout}，字体对象被释放时随之清除
+_text_layout_cache = weakref.WeakKeyDictionary()
+_text_layout_cache_lock = threading.Lock()
+TEXT_LAYOUT_CACHE_SIZE = 256  # 每个字体最多缓存的文本数
+
+# 多行文本的行间距（与 ImageDraw.multiline_text 的默认值相同）
+MULTILINE_SPACING = 4
+
+
+class TextLayout:
+    """一段文本在某个字体下的排版信息
+
+    bbox 是在原点 (0, 0) 绘制时文字墨迹的范围 (左, 上, 右, 下)。墨迹左上角相对绘制原点有 (bbox[0], bbox[1]) 的偏移，
+    要让墨迹的左上角落在 (x, y)，应在 origin_for(x, y) 处绘制。
+    lines 为每行的 (文本, 宽度)；ascent、descent 为字体的行度量，line_height 为多行文本相邻两行基线的距离。
+    """
+
+    def __init__(self, text, bbox, lines, ascent, descent, line_height):
+        self.text = text
+        self.bbox = bbox
+        self.width = bbox[2] - bbox[0]
+        self.height = bbox[3] - bbox[1]
+        self.lines = lines
+        self.ascent = ascent
+        self.descent = descent
+        self.line_height = line_height
+
+    def origin_for(self, x, y):
+        """墨迹左上角位于 (x, y) 时的绘制原点"""
+        return x - self.bbox[0], y - self.bbox[1]
+
+
+def _get_measure_draw():
+    """当前线程用于测量文本的绘图对象（只创建一次）"""
+    draw = getattr(_font_cache_local, 'measure_draw', None)
+    if draw is None:
+        draw = _font_cache_local.measure_draw = ImageDraw.Draw(Image.new('RGBA', (1, 1)))
+    return draw
+
+
+def _measure_text(font, text):
+    draw = _get_measure_draw()
+    try:
+        # 含换行时按多行文本测量（与 draw.text 的多行绘制一致）
+        bbox = draw.textbbox((0, 0), text, font=font, spacing=MULTILINE_SPACING)
+        lines = tuple((line, draw.textlength(line, font=font)) for line in text.split("\n"))
+        line_height = draw.textbbox((0, 0), "A", font=font)[3] + MULTILINE_SPACING
+    except Exception:
+        # 降级为保守的默认值
+        bbox, lines, line_height = (0, 0, 100, 50), ((text, 100),), 50
+    if hasattr(font, 'getmetrics'):
+        ascent, descent = font.getmetrics()
+    else:
+        ascent, descent = bbox[3], 0
+    return TextLayout(text, bbox, lines, ascent, descent, line_height)
+
+
+def get_text_layout(font, text):
+    """文本在字体下的排版信息（带缓存，同一字体和文本只测量一次）"""
+    with _text_layout_cache_lock:
+        layouts = _text_layout_cache.get(font)
+        layout = layouts.get(text) if layouts is not None else None
+    if layout is not None:
+        return layout
+    layout = _measure_text(font, text)
+    with _text_layout_cache_lock:
+        layouts = _text_layout_cache.setdefault(font, {})
+        if len(layouts) >= TEXT_LAYOUT_CACHE_SIZE:
+            layouts.pop(next(iter(layouts)))
+        layouts[text] = layout
+    return layout
+
+
+# 阴影相对文本的偏移（像素）
+TEXT_SHADOW_OFFSET = 2
+
+
+def _stroke_offsets(text_width, text_height, stroke_width):
+    """描边时重复绘制文本的偏移量（按绘制顺序）"""
+    # 基于文本尺寸的描边策略
+    if text_width < 100 or text_height < 50:
+        # 小文本：只绘制4个方向的描边
+        return tuple((dx * stroke_width, dy * stroke_width) for dx, dy in [(-1, 0), (1, 0), (0, -1), (0, 1)])
+    # 大文本：使用简化的偏移算法，限制最大偏移量以提高性能
+    max_offset = min(stroke_width, 3)
+    # 只绘制边缘点，减少内部点的绘制
+    return tuple((dx, dy) for dx in range(-max_offset, max_offset + 1) for dy in range(-max_offset, max_offset + 1)
+                 if abs(dx) == max_offset or abs(dy) == max_offset)
+
+
+def _draw_text_effects(draw, pos_x, pos_y, layout, font, settings):
+    """绘制描边、阴影和主文本，(pos_x, pos_y) 为文字墨迹的左上角"""
+    text = layout.text
+    text_width, text_height = layout.width, layout.height
+    pos_x, pos_y = layout.origin_for(pos_x, pos_y)
+    opacity = settings["watermark_opacity"]
+    fill_color = (*get_rgb_from_color(settings["watermark_color"]), opacity)
+
+    if settings["watermark_stroke"]:
+        # 添加描边
+        stroke_color = (*get_rgb_from_color(settings["watermark_stroke_color"]), opacity)
+        for dx, dy in _stroke_offsets(text_width, text_height, settings["watermark_stroke_width"]):
+            draw.text((pos_x + dx, pos_y + dy), text, fill=stroke_color, font=font)
+
+    if settings["watermark_shadow"] and not settings["watermark_stroke"]:
+        # 只有在没有描边的情况下才添加阴影
+        shadow_color = (0, 0, 0, int(opacity * 0.5))
+        draw.text((pos_x + TEXT_SHADOW_OFFSET, pos_y + TEXT_SHADOW_OFFSET), text, fill=shadow_color, font=font)
+
+    # 添加主水印文本
+    draw.text((pos_x, pos_y), text, fill=fill_color, font=font)
+
+
+def scale_watermark_settings(settings, scale):
+    """按比例缩放以像素为单位的水印设置，用于在缩小的代理图上渲染与原图比例一致的水印"""
+    settings = dict(settings)
+    if scale != 1.0:
+        for key in ("watermark_font_size", "watermark_stroke_width"):
+            value = settings.get(key, DEFAULT_SETTINGS[key])
+            settings[key] = max(1, int(round(value * scale)))
+        if settings.get("watermark_layers"):
+            settings["watermark_layers"] = [
+                scale_watermark_settings(layer, scale) for layer in settings["watermark_layers"]
+            ]
+    return settings
+
+
+# 已缩放、旋转并应用透明度的水印图片缓存（同一设置批量处理时不必每张重新加载）
+_watermark_image_cache = {}
+_watermark_image_cache_lock = threading.Lock()
+WATERMARK_IMAGE_CACHE_SIZE = 16
+
+# 只缩放、未旋转的水印图片缓存：拖动旋转滑块时每个角度只需旋转，不必重新读取和缩放
+_watermark_base_cache = {}
+
+
+def _cache_put(cache, key, value, max_size):
+    """放入有数量上限的缓存（调用方持有锁），超出时淘汰最早放入的项"""
+    if len(cache) >= max_size:
+        cache.pop(next(iter(cache)))
+    cache[key] = value
+
+
+def _load_watermark_base(path, stat, width):
+    """读取水印图片并缩放到指定宽度（不要修改返回的图片）"""
+    key = (path, stat.st_mtime_ns, stat.st_size, width)
+    with _watermark_image_cache_lock:
+        cached = _watermark_base_cache.get(key)
+    if cached is not None:
+        return cached
+    watermark_img = Image.open(path).convert('RGBA')
+    height = max(1, int(watermark_img.height * (width / watermark_img.width)))
+    watermark_img = watermark_img.resize((width, height), Image.LANCZOS)
+    with _watermark_image_cache_lock:
+        _cache_put(_watermark_base_cache, key, watermark_img, WATERMARK_IMAGE_CACHE_SIZE)
+    return watermark_img
+
+
+def load_watermark_image(path, width, rotation, opacity, resample=Image.BICUBIC):
+    """加载水印图片并缩放到指定宽度、旋转、应用透明度，结果按文件修改时间缓存（不要修改返回的图片）
+
+    resample 为旋转时的插值方法，交互预览可以用更快的 BILINEAR，导出总是用默认的 BICUBIC。
+    """
+    stat = os.stat(path)
+    key = (path, stat.st_mtime_ns, stat.st_size, width, rotation, opacity, resample)
+    with _watermark_image_cache_lock:
+        cached = _watermark_image_cache.get(key)
+    if cached is not None:
+        return cached
+
+    watermark_img = _load_watermark_base(path, stat, width)
+
+    # 应用旋转（如果需要）；旋转会生成新图片，不旋转时复制一份再修改透明度
+    if rotation != 0:
+        watermark_img = watermark_img.rotate(rotation, expand=True, resample=resample)
+    else:
+        watermark_img = watermark_img.copy()
+
+    # 应用透明度（整通道运算代替逐像素处理）
+    alpha = watermark_img.getchannel('A').point(lambda a: int(a * opacity / 255))
+    watermark_img.putalpha(alpha)
+
+    with _watermark_image_cache_lock:
+        _cache_put(_watermark_image_cache, key, watermark_img, WATERMARK_IMAGE_CACHE_SIZE)
+    return watermark_img
+
+
+# 文本图层缓存：字体对象 -> {键: 图层}，字体对象被释放时随之清除。
+# 未旋转的图层按 (文本, 样式) 缓存，旋转后的图层再按角度和插值方法缓存，
+# 拖动旋转滑块时每个角度只需旋转已绘制好的图层，不必重新绘制文字、描边和阴影
+_text_layer_cache = weakref.WeakKeyDictionary()
+TEXT_LAYER_CACHE_SIZE = 64  # 每个字体最多缓存的图层数
+TEXT_LAYER_PADDING = 20  # 文本图层四周的空白（容纳描边、阴影和旋转）
+
+# 多图层水印合成后的覆盖层缓存
+_layer_overlay_cache = {}
+LAYER_OVERLAY_CACHE_SIZE = 8
+
+# 影响文本图层像素的样式设置
+_TEXT_STYLE_KEYS = (
+    "watermark_color", "watermark_opacity", "watermark_shadow",
+    "watermark_stroke", "watermark_stroke_width", "watermark_stroke_color",
+)
+
+
+def _get_text_layer(font, key, create):
+    with _watermark_image_cache_lock:
+        layers = _text_layer_cache.get(font)
+        cached = layers.get(key) if layers is not None else None
+    if cached is not None:
+        return cached
+    layer = create()
+    with _watermark_image_cache_lock:
+        layers = _text_layer_cache.setdefault(font, {})
+        _cache_put(layers, key, layer, TEXT_LAYER_CACHE_SIZE)
+    return layer
+
+
+def _text_style_key(layout, settings):
+    return layout.text, tuple(settings[k] for k in _TEXT_STYLE_KEYS)
+
+
+def render_text_layer(font, layout, settings):
+    """绘制未旋转的文本图层（带描边、阴影），文字墨迹居中，四周留出 TEXT_LAYER_PADDING 的空白
+
+    按文本和样式缓存（不要修改返回的图片）。
+    """
+    def draw_layer():
+        # 创建一个足够大的临时图像来容纳原始文本
+        temp_img = Image.new('RGBA', (layout.width + 2 * TEXT_LAYER_PADDING, layout.height + 2 * TEXT_LAYER_PADDING),
+                             (255, 255, 255, 0))
+        draw = ImageDraw.Draw(temp_img, 'RGBA')
+
+        # 计算文本在临时图像中的位置（居中）
+        temp_pos_x = (temp_img.width - layout.width) // 2
+        temp_pos_y = (temp_img.height - layout.height) // 2
+        _draw_text_effects(draw, temp_pos_x, temp_pos_y, layout, font, settings)
+        return temp_img
+
+    return _get_text_layer(font, _text_style_key(layout, settings), draw_layer)
+
+
+def render_rotated_text(font, layout, settings, rotation, resample=Image.BICUBIC):
+    """绘制旋转后的文本图层（带描边、阴影），按文本、样式和角度缓存（不要修改返回的图片）"""
+    def rotate_layer():
+        # 旋转文本图像，expand=True确保旋转后图像大小足够容纳整个文本
+        layer = render_text_layer(font, layout, settings)
+        return layer.rotate(rotation, expand=True, resample=resample)
+
+    return _get_text_layer(font, (_text_style_key(layout, settings), rotation, resample), rotate_layer)
+
+
+# 字形图集：字体对象 -> GlyphAtlas，字体对象被释放时随之清除
+_glyph_atlases = weakref.WeakKeyDictionary()
+GLYPH_ATLAS_SIZE = 2048  # 每个字体最多缓存的字形位图数
+
+
+class GlyphAtlas:
+    """一个字体的字形图集：按偏移预先光栅化的单个字符覆盖率遮罩，以及字宽和字距
+
+    按图片填写变量的文本每张图片都不同，整段文本图层的缓存无法命中；
+    这类文本由缓存的字形位图拼合，不必每张图片重新光栅化整段文本和多次偏移绘制的描边。
+    ImageDraw 在 RGBA 图片上绘制文字时按覆盖率在原像素和墨水颜色（含透明通道）之间插值，
+    用墨水颜色按覆盖率遮罩粘贴的结果相同，所以遮罩与颜色、不透明度无关，描边、阴影和主文本共用。
+    字形位置取整到像素，与整段绘制相比可能有不到一像素的差别。
+    字体对象只在一个线程中使用（见 load_font），图集不加锁。
+    """
+
+    def __init__(self, font):
+        self.font = font
+        self._glyphs = {}  # (字符, 偏移) -> ('L' 遮罩, 左上角相对笔位置的偏移) 或 None（没有墨迹）
+        self._advances = {}
+        self._kerning = {}
+        draw = _get_measure_draw()
+        self.line_height = draw.textbbox((0, 0), "A", font=font)[3] + MULTILINE_SPACING
+        if hasattr(font, 'getmetrics'):
+            self.ascent, self.descent = font.getmetrics()
+        else:
+            self.ascent, self.descent = self.line_height, 0
+
+    def advance(self, char):
+        advance = self._advances.get(char)
+        if advance is None:
+            advance = self._advances[char] = self.font.getlength(char)
+        return advance
+
+    def kerning(self, left, right):
+        """两个字符相邻时相对各自字宽之和的调整量"""
+        key = left + right
+        kerning = self._kerning.get(key)
+        if kerning is None:
+            if len(self._kerning) >= GLYPH_ATLAS_SIZE:
+                self._kerning.clear()
+            kerning = self._kerning[key] = self.font.getlength(key) - self.advance(left) - self.advance(right)
+        return kerning
+
+    def glyph(self, char, offsets=((0, 0),)):
+        """字符在各偏移处重复绘制（描边）后的覆盖率遮罩，返回 (遮罩, 左上角相对笔位置的偏移)，没有墨迹时返回 None"""
+        key = (char, offsets)
+        if key in self._glyphs:
+            return self._glyphs[key]
+        left, top, right, bottom = self.font.getbbox(char)
+        glyph = None
+        if right > left and bottom > top:
+            min_x = min(dx for dx, _ in offsets)
+            min_y = min(dy for _, dy in offsets)
+            width = right - left + max(dx for dx, _ in offsets) - min_x
+            height = bottom - top + max(dy for _, dy in offsets) - min_y
+            # 重复绘制时覆盖率按 ImageDraw 的插值方式累积，取结果的透明通道作为遮罩
+            bitmap = Image.new('RGBA', (width, height), (255, 255, 255, 0))
+            draw = ImageDraw.Draw(bitmap, 'RGBA')
+            for dx, dy in offsets:
+                draw.text((dx - min_x - left, dy - min_y - top), char, fill=(255, 255, 255, 255), font=self.font)
+            glyph = (bitmap.getchannel('A'), (left + min_x, top + min_y))
+        _cache_put(self._glyphs, key, glyph, GLYPH_ATLAS_SIZE)
+        return glyph
+
+
+def get_glyph_atlas(font):
+    with _watermark_image_cache_lock:
+        atlas = _glyph_atlases.get(font)
+        if atlas is None:
+            atlas = _glyph_atlases[font] = GlyphAtlas(font)
+    return atlas
+
+
+def render_text_layer_from_atlas(font, text, settings):
+    """用字形图集拼合文本图层（带描边、阴影），图层布局与 render_text_layer 相同，不缓存
+
+    返回 (图层, TextLayout)，文本没有墨迹时返回 (None, None)。
+    """
+    atlas = get_glyph_atlas(font)
+    opacity = settings["watermark_opacity"]
+    fill_color = (*get_rgb_from_color(settings["watermark_color"]), opacity)
+
+    # 每个字符的笔位置（多行文本按 MULTILINE_SPACING 的行距排列，与整段绘制一致）
+    placements = []
+    lines = []
+    for line_number, line in enumerate(text.split("\n")):
+        pen_x = 0.0
+        previous = None
+        for char in line:
+            if previous is not None:
+                pen_x += atlas.kerning(previous, char)
+            placements.append((char, int(round(pen_x)), line_number * atlas.line_height))
+            pen_x += atlas.advance(char)
+            previous = char
+        lines.append((line, pen_x))
+
+    # 墨迹范围：各字符主文本位图的并集
+    boxes = []
+    for char, x, y in placements:
+        glyph = atlas.glyph(char)
+        if glyph is not None:
+            bitmap, (left, top) = glyph
+            boxes.append((x + left, y + top, x + left + bitmap.width, y + top + bitmap.height))
+    if not boxes:
+        return None, None
+    bbox = (min(b[0] for b in boxes), min(b[1] for b in boxes), max(b[2] for b in boxes), max(b[3] for b in boxes))
+    layout = TextLayout(text, bbox, tuple(lines), atlas.ascent, atlas.descent, atlas.line_height)
+
+    # 依次合成描边、阴影和主文本（与 _draw_text_effects 的绘制顺序相同）
+    passes = []
+    if settings["watermark_stroke"]:
+        stroke_color = (*get_rgb_from_color(settings["watermark_stroke_color"]), opacity)
+        passes.append((stroke_color, _stroke_offsets(layout.width, layout.height, settings["watermark_stroke_width"]), 0))
+    elif settings["watermark_shadow"]:
+        passes.append(((0, 0, 0, int(opacity * 0.5)), ((0, 0),), TEXT_SHADOW_OFFSET))
+    passes.append((fill_color, ((0, 0),), 0))
+
+    layer = Image.new('RGBA', (layout.width + 2 * TEXT_LAYER_PADDING, layout.height + 2 * TEXT_LAYER_PADDING),
+                      (255, 255, 255, 0))
+    origin_x, origin_y = layout.origin_for(TEXT_LAYER_PADDING, TEXT_LAYER_PADDING)
+    for color, offsets, shift in passes:
+        for char, x, y in placements:
+            glyph = atlas.glyph(char, offsets)
+            if glyph is not None:
+                mask, (left, top) = glyph
+                layer.paste(color, (origin_x + x + left + shift, origin_y + y + top + shift), mask)
+    return layer, layout
+
+
+def _clamped_position(position, canvas_size, size):
+    """元素中心位于画布的相对位置 position 时的左上角，并确保元素在画布范围内"""
+    width, height = canvas_size
+    pos_x = int(position[0] * width - size[0] / 2)
+    pos_y = int(position[1] * height - size[1] / 2)
+    pos_x = max(0, min(pos_x, width - size[0]))
+    pos_y = max(0, min(pos_y, height - size[1]))
+    return pos_x, pos_y
+
+
+def _render_layer_element(layer, canvas_size, font, font_name_to_path, resample, text_context=None):
+    """把一个水印图层绘制为独立的图片，返回 (图片, 左上角在画布中的位置)，出错或没有内容时返回 None
+
+    文本中有变量时用 text_context 填写，并用字形图集拼合（见 render_text_layer_from_atlas）。
+    """
+    rotation = layer["watermark_rotation"]
+    if layer["use_image_watermark"]:
+        try:
+            new_width = max(1, int(canvas_size[0] * layer["watermark_image_size_ratio"] / 100))
+            element = load_watermark_image(
+                layer["watermark_image_path"], new_width, rotation, layer["watermark_image_opacity"], resample
+            )
+            return element, _clamped_position(layer["watermark_position"], canvas_size, element.size)
+        except Exception as e:
+            print(f"添加图片水印时出错: {str(e)}")
+            return None
+    try:
+        if font is None:
+            font = load_font(layer, font_name_to_path)
+        text = layer["watermark_text"]
+        if text_has_tokens(text):
+            # 每张图片不同的文本由字形图集拼合，不放入整段文本图层的缓存
+            element, layout = render_text_layer_from_atlas(font, expand_text_tokens(text, text_context), layer)
+            if element is None:
+                return None
+            if rotation != 0:
+                element = element.rotate(rotation, expand=True, resample=resample)
+        else:
+            layout = get_text_layout(font, text)
+            if rotation != 0:
+                element = render_rotated_text(font, layout, layer, rotation, resample)
+            else:
+                element = render_text_layer(font, layout, layer)
+        if rotation != 0:
+            return element, _clamped_position(layer["watermark_position"], canvas_size, element.size)
+        # 不旋转时按墨迹范围定位（与单个水印直接绘制时的位置相同），再换算为图层左上角
+        pos_x, pos_y = _clamped_position(layer["watermark_position"], canvas_size, (layout.width, layout.height))
+        return element, (pos_x - (element.width - layout.width) // 2, pos_y - (element.height - layout.height) // 2)
+    except Exception as e:
+        print(f"添加文本水印时出错: {str(e)}")
+        return None
+
+
+def _group_overlapping(elements):
+    """把范围互相重叠的元素归为一组，返回 [(范围 [左, 上, 右, 下], [(序号, 图片, 位置)])]"""
+    groups = []
+    for index, (element, (x, y)) in enumerate(elements):
+        box = [x, y, x + element.width, y + element.height]
+        members = [(index, element, (x, y))]
+        merged = True
+        while merged:
+            # 合并后范围变大，可能又与其他组重叠，重复直到不再变化
+            merged = False
+            for group in groups:
+                group_box = group[0]
+                if group_box[0] < box[2] and box[0] < group_box[2] and group_box[1] < box[3] and box[1] < group_box[3]:
+                    groups.remove(group)
+                    box = [min(box[0], group_box[0]), min(box[1], group_box[1]),
+                           max(box[2], group_box[2]), max(box[3], group_box[3])]
+                    members = group[1] + members
+                    merged = True
+                    break
+        groups.append((box, members))
+    return groups
+
+
+def build_layer_overlay(layers, canvas_size, font=None, font_name_to_path=None, resample=Image.BICUBIC,
+                        text_context=None):
+    """把多个水印图层合成为覆盖层，返回 [(图片, 左上角在画布中的位置)]（不要修改返回的图片）
+
+    互相重叠的图层按绘制顺序预先合成为一块，不重叠的各自成块，
+    贴到图片上时每个像素只混合一次，也不必为分散在角落的图层分配整张画布大小的覆盖层。
+    font 只用于最后一个图层（主水印），其余图层按各自的设置加载字体。
+    结果按图层设置、画布尺寸和水印图片的修改时间缓存，批量处理同尺寸的图片时只合成一次；
+    文本中有变量的图层每张图片都不同，此时不缓存覆盖层（变量用 text_context 填写）。
+    """
+    dynamic = any(not layer["use_image_watermark"] and text_has_tokens(layer["watermark_text"]) for layer in layers)
+    key_parts = []
+    for layer in layers:
+        stat = None
+        if layer["use_image_watermark"]:
+            try:
+                file_stat = os.stat(layer["watermark_image_path"])
+                stat = (file_stat.st_mtime_ns, file_stat.st_size)
+            except OSError:
+                pass
+        key_parts.append((json.dumps(layer, sort_keys=True, ensure_ascii=False, default=list), stat))
+    key = (tuple(key_parts), tuple(canvas_size), resample, font)
+    if not dynamic:
+        with _watermark_image_cache_lock:
+            cached = _layer_overlay_cache.get(key)
+        if cached is not None:
+            return cached
+
+    elements = []
+    for index, layer in enumerate(layers):
+        element = _render_layer_element(
+            layer, canvas_size, font if index == len(layers) - 1 else None, font_name_to_path, resample, text_context
+        )
+        if element is not None:
+            elements.append(element)
+
+    overlay = []
+    for box, members in _group_overlapping(elements):
+        if len(members) == 1:
+            _, element, position = members[0]
+            overlay.append((element, position))
+            continue
+        patch = Image.new('RGBA', (box[2] - box[0], box[3] - box[1]), (0, 0, 0, 0))
+        for _, element, (x, y) in sorted(members, key=lambda member: member[0]):
+            patch.alpha_composite(element, (x - box[0], y - box[1]))
+        overlay.append((patch, (box[0], box[1])))
+
+    if not dynamic:
+        with _watermark_image_cache_lock:
+            _cache_put(_layer_overlay_cache, key, overlay, LAYER_OVERLAY_CACHE_SIZE)
+    return overlay
+
+
+def add_watermark_to_image(image, settings, font=None, font_name_to_path=None, canvas_size=None, offset=(0, 0),
+                           rotation_resample=Image.BICUBIC, text_context=None):
+    """向图片添加水印（支持文本和图片），返回处理后的图片
+
+    image 也可以是更大画布中的一块：canvas_size 为整个画布的尺寸，offset 为这一块左上角在画布中的位置。
+    水印位置按整个画布计算，只绘制落在这一块中的部分，结果与在整张图上绘制后再裁剪相同。
+    rotation_resample 为旋转水印时的插值方法；交互中的快速预览可以传入 BILINEAR，导出使用默认值。
+    设置中有 watermark_layers 时，所有图层和主水印合成为一个覆盖层后再贴到图片上（见 build_layer_overlay），
+    font 只用于主水印。
+    文本中的变量（见 TEXT_TOKENS）用 text_context（见 get_text_context）填写，同样走图层合成的路径。
+    """
+    settings = normalize_settings(settings)
+
+    # 快速路径：如果水印条件不满足，直接返回原图
+    if not has_watermark(settings):
+        return image
+
+    width, height = canvas_size or image.size
+    offset_x, offset_y = offset
+
+    if settings["watermark_layers"] or has_text_tokens(settings):
+        # 多个图层先合成为覆盖层（带缓存），再一次贴到图片上
+        layers = get_watermark_layers(settings)
+        primary_font = font if layer_has_watermark(settings) else None
+        overlay = build_layer_overlay(layers, (width, height), primary_font, font_name_to_path, rotation_resample,
+                                      text_context)
+        for patch, (pos_x, pos_y) in overlay:
+            image.paste(patch, (pos_x - offset_x, pos_y - offset_y), patch)
+        return image
+
+    position = settings["watermark_position"]
+    rotation = settings["watermark_rotation"]
+
+    if settings["use_image_watermark"]:
+        # 图片水印逻辑
+        try:
+            # 计算水印图片尺寸（基于原图的百分比）
+            new_width = max(1, int(width * settings["watermark_image_size_ratio"] / 100))
+            watermark_img = load_watermark_image(
+                settings["watermark_image_path"], new_width, rotation, settings["watermark_image_opacity"],
+                rotation_resample
+            )
+            new_width, new_height = watermark_img.size
+
+            # 计算水印位置并确保在图片范围内
+            pos_x = int(position[0] * width - new_width / 2)
+            pos_y = int(position[1] * height - new_height / 2)
+            pos_x = max(0, min(pos_x, width - new_width))
+            pos_y = max(0, min(pos_y, height - new_height))
+
+            image.paste(watermark_img, (pos_x - offset_x, pos_y - offset_y), watermark_img)
+        except Exception as e:
+            # 如果出现错误，记录日志但不中断程序
+            print(f"添加图片水印时出错: {str(e)}")
+    else:
+        # 文本水印逻辑
+        try:
+            text = settings["watermark_text"]
+            if font is None:
+                font = load_font(settings, font_name_to_path)
+
+            # 文本尺寸（同一字体和文本只测量一次）
+            layout = get_text_layout(font, text)
+            text_width, text_height = layout.width, layout.height
+
+            if rotation != 0:
+                # 旋转后的文本图层按角度缓存，批量导出和重复预览时不必重新绘制和旋转
+                temp_img = render_rotated_text(font, layout, settings, rotation, rotation_resample)
+                rotated_width, rotated_height = temp_img.size
+
+                # 计算水印在原图中的位置并确保在图片范围内
+                pos_x = int(position[0] * width - rotated_width / 2)
+                pos_y = int(position[1] * height - rotated_height / 2)
+                pos_x = max(0, min(pos_x, width - rotated_width))
+                pos_y = max(0, min(pos_y, height - rotated_height))
+
+                image.paste(temp_img, (pos_x - offset_x, pos_y - offset_y), temp_img)
+            else:
+                # 不旋转的情况，直接在原图上绘制
+                draw = ImageDraw.Draw(image, 'RGBA')
+
+                # 计算水印位置并确保在图片范围内
+                pos_x = int(position[0] * width - text_width / 2)
+                pos_y = int(position[1] * height - text_height / 2)
+                pos_x = max(0, min(pos_x, width - text_width))
+                pos_y = max(0, min(pos_y, height - text_height))
+                _draw_text_effects(draw, pos_x - offset_x, pos_y - offset_y, layout, font, settings)
+        except Exception as e:
+            # 如果出现错误，记录日志但不中断程序
+            print(f"添加文本水印时出错: {str(e)}")
+
+    return image
+
+
+def flatten_to_rgb(image):
+    """将带透明通道的图片合成到白色背景上（JPEG不支持透明度）"""
+    if image.mode == 'RGBA':
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.split()[3])  # 3 is the alpha channel
+        return background
+    elif image.mode != 'RGB':
+        return image.convert('RGB')
+    return image
+
+
+def get_encoder_options(settings):
+    """根据导出格式和编码配置返回 Image.save 的参数"""
+    export_format = settings.get("export_format", "JPEG")
+    profile = ENCODER_PROFILES.get(settings.get("encoder_profile"), ENCODER_PROFILES["balanced"])
+    options = dict(profile.get(export_format, {}))
+    if export_format in ("JPEG", "WEBP"):
+        options["quality"] = settings.get("export_quality", 95)
+    return options
+
+
+def prepare_for_format(image, export_format):
+    """将图片转换为目标格式支持的模式"""
+    if export_format == "JPEG":
+        # 确保图片模式兼容JPEG
+        return flatten_to_rgb(image)
+    if export_format == "WEBP" and image.mode not in ('RGB', 'RGBA'):
+        return image.convert('RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB')
+    return image
+
+
+def _encoded_size(image, export_format, options, quality):
+    """在内存中编码并返回字节数"""
+    buffer = io.BytesIO()
+    image.save(buffer, export_format, **dict(options, quality=quality))
+    return buffer.tell()
+
+
+def encode_to_target_size(image, settings, max_bytes, sample_pixels=1000000, max_full_encodes=5):
+    """在字节预算内寻找最高的JPEG/WebP质量，返回 (编码后的字节, 质量)
+
+    先在缩小的样图上二分查找质量（按像素数比例估算全尺寸大小），再做全尺寸编码确认。
+    样图的估算可能偏高也可能偏低：缩小后的样图每个像素的细节更多，柔和带噪点的照片按样图估算会偏大，
+    第一次全尺寸编码满足预算也不能直接返回。每次全尺寸编码后都用实际大小校正“全尺寸/样图”大小比例
+    （两点以上时按质量线性插值），在已知满足预算和已知超出预算的质量之间继续查找
+    （两端都有全尺寸编码后按它们的大小线性插值），直到两者相邻或用完 max_full_encodes 次全尺寸编码，
+    返回满足预算的最高质量。
+    """
+    export_format = settings.get("export_format", "JPEG")
+    options = get_encoder_options(settings)
+    max_quality = options.pop("quality", 95)
+    image = prepare_for_format(image, export_format)
+
+    # 使用 reduce 快速生成样图（整数倍盒式缩小）
+    factor = max(1, int(math.sqrt(image.width * image.height / sample_pixels)))
+    sample = image.reduce(factor) if factor > 1 else image
+    pixel_ratio = (image.width * image.height) / float(sample.width * sample.height)
+
+    sample_sizes = {}  # 质量 -> 样图编码大小（避免重复编码）
+    observed = []  # 全尺寸编码得到的 (质量, 全尺寸/样图 大小比例)
+
+    def sample_size(quality):
+        if quality not in sample_sizes:
+            sample_sizes[quality] = _encoded_size(sample, export_format, options, quality)
+        return sample_sizes[quality]
+
+    def size_ratio(quality):
+        if not observed:
+            return pixel_ratio
+        if len(observed) == 1:
+            return observed[0][1]
+        # 按质量在相邻的两次观测之间线性插值（超出范围时用两端的两点外推）
+        index = min(max(bisect.bisect_left(observed, (quality,)), 1), len(observed) - 1)
+        (q1, r1), (q2, r2) = observed[index - 1], observed[index]
+        return max(r1 + (r2 - r1) * (quality - q1) / float(q2 - q1), min(r1, r2))
+
+    fit_data, fit_quality = None, 0  # 满足预算的最高质量
+    over_data, over_quality = None, max_quality + 1  # 超出预算的最低质量
+    for _ in range(max_full_encodes):
+        if fit_data is not None and over_data is not None:
+            # 两端都有全尺寸编码：按实际大小在两者之间线性插值，比样图比例的估算更准
+            quality = fit_quality + int((max_bytes - len(fit_data)) * (over_quality - fit_quality)
+                                        / float(len(over_data) - len(fit_data)))
+            quality = min(max(quality, fit_quality + 1), over_quality - 1)
+        else:
+            # 在 (fit_quality, over_quality) 之间二分查找满足估算预算的最高质量
+            low, high = fit_quality + 1, over_quality - 1
+            quality = low
+            while low <= high:
+                mid = (low + high) // 2
+                if sample_size(mid) * size_ratio(mid) <= max_bytes:
+                    quality, low = mid, mid + 1
+                else:
+                    high = mid - 1
+
+        # 全尺寸编码确认
+        buffer = io.BytesIO()
+        image.save(buffer, export_format, **dict(options, quality=quality))
+        data = buffer.getvalue()
+        if len(data) <= max_bytes:
+            fit_data, fit_quality = data, quality
+        else:
+            over_data, over_quality = data, quality
+        if fit_quality + 1 >= over_quality:
+            break
+        # 记录实际比例，用于下一轮估算（满足预算时同样校正，继续尝试更高的质量）
+        observed.append((quality, len(data) / float(sample_size(quality))))
+        observed.sort()
+
+    if fit_data is not None:
+        return fit_data, fit_quality
+    # 无法满足预算时返回找到的最小结果
+    return over_data, over_quality
+
+
+def read_jpeg_encoding(image):
+    """读取JPEG源图的量化表和色度抽样（需在水印修改图片之前调用），非JPEG返回None"""
+    if getattr(image, 'format', None) != 'JPEG' or not getattr(image, 'quantization', None):
+        return None
+    encoding = {"qtables": [list(table) for _, table in sorted(image.quantization.items())]}
+    sampling = JpegImagePlugin.get_sampling(image)
+    if sampling != -1:
+        encoding["subsampling"] = sampling
+    return encoding
+
+
+def get_source_quality_options(image, settings, source_encoding):
+    """沿用源图量化表时的 Image.save 参数（不适用时返回None）"""
+    if not (settings.get("keep_source_quality") and source_encoding):
+        return None
+    if settings.get("export_format", "JPEG") != "JPEG":
+        return None
+    options = get_encoder_options(settings)
+    options.pop("quality", None)
+    options.pop("subsampling", None)
+    qtables = source_encoding["qtables"]
+    # 灰度源图只有一张量化表，输出为彩色时色度通道复用亮度表
+    if image.mode != 'L' and len(qtables) == 1:
+        qtables = qtables * 2
+    options["qtables"] = qtables
+    if "subsampling" in source_encoding:
+        options["subsampling"] = source_encoding["subsampling"]
+    return options
+
+
+def save_image(image, file_path, settings, source_encoding=None):
+    """按导出设置和编码配置保存图片（file_path 也可以是文件对象）
+
+    source_encoding 为 read_jpeg_encoding 读取的源图编码参数；开启 keep_source_quality 时
+    JPEG源图按原量化表重新编码，不再使用 export_quality 或目标文件大小。
+    """
+    export_format = settings.get("export_format", "JPEG")
+    if export_format == "JPEG" and source_encoding:
+        image = flatten_to_rgb(image) if image.mode != 'L' else image
+        options = get_source_quality_options(image, settings, source_encoding)
+        if options is not None:
+            image.save(file_path, 'JPEG', **options)
+            return
+    target_kb = settings.get("target_file_size_kb", 0)
+    if target_kb and export_format in ("JPEG", "WEBP"):
+        # 按目标文件大小自动选择质量
+        data, _ = encode_to_target_size(image, settings, target_kb * 1024)
+        if hasattr(file_path, 'write'):
+            file_path.write(data)
+        else:
+            with open(file_path, 'wb') as f:
+                f.write(data)
+        return
+    image = prepare_for_format(image, export_format)
+    image.save(file_path, export_format, **get_encoder_options(settings))
+
+
+# 原子写入时使用的临时文件前缀（与输出文件位于同一目录）
+TEMP_FILE_PREFIX = ".wmtmp-"
+
+
+def _write_atomic(output_path, write):
+    """先写入同目录的临时文件，落盘后再原子重命名为最终文件，避免中途退出留下半个文件"""
+    output_dir = os.path.dirname(os.path.abspath(output_path))
+    fd, temp_path = tempfile.mkstemp(prefix=TEMP_FILE_PREFIX, suffix=".tmp", dir=output_dir)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, output_path)
+    except BaseException:
+        # 失败时清理临时文件
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+def save_image_atomic(image, output_path, settings, source_encoding=None):
+    """编码并原子写入图片"""
+    _write_atomic(output_path, lambda f: save_image(image, f, settings, source_encoding))
+
+
+def write_bytes_atomic(data, output_path):
+    """原子写入已编码的数据"""
+    _write_atomic(output_path, lambda f: f.write(data))
+
+
+def encode_image(image, settings, source_encoding=None):
+    """按导出设置把图片编码到内存，返回字节串"""
+    buffer = io.BytesIO()
+    save_image(image, buffer, settings, source_encoding)
+    return buffer.getvalue()
+
+
+def remove_stale_temp_files(directory):
+    """清理目录中异常退出遗留的临时文件，返回清理的数量"""
+    removed = 0
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return 0
+    for name in names:
+        if name.startswith(TEMP_FILE_PREFIX) and name.endswith(".tmp"):
+            try:
+                os.remove(os.path.join(directory, name))
+                removed += 1
+            except OSError:
+                pass
+    return removed
+
+
+def get_output_extension(settings):
+    """根据导出格式返回扩展名"""
+    return FORMAT_EXTENSIONS.get(settings.get("export_format", "JPEG"), ".jpg")
+
+
+def generate_output_filename(original_path, settings, export_dir):
+    """生成输出文件路径"""
+    dir_path, file_name = os.path.split(original_path)
+    base_name, _ = os.path.splitext(file_name)
+
+    # 如果使用后缀，添加后缀
+    if settings.get("use_suffix", True):
+        output_name = f"{base_name}{settings.get('suffix_text', '')}"
+    else:
+        output_name = base_name
+
+    # 根据保存选项确定保存目录
+    save_dir = dir_path if settings.get("save_to_same_dir", False) else export_dir
+    return os.path.join(save_dir, output_name + get_output_extension(settings))
+
+
+def load_source(input_path):
+    """加载源图片（也可以是内存中的文件对象），返回 (图片, JPEG编码参数或None)"""
+    with Image.open(input_path) as source:
+        source.load()
+        source_encoding = read_jpeg_encoding(source)
+        image = source.copy()
+    return image, source_encoding
+
+
+def render_file(input_path, settings, font_name_to_path=None, index=None):
+    """加载图片文件并添加水印，返回 (图片, JPEG编码参数或None)；index 为填写 {index} 变量的序号"""
+    image, source_encoding = load_source(input_path)
+    if has_watermark(settings):
+        text_context = get_text_context(input_path, index, image) if has_text_tokens(settings) else None
+        image = add_watermark_to_image(image, settings, font_name_to_path=font_name_to_path, text_context=text_context)
+    return image, source_encoding
+
+
+def get_template_path(templates_dir, template_name):
+    """返回模板文件路径（与GUI保存模板时的命名规则一致）"""
+    return os.path.join(templates_dir, f"template_{template_name.replace(' ', '_')}.json")
+
+
+def load_template_settings(templates_dir, template_name):
+    """按名称读取已保存的模板，返回设置字典"""
+    with open(get_template_path(templates_dir, template_name), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def load_thumbnail(file_path, max_size=120):
+    """生成缩略图（JPEG利用DCT缩放只解码到接近缩略图的尺寸），返回RGB图片"""
+    with Image.open(file_path) as source:
+        if source.format == 'JPEG':
+            source.draft('RGB', (max_size * 2, max_size * 2))
+        source.thumbnail((max_size, max_size), Image.LANCZOS)
+        return flatten_to_rgb(source.copy() if source.mode in ('RGB', 'RGBA') else source.convert('RGBA'))
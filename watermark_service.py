@@ -0,0 +1,424 @@
+"""本地HTTP水印服务（常驻进程，供上传后台按请求添加水印）
+
+每张图片单独启动命令行会重复解释器、字体扫描等启动开销。服务启动时预先创建一组工作进程，
+每个进程扫描一次系统字体并预热所有模板（加载字体、按模板渲染一次小图），之后字体、模板设置
+和缩放好的水印图片都保留在进程内缓存中；模板文件修改后按修改时间自动重新加载。
+
+请求：
+    POST /watermark?template=模板名[&format=JPEG|PNG|WEBP][&quality=1-100]
+        请求体为图片数据，返回添加水印后的图片（Content-Type 按导出格式）
+    GET /health    服务状态
+    GET /stats     请求计数与延迟直方图（总延迟、工作进程处理时间），含 p50/p90/p99
+
+同时在处理和排队的请求数超过上限时立即返回 503（带 Retry-After），不会无限堆积。
+状态码：400 请求无效或图片无法解码，404 模板不存在，413 请求体过大，503 队列已满，504 处理超时。
+
+用法：
+    python watermark_service.py [--port 8765] [--workers N] [--max-queue N] [--templates-dir DIR]
+"""
+import os
+import io
+import sys
+import json
+import time
+import signal
+import argparse
+import threading
+import multiprocessing
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from PIL import Image, UnidentifiedImageError
+
+import watermark_core
+from watermark_core import DEFAULT_TEMPLATES_DIR
+from batch_export import default_worker_count
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+# 每个工作进程允许排队的请求数（不含正在处理的）
+DEFAULT_QUEUE_PER_WORKER = 4
+DEFAULT_MAX_REQUEST_MB = 64
+DEFAULT_REQUEST_TIMEOUT = 60.0
+
+CONTENT_TYPES = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp"}
+
+
+class TemplateNotFound(Exception):
+    """请求的模板不存在"""
+
+
+class QueueFull(Exception):
+    """处理中和排队的请求已达上限"""
+
+
+class LatencyHistogram:
+    """按固定的对数间隔分桶的延迟直方图（线程安全）
+
+    百分位数取所在桶的上界，是偏保守的估计；超过最大分桶的取观测到的最大值。
+    """
+
+    BOUNDS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        ms = seconds * 1000
+        index = len(self.BOUNDS_MS)
+        for i, bound in enumerate(self.BOUNDS_MS):
+            if ms <= bound:
+                index = i
+                break
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.total_ms += ms
+            self.max_ms = max(self.max_ms, ms)
+
+    def _percentile(self, fraction):
+        if self.count == 0:
+            return None
+        threshold = fraction * self.count
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            cumulative += count
+            if cumulative >= threshold:
+                return min(self.BOUNDS_MS[i], self.max_ms) if i < len(self.BOUNDS_MS) else self.max_ms
+        return self.max_ms
+
+    def snapshot(self):
+        with self._lock:
+            buckets = {f"<={bound}ms": count for bound, count in zip(self.BOUNDS_MS, self.counts)}
+            buckets[f">{self.BOUNDS_MS[-1]}ms"] = self.counts[-1]
+            return {
+                "count": self.count,
+                "mean_ms": self.total_ms / self.count if self.count else None,
+                "max_ms": self.max_ms,
+                "p50_ms": self._percentile(0.50),
+                "p90_ms": self._percentile(0.90),
+                "p99_ms": self._percentile(0.99),
+                "buckets": buckets,
+            }
+
+
+# ---- 工作进程 ----
+
+_worker_state = None
+
+
+def _init_worker(templates_dir):
+    """工作进程初始化：扫描字体并预热模板"""
+    global _worker_state
+    _, font_name_to_path = watermark_core.scan_system_fonts()
+    _worker_state = {
+        "templates_dir": templates_dir,
+        "font_name_to_path": font_name_to_path,
+        "templates": {},  # 模板名 -> (文件修改时间, 设置)
+    }
+    warm = Image.new('RGB', (64, 64), (128, 128, 128))
+    for name in list_template_names(templates_dir):
+        try:
+            settings = _get_template(name)
+            if watermark_core.has_watermark(settings):
+                watermark_core.add_watermark_to_image(warm.copy(), settings, font_name_to_path=font_name_to_path)
+        except Exception as e:
+            print(f"预热模板 {name} 时出错: {e}")
+
+
+def list_template_names(templates_dir):
+    """模板目录中所有模板的名称"""
+    names = []
+    try:
+        files = sorted(os.listdir(templates_dir))
+    except OSError:
+        return names
+    for file in files:
+        if file.startswith("template_") and file.endswith(".json"):
+            try:
+                with open(os.path.join(templates_dir, file), 'r', encoding='utf-8') as f:
+                    names.append(json.load(f).get("name") or file[len("template_"):-len(".json")])
+            except Exception as e:
+                print(f"读取模板 {file} 时出错: {e}")
+    return names
+
+
+def _get_template(name):
+    """按名称取得模板设置（文件修改后重新加载）"""
+    templates_dir = _worker_state["templates_dir"]
+    path = watermark_core.get_template_path(templates_dir, name)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        raise TemplateNotFound(name)
+    cached = _worker_state["templates"].get(name)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    settings = watermark_core.load_template_settings(templates_dir, name)
+    settings.pop("name", None)
+    settings = watermark_core.normalize_settings(settings)
+    _worker_state["templates"][name] = (mtime, settings)
+    return settings
+
+
+def watermark_request(data, template_name, export_format=None, quality=None):
+    """在工作进程中处理一个请求，返回 (编码后的图片, 导出格式, 处理秒数)"""
+    start = time.perf_counter()
+    settings = _get_template(template_name)
+    if export_format or quality is not None:
+        settings = dict(settings)
+        if export_format:
+            settings["export_format"] = export_format
+        if quality is not None:
+            settings["export_quality"] = quality
+    image, source_encoding = watermark_core.load_source(io.BytesIO(data))
+    if watermark_core.has_watermark(settings):
+        # 请求中没有文件名和序号，文本变量只能按上传图片的EXIF填写
+        text_context = watermark_core.get_text_context(image=image) if watermark_core.has_text_tokens(settings) else None
+        image = watermark_core.add_watermark_to_image(
+            image, settings, font_name_to_path=_worker_state["font_name_to_path"], text_context=text_context
+        )
+    output = watermark_core.encode_image(image, settings, source_encoding)
+    return output, settings["export_format"], time.perf_counter() - start
+
+
+# ---- 服务进程 ----
+
+class WatermarkService:
+    """工作进程池、排队上限与统计"""
+
+    def __init__(self, templates_dir=DEFAULT_TEMPLATES_DIR, workers=None, max_queue=None,
+                 request_timeout=DEFAULT_REQUEST_TIMEOUT):
+        self.workers = max(1, workers or default_worker_count())
+        if max_queue is None:
+            max_queue = self.workers * DEFAULT_QUEUE_PER_WORKER
+        self.max_in_flight = self.workers + max(0, max_queue)
+        self.request_timeout = request_timeout
+        self.templates_dir = templates_dir
+        # multiprocessing.Pool 启动时即创建全部工作进程，各自在初始化时扫描字体、预热模板
+        self.pool = multiprocessing.Pool(self.workers, _init_worker, (templates_dir,))
+        self._slots = threading.BoundedSemaphore(self.max_in_flight)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.counters = {"ok": 0, "rejected": 0, "client_errors": 0, "server_errors": 0}
+        self.latency = LatencyHistogram()  # 从收到请求到返回（含排队）
+        self.processing = LatencyHistogram()  # 工作进程内的处理时间
+        self.start_time = time.time()
+
+    def watermark(self, data, template_name, export_format=None, quality=None):
+        """添加水印，返回 (编码后的图片, 导出格式)；队列已满时抛出 QueueFull
+
+        名额在工作进程处理完成时才释放：超时（504）的请求仍在进程池中排队或处理，
+        提前释放会让积压超过 max_in_flight。
+        """
+        if not self._slots.acquire(blocking=False):
+            raise QueueFull()
+        with self._lock:
+            self.in_flight += 1
+        try:
+            async_result = self.pool.apply_async(
+                watermark_request, (data, template_name, export_format, quality),
+                callback=self._on_request_done, error_callback=self._on_request_failed,
+            )
+        except BaseException:
+            self._release_slot()
+            raise
+        output, output_format, _ = async_result.get(self.request_timeout)
+        return output, output_format
+
+    def _on_request_done(self, result):
+        """工作进程处理完成（在进程池的结果线程中调用）"""
+        self.processing.record(result[2])
+        self._release_slot()
+
+    def _on_request_failed(self, error):
+        self._release_slot()
+
+    def _release_slot(self):
+        with self._lock:
+            self.in_flight -= 1
+        self._slots.release()
+
+    def count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self.counters)
+            in_flight = self.in_flight
+        return {
+            "workers": self.workers,
+            "max_in_flight": self.max_in_flight,
+            "in_flight": in_flight,
+            "uptime": time.time() - self.start_time,
+            "requests": counters,
+            "latency": self.latency.snapshot(),
+            "processing": self.processing.snapshot(),
+        }
+
+    def close(self):
+        self.pool.terminate()
+        self.pool.join()
+
+
+class WatermarkRequestHandler(BaseHTTPRequestHandler):
+    """HTTP请求处理（每个连接一个线程，实际处理交给工作进程池）"""
+
+    protocol_version = "HTTP/1.1"  # 支持长连接
+    server_version = "WatermarkService/1.0"
+
+    @property
+    def service(self):
+        return self.server.service
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send(self, status, body, content_type="application/json", headers=None):
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _error(self, status, message, counter="client_errors", headers=None):
+        self.service.count(counter)
+        self._send(status, {"error": message}, headers=headers)
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == "/health":
+            self._send(200, {"status": "ok", "workers": self.service.workers})
+        elif path == "/stats":
+            self._send(200, self.service.stats())
+        else:
+            self._send(404, {"error": "未知的路径"})
+
+    def do_POST(self):
+        start = time.perf_counter()
+        url = urlparse(self.path)
+        if url.path != "/watermark":
+            self._send(404, {"error": "未知的路径"})
+            return
+        query = parse_qs(url.query)
+        template_name = query.get("template", [None])[0]
+        export_format = (query.get("format", [None])[0] or "").upper() or None
+        quality = query.get("quality", [None])[0]
+
+        length = self.headers.get("Content-Length")
+        if length is None:
+            self._error(411, "缺少 Content-Length")
+            return
+        try:
+            length = int(length)
+            if length < 0:
+                raise ValueError
+        except ValueError:
+            # 无法确定请求体的边界，不能继续使用这个连接
+            self.close_connection = True
+            self._error(400, "Content-Length 无效")
+            return
+        if length > self.server.max_request_bytes:
+            # 不读取请求体，关闭连接
+            self.close_connection = True
+            self._error(413, "请求体过大")
+            return
+        data = self.rfile.read(length)
+
+        if not template_name:
+            self._error(400, "缺少 template 参数")
+            return
+        if export_format is not None and export_format not in CONTENT_TYPES:
+            self._error(400, f"不支持的导出格式: {export_format}")
+            return
+        if quality is not None:
+            try:
+                quality = int(quality)
+                if not 1 <= quality <= 100:
+                    raise ValueError
+            except ValueError:
+                self._error(400, "quality 应在 1-100 之间")
+                return
+
+        try:
+            output, output_format = self.service.watermark(data, template_name, export_format, quality)
+        except QueueFull:
+            self._error(503, "服务繁忙", counter="rejected", headers={"Retry-After": "1"})
+            return
+        except TemplateNotFound:
+            self._error(404, f"模板不存在: {template_name}")
+            return
+        except (UnidentifiedImageError, Image.DecompressionBombError, OSError):
+            # 截断或损坏的图片在解码时抛出 OSError
+            self._error(400, "无法解码图片")
+            return
+        except multiprocessing.TimeoutError:
+            self._error(504, "处理超时", counter="server_errors")
+            return
+        except Exception as e:
+            print(f"处理请求时出错: {e}")
+            self._error(500, str(e), counter="server_errors")
+            return
+
+        self.service.count("ok")
+        self.service.latency.record(time.perf_counter() - start)
+        self._send(200, output, content_type=CONTENT_TYPES.get(output_format, "application/octet-stream"))
+
+
+def create_server(service, host=DEFAULT_HOST, port=DEFAULT_PORT, max_request_mb=DEFAULT_MAX_REQUEST_MB, verbose=False):
+    """创建HTTP服务器（调用 serve_forever 开始服务）"""
+    server = ThreadingHTTPServer((host, port), WatermarkRequestHandler)
+    server.daemon_threads = True
+    server.service = service
+    server.max_request_bytes = max_request_mb * 1024 * 1024
+    server.verbose = verbose
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='本地HTTP水印服务')
+    parser.add_argument('--host', default=DEFAULT_HOST, help='监听地址（默认只接受本机连接）')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='监听端口')
+    parser.add_argument('--workers', type=int, default=default_worker_count(), help='工作进程数（默认CPU核心数）')
+    parser.add_argument('--max-queue', type=int, help=f'排队请求数上限（默认每个工作进程 {DEFAULT_QUEUE_PER_WORKER} 个）')
+    parser.add_argument('--templates-dir', default=DEFAULT_TEMPLATES_DIR, help='模板目录')
+    parser.add_argument('--timeout', type=float, default=DEFAULT_REQUEST_TIMEOUT, help='单个请求的处理超时（秒）')
+    parser.add_argument('--max-request-mb', type=int, default=DEFAULT_MAX_REQUEST_MB, help='请求体大小上限（MB）')
+    parser.add_argument('--verbose', action='store_true', help='输出每个请求的日志')
+    args = parser.parse_args(argv)
+
+    service = WatermarkService(args.templates_dir, args.workers, args.max_queue, args.timeout)
+    try:
+        server = create_server(service, args.host, args.port, args.max_request_mb, args.verbose)
+    except OSError as e:
+        service.close()
+        print(f"启动服务时出错: {e}", file=sys.stderr)
+        return 1
+    def stop(signum, frame):
+        raise KeyboardInterrupt
+    if hasattr(signal, 'SIGTERM'):
+        signal.signal(signal.SIGTERM, stop)
+    print(f"水印服务已启动：http://{args.host}:{server.server_address[1]}  工作进程 {service.workers} 个", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+    return 0
+
+
+if __name__ == '__main__':
+    multiprocessing.freeze_support()
+    sys.exit(main())
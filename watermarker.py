@@ -0,0 +1,205 @@
+"""供其他Python程序调用的水印接口（不依赖Qt，NumPy 为可选依赖）
+
+已经持有解码后图片（PIL 图片或 NumPy 数组）的流水线可以直接调用，不必写入磁盘再驱动界面：
+
+    from watermarker import Watermarker
+
+    marker = Watermarker.from_template("默认")          # 或 Watermarker({"watermark_text": "..."})
+    image = marker.apply(pil_image)                     # 返回添加水印后的新图片
+    array = marker.apply_array(ndarray)                 # HxWx3 / HxWx4 / HxW 的 uint8 数组
+    marker.apply_array(rgba_array, inplace=True)        # RGBA 连续数组直接在原内存上绘制，不复制
+    for image in marker.apply_iter(paths, workers=4):   # 按输入顺序逐个产出结果
+        ...
+
+水印文本中可以使用 {filename}、{index}、{exif_date} 等变量（见 watermark_core.TEXT_TOKENS），
+处理文件时按文件名、序号和EXIF填写，直接传入图片时可以用 text_context 提供变量的值。
+
+同一个 Watermarker 在多次调用之间复用字体（每个线程缓存一份）和缩放好的水印图片。
+"""
+import os
+import json
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+import watermark_core
+from watermark_core import DEFAULT_TEMPLATES_DIR
+
+# Pillow 是否能直接写入 frombuffer 映射的数组内存（第一次就地处理时检测）
+_frombuffer_writable = None
+
+
+def frombuffer_writes_through():
+    """检测把 frombuffer 图片的 readonly 置0后，绘制是否直接写入原数组
+
+    这依赖 Pillow 未公开的内部行为：不同版本可能改为写入时复制，甚至不再允许修改 readonly，
+    所以不按版本号判断，而是用一个小数组实际试一次，不能写入时 apply_array 改为复制后写回。
+    """
+    global _frombuffer_writable
+    if _frombuffer_writable is None:
+        import numpy as np
+
+        array = np.zeros((2, 2, 4), dtype=np.uint8)
+        try:
+            image = Image.frombuffer('RGBA', (2, 2), array, 'raw', 'RGBA', 0, 1)
+            image.readonly = 0
+            image.paste((1, 2, 3, 4), (0, 0, 2, 2))
+            _frombuffer_writable = bool((array == (1, 2, 3, 4)).all())
+        except Exception:
+            _frombuffer_writable = False
+    return _frombuffer_writable
+
+
+class Watermarker:
+    """按一组水印设置给图片添加水印，可重复使用（线程安全）"""
+
+    def __init__(self, settings=None, font_name_to_path=None):
+        settings = dict(settings or {})
+        settings.pop("name", None)
+        self.settings = watermark_core.normalize_settings(settings)
+        if font_name_to_path is None and self._needs_fonts():
+            # 模板中的字体按显示名称保存，需要系统字体映射才能找到文件
+            _, font_name_to_path = watermark_core.scan_system_fonts()
+        self.font_name_to_path = font_name_to_path
+
+    @classmethod
+    def from_template(cls, template_name, templates_dir=DEFAULT_TEMPLATES_DIR, font_name_to_path=None):
+        """按名称读取程序保存的模板"""
+        return cls(watermark_core.load_template_settings(templates_dir, template_name), font_name_to_path)
+
+    @classmethod
+    def from_template_file(cls, template_path, font_name_to_path=None):
+        """读取模板JSON文件"""
+        with open(template_path, 'r', encoding='utf-8') as f:
+            return cls(json.load(f), font_name_to_path)
+
+    def _needs_fonts(self):
+        return watermark_core.needs_fonts(self.settings)
+
+    def _render(self, image, text_context=None):
+        """在图片上就地绘制水印"""
+        if watermark_core.has_watermark(self.settings):
+            image = watermark_core.add_watermark_to_image(image, self.settings, font_name_to_path=self.font_name_to_path,
+                                                          text_context=text_context)
+        return image
+
+    def apply(self, image, copy=True, text_context=None):
+        """给PIL图片添加水印，返回结果
+
+        copy 为 False 时直接在传入的图片上绘制（RGB/RGBA 图片）；其他模式的图片总是先转换。
+        text_context 为文本变量的值（字典），不提供时变量按图片自带的EXIF填写。
+        """
+        if text_context is None and watermark_core.has_text_tokens(self.settings):
+            text_context = watermark_core.get_text_context(image=image)
+        if image.mode not in ('RGB', 'RGBA'):
+            has_alpha = image.mode in ('LA', 'PA') or 'transparency' in image.info
+            image = image.convert('RGBA' if has_alpha else 'RGB')
+        elif copy:
+            image = image.copy()
+        return self._render(image, text_context)
+
+    def apply_array(self, array, inplace=False):
+        """给 uint8 的NumPy数组（HxW 灰度、HxWx3 RGB 或 HxWx4 RGBA）添加水印，返回数组
+
+        inplace 为 True 且数组是C连续、可写的 RGBA 时，直接把数组内存包装为图片绘制，不复制像素
+        （当前的 Pillow 不支持直接写入时退化为复制后写回，见 frombuffer_writes_through）；
+        RGB 数组在 Pillow 中按每像素4字节存储，无法直接包装，会复制一次后再写回原数组。
+        灰度数组的结果是 HxWx3 的新数组（水印颜色需要彩色通道），不能就地修改。
+        """
+        import numpy as np
+
+        if array.dtype != np.uint8:
+            raise ValueError(f"只支持 uint8 数组，实际为 {array.dtype}")
+        if array.ndim == 2:
+            if inplace:
+                raise ValueError("灰度数组不能就地添加水印")
+            return np.array(self._render(Image.fromarray(array, 'L').convert('RGB')))
+        if array.ndim != 3 or array.shape[2] not in (3, 4):
+            raise ValueError(f"不支持的数组形状: {array.shape}")
+
+        mode = 'RGBA' if array.shape[2] == 4 else 'RGB'
+        height, width = array.shape[:2]
+        if (inplace and mode == 'RGBA' and array.flags['C_CONTIGUOUS'] and array.flags['WRITEABLE']
+                and frombuffer_writes_through()):
+            image = Image.frombuffer(mode, (width, height), array, 'raw', mode, 0, 1)
+            # frombuffer 映射的图片默认只读（绘制时会复制），数组可写时允许直接写入
+            image.readonly = 0
+            rendered = self._render(image)
+            if rendered is not image:
+                # 渲染返回了新图片（没有在原内存上绘制），写回数组
+                array[...] = np.asarray(rendered)
+            return array
+
+        result = np.array(self._render(Image.fromarray(np.ascontiguousarray(array), mode)))
+        if inplace:
+            array[...] = result
+            return array
+        return result
+
+    def apply_file(self, path, index=None):
+        """加载图片文件并添加水印，返回 (图片, JPEG编码参数或None)；编码参数可传给 encode
+
+        index 为填写 {index} 变量的序号。
+        """
+        image, source_encoding = watermark_core.load_source(path)
+        text_context = None
+        if watermark_core.has_text_tokens(self.settings):
+            text_context = watermark_core.get_text_context(path, index, image)
+        return self.apply(image, copy=False, text_context=text_context), source_encoding
+
+    def encode(self, image, source_encoding=None):
+        """按设置中的导出格式和质量把图片编码为字节串"""
+        return watermark_core.encode_image(image, self.settings, source_encoding)
+
+    def _apply_item(self, item, index=None):
+        if isinstance(item, Image.Image):
+            return self.apply(item, text_context=self._item_context(index))
+        if isinstance(item, (str, bytes, os.PathLike)):
+            return self.apply_file(item, index)[0]
+        # 其余按NumPy数组处理
+        return self.apply_array(item)
+
+    def apply_iter(self, items, workers=1, on_error=None):
+        """逐个处理图片路径、PIL图片或NumPy数组，按输入顺序产出结果（路径产出PIL图片）
+
+        输入可以是惰性的迭代器，不会一次全部读入内存；workers 大于1时用线程池同时处理，
+        最多提前处理 2*workers 个。on_error(输入, 异常) 提供时出错的项目调用它后跳过，否则抛出异常。
+        {index} 变量按输入顺序从1开始编号。
+        """
+        def handle_error(item, error):
+            if on_error is None:
+                raise error
+            on_error(item, error)
+
+        if workers <= 1:
+            for index, item in enumerate(items, 1):
+                try:
+                    result = self._apply_item(item, index)
+                except Exception as e:
+                    handle_error(item, e)
+                    continue
+                yield result
+            return
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+            iterator = enumerate(items, 1)
+            exhausted = False
+            while True:
+                while not exhausted and len(pending) < workers * 2:
+                    try:
+                        index, item = next(iterator)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    pending.append((item, executor.submit(self._apply_item, item, index)))
+                if not pending:
+                    break
+                item, future = pending.popleft()
+                try:
+                    result = future.result()
+                except Exception as e:
+                    handle_error(item, e)
+                    continue
+                yield result
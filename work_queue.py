@@ -0,0 +1,344 @@
+"""共享文件系统上的批量导出工作队列
+
+多台机器（或同一台机器上的多个进程）挂载同一个任务目录后，各自运行无界面的工作进程领取任务。
+任务目录结构：
+
+    job.json      任务参数（水印设置、输出目录、多规格配置等）
+    todo/         待处理的图片，每张一个文件
+    claimed/      已被领取、正在处理的图片（文件名为 图片~领取标识.json，文件修改时间即租约心跳）
+    done/         已完成
+    failed/       处理失败（文件内容包含错误信息）
+
+领取通过原子重命名 todo/x.json -> claimed/x~领取标识.json 完成，只有一个进程能成功；领取标识由工作进程标识
+和每次领取不同的随机数组成，之后对这次领取的刷新、完成和收回都按这个文件名进行，
+不会误动同一张图片之后被其他进程重新领取的文件。处理期间工作进程定期刷新 claimed 文件的修改时间；
+超过租约时间未刷新的文件（进程已退出或机器宕机）会被任意工作进程先改名为自己的领取标识（只有一个进程能成功），
+确认仍然过期后移回 todo/ 重新分配。租约时间按文件服务器的时钟计算（刷新任务目录中的探测文件，以它的修改时间
+作为当前时间），各机器的时钟不一致也不会误收或漏收租约。
+输出文件与 generate_output_filename 的命名规则一致，并以原子重命名写入。
+
+用法：
+    python work_queue.py enqueue --job-dir DIR --output OUT [--template T.json] 图片或通配符 ...
+    python work_queue.py worker --job-dir DIR [--max-items N]
+    python work_queue.py status --job-dir DIR
+"""
+import os
+import sys
+import json
+import glob
+import time
+import uuid
+import socket
+import random
+import argparse
+import threading
+
+import watermark_core
+from batch_export import BatchExporter, BatchResult
+
+JOB_FILENAME = "job.json"
+QUEUE_DIRS = ("todo", "claimed", "done", "failed")
+DEFAULT_LEASE_SECONDS = 300
+# claimed/ 中文件名里图片名与领取标识的分隔符（工作进程标识中的这个字符会被替换）
+CLAIM_SEPARATOR = "~"
+
+
+def _write_json_atomic(path, data):
+    """写入JSON文件（临时文件 + 原子重命名）"""
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(temp_path, path)
+
+
+def create_job(job_dir, image_paths, settings, export_dir, renditions=None, templates_dir=None,
+               lease_seconds=DEFAULT_LEASE_SECONDS):
+    """创建任务目录并把图片加入待处理队列，返回入队数量
+
+    任务目录中已有任务时抛出 ValueError：重复入队会让已领取或已完成的图片被再次处理。
+    """
+    if os.path.exists(os.path.join(job_dir, JOB_FILENAME)) or any(job_status(job_dir).values()):
+        raise ValueError(f"任务目录中已有任务: {job_dir}")
+    for name in QUEUE_DIRS:
+        os.makedirs(os.path.join(job_dir, name), exist_ok=True)
+    _write_json_atomic(os.path.join(job_dir, JOB_FILENAME), {
+        "settings": watermark_core.normalize_settings(settings),
+        "export_dir": os.path.abspath(export_dir),
+        "renditions": renditions,
+        "templates_dir": templates_dir,
+        "lease_seconds": lease_seconds,
+    })
+    todo_dir = os.path.join(job_dir, "todo")
+    for index, input_path in enumerate(image_paths):
+        _write_json_atomic(os.path.join(todo_dir, f"{index:09d}.json"), {
+            "index": index,
+            "input": os.path.abspath(input_path),
+        })
+    return len(image_paths)
+
+
+def _claimed_name(item_name, owner):
+    """领取后在 claimed/ 中的文件名"""
+    return f"{item_name[:-len('.json')]}{CLAIM_SEPARATOR}{owner}.json"
+
+
+def _item_name(claimed_name):
+    """claimed/ 中的文件名对应的图片名（todo/、done/、failed/ 中的文件名）"""
+    if CLAIM_SEPARATOR not in claimed_name:
+        return claimed_name
+    return claimed_name.split(CLAIM_SEPARATOR, 1)[0] + ".json"
+
+
+def job_status(job_dir):
+    """统计队列中各状态的数量"""
+    status = {}
+    for name in QUEUE_DIRS:
+        try:
+            status[name] = sum(1 for item in os.listdir(os.path.join(job_dir, name)) if item.endswith(".json"))
+        except OSError:
+            status[name] = 0
+    return status
+
+
+class QueueWorker:
+    """从任务目录领取并处理图片的工作进程"""
+
+    def __init__(self, job_dir, worker_id=None, font_name_to_path=None):
+        self.job_dir = job_dir
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        with open(os.path.join(job_dir, JOB_FILENAME), 'r', encoding='utf-8') as f:
+            self.job = json.load(f)
+        self.lease_seconds = self.job.get("lease_seconds", DEFAULT_LEASE_SECONDS)
+        if font_name_to_path is None:
+            _, font_name_to_path = watermark_core.scan_system_fonts()
+        # 多个进程同时写同一目录，不使用导出清单
+        self.exporter = BatchExporter(
+            self.job["settings"], self.job["export_dir"], font_name_to_path,
+            renditions=self.job.get("renditions"), templates_dir=self.job.get("templates_dir"),
+            use_manifest=False
+        )
+        self._candidates = []
+        self._safe_id = "".join(c if c.isalnum() or c in "-_." else "_" for c in self.worker_id)
+        # 读取文件服务器时钟用的探测文件（每个工作进程一个，避免互相争用）
+        self._clock_path = os.path.join(job_dir, ".clock-" + self._safe_id)
+
+    def _path(self, state, name):
+        return os.path.join(self.job_dir, state, name)
+
+    def _owner(self):
+        """一次领取（或收回）的标识：工作进程标识加随机数，每次都不同"""
+        return f"{self._safe_id}-{uuid.uuid4().hex[:12]}"
+
+    def server_time(self):
+        """文件服务器的当前时间：刷新探测文件，返回它的修改时间
+
+        租约心跳用 os.utime 刷新修改时间，由文件服务器记录时间；与本机的 time.time() 比较时，
+        机器之间的时钟偏差会导致误收仍然有效的租约或永不收回过期的租约。
+        """
+        try:
+            os.utime(self._clock_path)
+        except FileNotFoundError:
+            with open(self._clock_path, 'a'):
+                pass
+        return os.stat(self._clock_path).st_mtime
+
+    def reap_expired(self):
+        """把租约过期的任务移回待处理队列，返回数量"""
+        reaped = 0
+        try:
+            now = self.server_time()
+        except OSError as e:
+            print(f"读取文件服务器时间时出错: {e}")
+            return 0
+        try:
+            names = os.listdir(os.path.join(self.job_dir, "claimed"))
+        except OSError:
+            return 0
+        for name in names:
+            if not name.endswith(".json"):
+                continue
+            claimed_path = self._path("claimed", name)
+            item_name = _item_name(name)
+            reaping_path = self._path("claimed", _claimed_name(item_name, self._owner()))
+            try:
+                if now - os.stat(claimed_path).st_mtime < self.lease_seconds:
+                    continue
+                # 先改名为自己的领取标识：只有一个进程能成功，原来的工作进程也无法再完成或刷新这次领取
+                os.rename(claimed_path, reaping_path)
+            except OSError:
+                # 其他进程已经收回，或原来的工作进程已经完成
+                continue
+            try:
+                if now - os.stat(reaping_path).st_mtime < self.lease_seconds:
+                    # 检查与改名之间租约被刷新了，还给原来的工作进程
+                    os.rename(reaping_path, claimed_path)
+                    continue
+                os.rename(reaping_path, self._path("todo", item_name))
+                reaped += 1
+            except OSError as e:
+                print(f"收回过期的任务 {name} 时出错: {e}")
+        return reaped
+
+    def claim(self):
+        """领取一张待处理的图片，返回在 claimed/ 中的文件名（队列为空时返回None）"""
+        for attempt in range(2):
+            if not self._candidates:
+                # 目录列表代价较高，一次读取后打乱顺序逐个尝试，减少与其他进程冲突
+                try:
+                    self._candidates = [n for n in os.listdir(os.path.join(self.job_dir, "todo")) if n.endswith(".json")]
+                except OSError:
+                    self._candidates = []
+                random.shuffle(self._candidates)
+            while self._candidates:
+                item_name = self._candidates.pop()
+                name = _claimed_name(item_name, self._owner())
+                try:
+                    os.rename(self._path("todo", item_name), self._path("claimed", name))
+                    # 重命名不会更新修改时间，立即刷新租约
+                    os.utime(self._path("claimed", name))
+                except OSError:
+                    # 已被其他进程领取（或刚领取就被收回）
+                    continue
+                return name
+        return None
+
+    def _heartbeat(self, name, stop_event):
+        """处理期间定期刷新租约"""
+        interval = max(1.0, self.lease_seconds / 3.0)
+        while not stop_event.wait(interval):
+            try:
+                os.utime(self._path("claimed", name))
+            except OSError:
+                # 租约已被收回，或其他进程正在确认是否过期（确认后可能还回来），下次再试
+                continue
+
+    def process(self, name, result):
+        """处理一张已领取的图片，返回是否完成（领取已被收回时跳过或放弃结果，返回 False）"""
+        try:
+            with open(self._path("claimed", name), 'r', encoding='utf-8') as f:
+                item = json.load(f)
+        except FileNotFoundError:
+            # 领取后租约就被收回了，交给重新领取的进程处理
+            return False
+        stop_event = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(name, stop_event), daemon=True)
+        heartbeat.start()
+        failed_before = len(result.failed)
+        try:
+            try:
+                self.exporter.export_one(item["input"], result, index=item["index"] + 1)
+            except Exception as e:
+                result.failed.append((item["input"], str(e)))
+        finally:
+            stop_event.set()
+            heartbeat.join()
+
+        # 按这次领取的文件名移动：租约过期后被收回（可能已被其他进程重新领取）时重命名失败，不会移动别人的领取；
+        # 输出文件是原子写入的，重复处理结果相同
+        item_name = _item_name(name)
+        failed = len(result.failed) > failed_before
+        try:
+            os.rename(self._path("claimed", name), self._path("failed" if failed else "done", item_name))
+        except OSError:
+            return False
+        if failed:
+            item["error"] = result.failed[-1][1]
+            item["worker"] = self.worker_id
+            try:
+                _write_json_atomic(self._path("failed", item_name), item)
+            except OSError as e:
+                print(f"记录失败原因时出错: {e}")
+        return True
+
+    def run(self, max_items=None, poll_interval=1.0, wait_for_leases=True):
+        """循环领取并处理图片，直到队列为空，返回 BatchResult"""
+        result = BatchResult()
+        processed = 0
+        try:
+            while max_items is None or processed < max_items:
+                self.reap_expired()
+                name = self.claim()
+                if name is None:
+                    # 仍有其他进程在处理时等待，以便接手过期的租约
+                    if wait_for_leases and job_status(self.job_dir)["claimed"] > 0:
+                        time.sleep(poll_interval)
+                        continue
+                    break
+                self.process(name, result)
+                processed += 1
+        finally:
+            try:
+                os.remove(self._clock_path)
+            except OSError:
+                pass
+        return result
+
+
+def expand_inputs(patterns):
+    """展开输入路径、通配符和文件夹，返回支持格式的图片列表（保持顺序、去重）"""
+    paths = []
+    seen = set()
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern, recursive=True)) if glob.has_magic(pattern) else [pattern]
+        for match in matches:
+            if os.path.isdir(match):
+                candidates = []
+                for root, _, files in os.walk(match):
+                    candidates.extend(os.path.join(root, f) for f in sorted(files))
+            else:
+                candidates = [match]
+            for path in candidates:
+                if os.path.splitext(path)[1].lower() in watermark_core.SUPPORTED_EXTENSIONS and path not in seen:
+                    seen.add(path)
+                    paths.append(path)
+    return paths
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='共享文件系统上的批量导出工作队列')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    enqueue_parser = subparsers.add_parser('enqueue', help='创建任务并加入待处理图片')
+    enqueue_parser.add_argument('--job-dir', required=True, help='任务目录（所有工作进程都能访问）')
+    enqueue_parser.add_argument('--output', required=True, help='输出目录')
+    enqueue_parser.add_argument('--template', help='模板JSON文件（与程序保存的模板格式相同）')
+    enqueue_parser.add_argument('--lease', type=int, default=DEFAULT_LEASE_SECONDS, help='租约时间（秒）')
+    enqueue_parser.add_argument('inputs', nargs='+', help='图片路径、通配符或文件夹')
+
+    worker_parser = subparsers.add_parser('worker', help='运行工作进程')
+    worker_parser.add_argument('--job-dir', required=True)
+    worker_parser.add_argument('--worker-id', help='工作进程标识（默认 主机名-进程号）')
+    worker_parser.add_argument('--max-items', type=int, help='最多处理的图片数')
+
+    status_parser = subparsers.add_parser('status', help='查看队列状态')
+    status_parser.add_argument('--job-dir', required=True)
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'enqueue':
+        settings = {}
+        if args.template:
+            with open(args.template, 'r', encoding='utf-8') as f:
+                settings = json.load(f)
+        try:
+            count = create_job(args.job_dir, expand_inputs(args.inputs), settings, args.output, lease_seconds=args.lease)
+        except ValueError as e:
+            print(json.dumps({"error": str(e)}, ensure_ascii=False))
+            return 2
+        print(json.dumps({"enqueued": count}))
+    elif args.command == 'worker':
+        worker = QueueWorker(args.job_dir, args.worker_id)
+        result = worker.run(max_items=args.max_items)
+        print(json.dumps({
+            "worker": worker.worker_id,
+            "rendered": len(result.rendered),
+            "failed": len(result.failed),
+        }, ensure_ascii=False))
+        return 1 if result.failed else 0
+    else:
+        print(json.dumps(job_status(args.job_dir)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())